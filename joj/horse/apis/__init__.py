@@ -12,6 +12,7 @@ from joj.horse.apis import (
     problems as problems,
     records as records,
     users as users,
+    webhooks as webhooks,
 )
 from joj.horse.apis.auth import login
 from joj.horse.apis.problem_configs import update_problem_config_by_archive
@@ -31,6 +32,7 @@ modules: List[Any] = [
     auth,
     admin,
     judge,
+    webhooks,
     misc,
 ]
 for module in modules:
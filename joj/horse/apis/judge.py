@@ -1,5 +1,6 @@
 from copy import deepcopy
 from enum import Enum
+from typing import Optional
 
 from fastapi import Depends
 from loguru import logger
@@ -9,9 +10,14 @@ from starlette.concurrency import run_in_threadpool
 from joj.horse import models, schemas
 from joj.horse.schemas.base import Empty, NoneNegativeInt, StandardResponse
 from joj.horse.schemas.permission import Permission
-from joj.horse.services.lakefs import LakeFSProblemConfig, LakeFSRecord
+from joj.horse.services.lakefs import (
+    RECORD_BUNDLE_NAME,
+    LakeFSProblemConfig,
+    LakeFSRecord,
+)
 from joj.horse.utils.errors import BizError, ErrorCode
 from joj.horse.utils.fastapi.router import APIRouter
+from joj.horse.utils.idempotency import Idempotency, parse_idempotency_key
 from joj.horse.utils.lock import lock_record_judger
 from joj.horse.utils.parser import parse_record_judger, parse_user_from_auth
 
@@ -44,6 +50,9 @@ async def claim_record_by_judger(
     # we always reset the state to "fetched", for both first attempt and retries
     record.judger_id = user.id
     record.state = schemas.RecordState.fetched
+    await record.save_model()
+    # invalidate after the save, or a concurrent read may cache the old state
+    await record.invalidate_user_latest_record()
 
     # initialize the permission of the judger to lakefs
     # the user have read access to all problems in the problem group,
@@ -67,7 +76,20 @@ async def claim_record_by_judger(
         problem_config_commit_id=record.problem_config.commit_id,
         record_repo_name=lakefs_record.repo_name,
         record_commit_id=record.commit_id,
+        record_bundle_path=RECORD_BUNDLE_NAME if record.bundled else None,
     )
+    bundle_digest = record.problem_config.bundle_digest
+    if bundle_digest is None:
+        # build the missing bundle for the next judgers, e.g., a failed build
+        record.problem_config.schedule_bundle(record.problem)
+    else:
+        # the judger warms its cache with one download instead of listing lakefs
+        manifest_url, bundle_url = lakefs_problem_config.get_bundle_presigned_urls(
+            bundle_digest
+        )
+        judger_credentials.problem_config_bundle_digest = bundle_digest
+        judger_credentials.problem_config_manifest_url = manifest_url
+        judger_credentials.problem_config_bundle_url = bundle_url
     return StandardResponse(judger_credentials)
 
 
@@ -79,13 +101,18 @@ async def claim_record_by_judger(
 async def submit_record_by_judger(
     record_result: schemas.RecordSubmit = Depends(schemas.RecordSubmit.edit_dependency),
     record: models.Record = Depends(parse_record_judger),
+    idempotency: Optional[Idempotency] = Depends(parse_idempotency_key),
 ) -> StandardResponse[Empty]:
     # TODO: check current record state
     # if record.state != schemas.RecordState.fetched:
     #     raise BizError(ErrorCode.Error)
     record.update_from_dict(record_result.dict())
     await record.save_model()
-    return StandardResponse()
+    await record.finish_judge()
+    response = StandardResponse()
+    if idempotency is not None:
+        await idempotency.save(response)
+    return response
 
 
 @router.put(
@@ -100,6 +127,7 @@ async def submit_case_by_judger(
     ),
     record: models.Record = Depends(parse_record_judger),
     user: schemas.User = Depends(parse_user_from_auth),
+    idempotency: Optional[Idempotency] = Depends(parse_idempotency_key),
 ) -> StandardResponse[Empty]:
     # TODO: check current record state
     # if record.state != schemas.RecordState.fetched:
@@ -127,4 +155,9 @@ async def submit_case_by_judger(
     logger.debug(
         f"{user.username} submit case {index} of record {record.id} cases after: {record.cases}"
     )
-    return StandardResponse()
+    await record.publish_case(index)
+    await record.publish_state()
+    response = StandardResponse()
+    if idempotency is not None:
+        await idempotency.save(response)
+    return response
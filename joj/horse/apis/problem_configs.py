@@ -1,22 +1,30 @@
 import io
-from pathlib import Path as PathlibPath
-from typing import Any, Optional
+from pathlib import Path as PathlibPath, PurePosixPath
+from typing import Any, Literal, Optional
 
 import orjson
-from fastapi import Depends, File, Query, UploadFile
+from fastapi import Depends, File, Path, Query, Request, UploadFile
 from fastapi.responses import StreamingResponse
+from joj.elephant.schemas import ArchiveType
 from starlette.concurrency import run_in_threadpool
 from uvicorn.config import logger
 
-from joj.elephant.schemas import ArchiveType
 from joj.horse import models, schemas
+from joj.horse.config import settings
 from joj.horse.schemas import StandardResponse
 from joj.horse.schemas.base import StandardListResponse
 from joj.horse.schemas.permission import Permission
+from joj.horse.services.archive_cache import get_archive_cache
 from joj.horse.services.lakefs import LakeFSProblemConfig
-from joj.horse.utils.base import TemporaryDirectory, iter_file
+from joj.horse.services.problem_config_cache import get_problem_config_cache
 from joj.horse.utils.errors import BizError, ErrorCode
-from joj.horse.utils.fastapi.router import APIRouter
+from joj.horse.utils.fastapi.responses import (
+    RangeFileResponse,
+    get_content_disposition,
+    get_object_response,
+    get_presigned_url_response,
+)
+from joj.horse.utils.fastapi.router import APIRouter, Version
 from joj.horse.utils.lock import lock_problem_config
 from joj.horse.utils.parser import (
     parse_ordering_query,
@@ -59,23 +67,32 @@ async def update_problem_config_by_archive(
     config_json_on_missing: schemas.ConfigMissing = schemas.ConfigMissing.raise_error,
     problem: models.Problem = Depends(parse_problem),
     user: schemas.User = Depends(parse_user_from_auth),
-) -> StandardResponse[schemas.ProblemConfigDetail]:
+) -> StandardResponse[schemas.ProblemConfigUploadDetail]:
     logger.info("problem config archive name: %s", file.filename)
 
-    def sync_func() -> None:
+    def sync_func() -> Optional[schemas.ProblemConfigFileChanges]:
         problem_config = LakeFSProblemConfig(problem)
-        problem_config.upload_problem_config_archive(
+        return problem_config.upload_problem_config_archive(
             file.filename, file.file, config_json_on_missing
         )
 
-    await run_in_threadpool(sync_func)
-    result = await models.ProblemConfig.make_commit(
-        problem=problem,
-        committer=user,
-        commit=schemas.ProblemConfigCommit(message="", data_version=2),
-    )
+    changes = await run_in_threadpool(sync_func)
+    result = None
+    if changes is not None and changes.is_empty():
+        # nothing to commit, the latest config is the same as the archive
+        result = await problem.get_latest_problem_config()
+    if result is None:
+        result = await models.ProblemConfig.make_commit(
+            problem=problem,
+            committer=user,
+            commit=schemas.ProblemConfigCommit(message="", data_version=2),
+        )
     logger.info("problem config commit: %s", result)
-    return StandardResponse(schemas.ProblemConfigDetail.from_orm(result))
+    return StandardResponse(
+        schemas.ProblemConfigUploadDetail(
+            **schemas.ProblemConfigDetail.from_orm(result).dict(), changes=changes
+        )
+    )
 
 
 @router.post(
@@ -110,44 +127,100 @@ async def update_problem_config_json(
     permissions=[Permission.DomainProblem.view_config, Permission.DomainProblem.edit],
 )
 def download_problem_config_archive(
-    temp_dir: PathlibPath = Depends(TemporaryDirectory()),
+    request: Request,
     archive_format: ArchiveType = Query(ArchiveType.zip),
+    response_type: Literal["redirect", "json"] = Query(
+        "redirect", description="How a presigned url is returned if enabled"
+    ),
     problem: models.Problem = Depends(parse_problem),
-    config: Optional[models.ProblemConfig] = Depends(parse_problem_config),
+    config: models.ProblemConfig = Depends(parse_problem_config),
 ) -> Any:
-    # use lakefs to sync and zip files
-    ref: Optional[str]
-    if config is not None:
-        ref = config.commit_id
-    else:
-        ref = None
     problem_config = LakeFSProblemConfig(problem)
-    file_path = problem_config.download_archive(temp_dir, archive_format, ref)
-    # TODO: cache the archive
-    response = StreamingResponse(iter_file(file_path))
-    # response.content_disposition = f'attachment; filename="{file_path.name}"'
-    return response
+    filename = problem_config.get_archive_filename(archive_format)
+    archive_cache = get_archive_cache()
+
+    def build_archive() -> PathlibPath:
+        # use lakefs to sync and zip files on a miss of the archive cache
+        return archive_cache.get_or_build(
+            problem_config.repo_name,
+            config.commit_id,
+            archive_format,
+            lambda temp_dir: problem_config.download_archive(
+                temp_dir, archive_format, config.commit_id
+            ),
+        )
+
+    if settings.presigned_download and settings.s3_host:
+        url = problem_config.get_archive_presigned_url(
+            archive_format, config.commit_id, build_archive
+        )
+        return get_presigned_url_response(url, response_type)
+    file_path = archive_cache.get(
+        problem_config.repo_name, config.commit_id, archive_format
+    )
+    if file_path is None and settings.archive_streaming:
+        chunks = problem_config.iter_archive(archive_format, config.commit_id)
+        return StreamingResponse(
+            archive_cache.iter_and_store(
+                problem_config.repo_name, config.commit_id, archive_format, chunks
+            ),
+            media_type="application/octet-stream",
+            headers={"content-disposition": get_content_disposition(filename)},
+        )
+    return RangeFileResponse(
+        file_path or build_archive(),
+        request,
+        filename=filename,
+        version=f"{config.commit_id}:{archive_format.value}",
+        modified_at=config.created_at,
+    )
+
+
+def get_problem_config_version(
+    config: str = Path(..., description="'latest' or id of the config"),
+    config_model: models.ProblemConfig = Depends(parse_problem_config),
+) -> Version:
+    # the content of a commit never changes, but "latest" moves to new commits
+    return Version(config_model.commit_id, immutable=config != "latest")
 
 
 @router.get(
-    "/configs/{config}/json", permissions=[Permission.DomainProblem.view_config]
+    "/configs/{config}/json",
+    permissions=[Permission.DomainProblem.view_config],
+    etag=get_problem_config_version,
 )
 async def get_problem_config_json(
     config: models.ProblemConfig = Depends(parse_problem_config),
     problem: models.Problem = Depends(parse_problem),
 ) -> StandardResponse[schemas.ProblemConfigDataDetail]:
     problem_config = LakeFSProblemConfig(problem)
-    try:
-        data = problem_config.get_config(config.commit_id)
-    except BizError as e:
-        if e.error_code != ErrorCode.FileValidationError:
-            raise e
+    data = await get_problem_config_cache().get(problem_config, config.commit_id)
     result = schemas.ProblemConfigDataDetail(
         **schemas.ProblemConfigDetail.from_orm(config).dict(), data=data
     )
     return StandardResponse(result)
 
 
+@router.get(
+    "/configs/{config}/files/{path:path}",
+    permissions=[Permission.DomainProblem.view_config],
+)
+def download_problem_config_file(
+    path: str = Path(..., description="Path of the file in the config"),
+    response_type: Literal["redirect", "json"] = Query(
+        "redirect", description="How a presigned url is returned if enabled"
+    ),
+    problem: models.Problem = Depends(parse_problem),
+    config: models.ProblemConfig = Depends(parse_problem_config),
+) -> Any:
+    problem_config = LakeFSProblemConfig(problem)
+    if settings.presigned_download:
+        url = problem_config.get_presigned_url(path, config.commit_id)
+        return get_presigned_url_response(url, response_type)
+    obj = problem_config.get_object(path, config.commit_id)
+    return get_object_response(obj, PurePosixPath(path).name)
+
+
 @router.get(
     "/configs/latest/ls",
     permissions=[Permission.DomainProblem.view_config],
@@ -1,13 +1,18 @@
+from typing import List, Optional
+
 from celery import Celery
-from fastapi import BackgroundTasks, Depends
+from fastapi import BackgroundTasks, Depends, Header, Response
 from loguru import logger
 
 from joj.horse import models, schemas
 from joj.horse.schemas import Empty, Operation, StandardListResponse, StandardResponse
 from joj.horse.schemas.auth import DomainAuthentication
-from joj.horse.schemas.permission import Permission
+from joj.horse.schemas.permission import Permission, PermissionType, ScopeType
 from joj.horse.services.celery_app import celery_app_dependency
-from joj.horse.utils.fastapi.router import APIRouter
+from joj.horse.utils.base import is_etag_matched
+from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.fastapi.router import APIRouter, Version
+from joj.horse.utils.idempotency import Idempotency, parse_idempotency_key
 from joj.horse.utils.parser import (
     parse_domain_from_auth,
     parse_ordering_query,
@@ -16,6 +21,7 @@ from joj.horse.utils.parser import (
     parse_problem_problem_set_link,
     parse_problem_set,
     parse_problem_set_factory,
+    parse_problem_set_latest_records,
     parse_problem_without_validation,
     parse_user_from_auth,
     parse_view_hidden_problem_set,
@@ -32,12 +38,15 @@ async def list_problem_sets(
     ordering: schemas.OrderingQuery = Depends(parse_ordering_query()),
     pagination: schemas.PaginationQuery = Depends(parse_pagination_query),
     include_hidden: bool = Depends(parse_view_hidden_problem_set),
-) -> StandardListResponse[schemas.ProblemSet]:
-    statement = domain.find_problem_sets_statement(include_hidden)
-    problem_sets, count = await models.ProblemSet.execute_list_statement(
+) -> StandardListResponse[schemas.ProblemSetPreview]:
+    statement = domain.find_problem_sets_statement(
+        include_hidden, schemas.ProblemSetPreview
+    )
+    rows, count = await models.ProblemSet.execute_list_statement(
         statement, ordering, pagination
     )
-    return StandardListResponse(problem_sets, count)
+    problem_sets = [schemas.ProblemSetPreview.dump_row(row) for row in rows]
+    return StandardListResponse.from_trusted(problem_sets, count)
 
 
 @router.post("", permissions=[Permission.DomainProblemSet.create])
@@ -56,19 +65,40 @@ async def create_problem_set(
     return StandardResponse(problem_set)
 
 
-@router.get("/{problemSet}", permissions=[Permission.DomainProblemSet.view])
+def get_problem_set_version(
+    problem_set: models.ProblemSet = Depends(
+        parse_problem_set_factory(load_problems=True)
+    ),
+    records: List[Optional[schemas.RecordPreview]] = Depends(
+        parse_problem_set_latest_records
+    ),
+) -> Version:
+    # the problem set is updated when problems are added, moved or deleted,
+    # but not when one of the problems is edited
+    return Version(
+        problem_set.updated_at,
+        [(problem.id, problem.updated_at) for problem in problem_set.problems],
+        records,
+    )
+
+
+@router.get(
+    "/{problemSet}",
+    permissions=[Permission.DomainProblemSet.view],
+    etag=get_problem_set_version,
+)
 async def get_problem_set(
     problem_set: models.ProblemSet = Depends(
         parse_problem_set_factory(load_problems=True)
     ),
-    user: schemas.User = Depends(parse_user_from_auth),
+    records: List[Optional[schemas.RecordPreview]] = Depends(
+        parse_problem_set_latest_records
+    ),
 ) -> StandardResponse[schemas.ProblemSetDetail]:
-    problems = await models.Problem.get_problems_with_record_states(
-        result_cls=schemas.ProblemPreviewWithLatestRecord,
-        problem_set_id=problem_set.id,
-        problems=problem_set.problems,
-        user_id=user.id,
-    )
+    problems = [
+        schemas.ProblemPreviewWithLatestRecord.from_row(problem, latest_record=record)
+        for problem, record in zip(problem_set.problems, records)
+    ]
     result = schemas.ProblemSetDetail(
         **problem_set.dict(exclude={"problems": ...}), problems=problems
     )
@@ -106,8 +136,11 @@ async def list_problems_in_problem_set(
     ),
     user: schemas.User = Depends(parse_user_from_auth),
 ) -> StandardListResponse[schemas.ProblemWithLatestRecord]:
-    problems = await problem_set.get_problems_with_record_states(
-        cls=schemas.ProblemWithLatestRecord, user_id=user.id
+    problems = await models.Problem.get_problems_with_record_states(
+        result_cls=schemas.ProblemWithLatestRecord,
+        problem_set_id=problem_set.id,
+        problems=problem_set.problems,
+        user_id=user.id,
     )
     return StandardListResponse(problems)
 
@@ -115,9 +148,7 @@ async def list_problems_in_problem_set(
 @router.post("/{problemSet}/problems", permissions=[Permission.DomainProblemSet.edit])
 async def add_problem_in_problem_set(
     add_problem: schemas.ProblemSetAddProblem,
-    problem_set: models.ProblemSet = Depends(
-        parse_problem_set_factory(load_links=True)
-    ),
+    problem_set: models.ProblemSet = Depends(parse_problem_set),
     domain_auth: DomainAuthentication = Depends(DomainAuthentication),
 ) -> StandardResponse[schemas.ProblemSet]:
     problem = await parse_problem_without_validation(
@@ -129,6 +160,15 @@ async def add_problem_in_problem_set(
     return StandardResponse(problem_set)
 
 
+@router.put("/{problemSet}/problems", permissions=[Permission.DomainProblemSet.edit])
+async def reorder_problems_in_problem_set(
+    reorder_problems: schemas.ProblemSetReorderProblems,
+    problem_set: models.ProblemSet = Depends(parse_problem_set),
+) -> StandardResponse[schemas.ProblemSet]:
+    await problem_set.reorder_problems(reorder_problems.problem_ids)
+    return StandardResponse(problem_set)
+
+
 @router.get(
     "/{problemSet}/problems/{problem}", permissions=[Permission.DomainProblemSet.view]
 )
@@ -151,9 +191,7 @@ async def get_problem_in_problem_set(
 )
 async def update_problem_in_problem_set(
     update_problem: schemas.ProblemSetUpdateProblem,
-    problem_set: models.ProblemSet = Depends(
-        parse_problem_set_factory(load_links=True)
-    ),
+    problem_set: models.ProblemSet = Depends(parse_problem_set),
     problem: models.Problem = Depends(parse_problem),
 ) -> StandardResponse[schemas.ProblemSet]:
     await problem_set.operate_problem(
@@ -166,9 +204,7 @@ async def update_problem_in_problem_set(
     "/{problemSet}/problems/{problem}", permissions=[Permission.DomainProblemSet.edit]
 )
 async def delete_problem_in_problem_set(
-    problem_set: models.ProblemSet = Depends(
-        parse_problem_set_factory(load_links=True)
-    ),
+    problem_set: models.ProblemSet = Depends(parse_problem_set),
     problem: models.Problem = Depends(parse_problem),
 ) -> StandardResponse[schemas.ProblemSet]:
     await problem_set.operate_problem(problem, Operation.Delete)
@@ -187,6 +223,7 @@ async def submit_solution_to_problem_set(
     ),
     link: models.ProblemProblemSetLink = Depends(parse_problem_problem_set_link),
     user: schemas.User = Depends(parse_user_from_auth),
+    idempotency: Optional[Idempotency] = Depends(parse_idempotency_key),
 ) -> StandardResponse[schemas.Record]:
     record = await models.Record.submit(
         background_tasks=background_tasks,
@@ -197,70 +234,51 @@ async def submit_solution_to_problem_set(
         user=user,
     )
     logger.info("create record: {}", record)
-    return StandardResponse(record)
-
-
-# @router.get("/{problemSet}/scoreboard", deprecated=True)
-# async def get_scoreboard(
-#     problem_set: models.ProblemSet = Depends(parse_problem_set),
-#     domain: models.Domain = Depends(parse_domain_from_auth),
-#     include_hidden: bool = Depends(parse_view_hidden_problem_set),
-# ) -> StandardResponse[schemas.ScoreBoard]:
-#     if problem_set.scoreboard_hidden:
-#         raise BizError(ErrorCode.ScoreboardHiddenBadRequestError)
-#     # domain: models.Domain = await problem_set.domain.fetch()
-#     cursor = models.DomainUser.cursor_join(
-#         field="user", condition={"domain": domain.id}
-#     )
-#     users = await models.User.to_list(cursor)
-#     results: List[models.UserScore] = []
-#     problem_ids: List[str] = []
-#     firstUser = True
-#     for user in users:
-#         scores: List[models.Score] = []
-#         total_score = 0
-#         total_time_spent = timedelta(0)
-#         problem: models.Problem
-#         async for problem in models.Problem.find({"problem_set": problem_set.id}):
-#             if firstUser:
-#                 problem_ids.append(problem.id)
-#             record_model: schemas.Record = await schemas.Record.find_one(
-#                 # {
-#                 #     "user": str(user.id),
-#                 #     "problem": problem.id,
-#                 #     "submit_at": {"$gte": problem_set.unlock_at},
-#                 #     "status": {"$nin": [RecordStatus.waiting, RecordStatus.judging]},
-#                 # },
-#                 sort=[("submit_at", "DESCENDING")],
-#             )
-#             tried = record_model is not None
-#             record = schemas.Record.from_orm(record_model) if record_model else None
-#             score = 0
-#             time = datetime(1970, 1, 1)
-#             time_spent = datetime.utcnow() - problem_set.unlock_at
-#             full_score = 1000
-#             if record is not None:
-#                 score = record.score
-#                 time = record.submit_at
-#                 time_spent = record_model.submit_at - problem_set.unlock_at
-#             total_score += score
-#             total_time_spent += time_spent
-#             scores.append(
-#                 models.Score(
-#                     score=score,
-#                     time=time,
-#                     full_score=full_score,
-#                     time_spent=time_spent,
-#                     tried=tried,
-#                 )
-#             )
-#         user_score = models.UserScore(
-#             user=user,
-#             total_score=total_score,
-#             total_time_spent=total_time_spent,
-#             scores=scores,
-#         )
-#         results.append(user_score)
-#         firstUser = False
-#     results.sort(key=lambda x: (x.total_score, x.total_time_spent))
-#     return StandardResponse(models.ScoreBoard(results=results, problem_ids=problem_ids))
+    response = StandardResponse(schemas.Record.from_orm(record))
+    if idempotency is not None:
+        await idempotency.save(response)
+    return response
+
+
+@router.get("/{problemSet}/progress", permissions=[Permission.DomainProblemSet.manage])
+async def get_problem_set_progress(
+    problem_set: models.ProblemSet = Depends(parse_problem_set),
+    pagination: schemas.PaginationQuery = Depends(parse_pagination_query),
+) -> StandardResponse[schemas.ProblemSetProgress]:
+    progress = await problem_set.get_progress(pagination)
+    return StandardResponse(progress)
+
+
+@router.get("/{problemSet}/statistics", permissions=[Permission.DomainRecord.view])
+async def get_problem_set_statistics(
+    problem_set: models.ProblemSet = Depends(parse_problem_set),
+) -> StandardResponse[schemas.JudgeStatistics]:
+    statistics = await problem_set.get_statistics()
+    return StandardResponse(statistics)
+
+
+@router.get(
+    "/{problemSet}/scoreboard",
+    permissions=[Permission.DomainProblemSet.view],
+    response_model=StandardResponse[schemas.Scoreboard],
+)
+async def get_scoreboard(
+    problem_set: models.ProblemSet = Depends(parse_problem_set),
+    pagination: schemas.PaginationQuery = Depends(parse_pagination_query),
+    domain_auth: DomainAuthentication = Depends(DomainAuthentication),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    # users with the scoreboard permission always see the live scoreboard
+    live = domain_auth.auth.check(
+        ScopeType.DOMAIN_PROBLEM_SET, PermissionType.scoreboard
+    )
+    if problem_set.scoreboard_hidden and not live:
+        raise BizError(ErrorCode.ScoreboardHiddenBadRequestError)
+    frozen = not live and problem_set.is_scoreboard_frozen()
+    snapshot = await models.ScoreboardEntry.get_snapshot(
+        problem_set, pagination, frozen
+    )
+    headers = {"etag": snapshot.etag, "cache-control": "no-cache"}
+    if is_etag_matched(if_none_match, snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(snapshot.body, media_type="application/json", headers=headers)
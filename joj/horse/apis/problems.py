@@ -4,6 +4,7 @@ from uuid import UUID
 from celery import Celery
 from fastapi import BackgroundTasks, Depends
 from loguru import logger
+from pydantic.fields import Undefined
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from joj.horse import models, schemas
@@ -14,12 +15,14 @@ from joj.horse.services.celery_app import celery_app_dependency
 from joj.horse.services.db import db_session_dependency
 from joj.horse.services.lakefs import LakeFSProblemConfig
 from joj.horse.utils.errors import ForbiddenError
-from joj.horse.utils.fastapi.router import APIRouter
+from joj.horse.utils.fastapi.router import APIRouter, Version
+from joj.horse.utils.idempotency import Idempotency, parse_idempotency_key
 from joj.horse.utils.parser import (
     parse_domain_from_auth,
     parse_ordering_query,
     parse_pagination_query,
     parse_problem,
+    parse_problem_latest_record,
     parse_problem_without_validation,
     parse_user_from_auth,
     parse_view_hidden_problem,
@@ -38,17 +41,20 @@ async def list_problems(
     include_hidden: bool = Depends(parse_view_hidden_problem),
     user: schemas.User = Depends(parse_user_from_auth),
 ) -> StandardListResponse[schemas.ProblemWithLatestRecord]:
-    statement = domain.find_problems_statement(include_hidden)
-    problems, count = await models.Problem.execute_list_statement(
+    statement = domain.find_problems_statement(
+        include_hidden, schemas.ProblemWithLatestRecord
+    )
+    rows, count = await models.Problem.execute_list_statement(
         statement, ordering, pagination
     )
-    result = await models.Problem.get_problems_with_record_states(
-        result_cls=schemas.ProblemWithLatestRecord,
-        problem_set_id=None,
-        problems=problems,
-        user_id=user.id,
+    records = await models.Record.get_user_latest_records(
+        problem_set_id=None, problem_ids=[row.id for row in rows], user_id=user.id
     )
-    return StandardListResponse(result, count)
+    result = [
+        schemas.ProblemWithLatestRecord.dump_row(row, latest_record=record)
+        for row, record in zip(rows, records)
+    ]
+    return StandardListResponse.from_trusted(result, count)
 
 
 @router.post("", permissions=[Permission.DomainProblem.create])
@@ -81,20 +87,45 @@ async def create_problem(
     return StandardResponse(problem)
 
 
-@router.get("/{problem}", permissions=[Permission.DomainProblem.view])
+def get_problem_version(
+    problem: models.Problem = Depends(parse_problem),
+    record: Optional[schemas.RecordPreview] = Depends(parse_problem_latest_record),
+) -> Version:
+    # counters are flushed to the problem without changing updated_at
+    return Version(problem.updated_at, problem.num_submit, problem.num_accept, record)
+
+
+@router.get(
+    "/{problem}",
+    permissions=[Permission.DomainProblem.view],
+    etag=get_problem_version,
+)
 async def get_problem(
     problem: models.Problem = Depends(parse_problem),
-    user: schemas.User = Depends(parse_user_from_auth),
+    record: Optional[schemas.RecordPreview] = Depends(parse_problem_latest_record),
 ) -> StandardResponse[schemas.ProblemDetailWithLatestRecord]:
-    record = await models.Record.get_user_latest_record(
-        problem_set_id=None, problem_id=problem.id, user_id=user.id
-    )
     result = schemas.ProblemDetailWithLatestRecord(
         **problem.dict(), latest_record=record
     )
     return StandardResponse(result)
 
 
+@router.get("/{problem}/counters", permissions=[Permission.DomainProblem.view])
+async def get_problem_counters(
+    problem: models.Problem = Depends(parse_problem),
+) -> StandardResponse[schemas.ProblemCounters]:
+    counters = await problem.get_counters()
+    return StandardResponse(counters)
+
+
+@router.get("/{problem}/statistics", permissions=[Permission.DomainRecord.view])
+async def get_problem_statistics(
+    problem: models.Problem = Depends(parse_problem),
+) -> StandardResponse[schemas.JudgeStatistics]:
+    statistics = await problem.get_statistics()
+    return StandardResponse(statistics)
+
+
 @router.delete("/{problem}", permissions=[Permission.DomainProblem.edit])
 async def delete_problem(
     problem: models.Problem = Depends(parse_problem),
@@ -107,7 +138,12 @@ async def delete_problem(
 async def update_problem(
     problem_edit: schemas.ProblemEdit = Depends(schemas.ProblemEdit.edit_dependency),
     problem: models.Problem = Depends(parse_problem),
+    auth: Authentication = Depends(),
 ) -> StandardResponse[schemas.Problem]:
+    # the repo is read with the token of the server, which can read any repo
+    gitea_fields = (problem_edit.gitea_repo, problem_edit.gitea_branch)
+    if not auth.is_root() and any(x is not Undefined for x in gitea_fields):
+        raise ForbiddenError(message="only site root can bind a gitea repo.")
     problem.update_from_dict(problem_edit.dict())
     await problem.save_model()
     return StandardResponse(problem)
@@ -169,6 +205,7 @@ async def submit_solution_to_problem(
     ),
     problem: models.Problem = Depends(parse_problem),
     user: schemas.User = Depends(parse_user_from_auth),
+    idempotency: Optional[Idempotency] = Depends(parse_idempotency_key),
 ) -> StandardResponse[schemas.Record]:
     record = await models.Record.submit(
         background_tasks=background_tasks,
@@ -179,4 +216,7 @@ async def submit_solution_to_problem(
         user=user,
     )
     logger.info("create record: {}", record)
-    return StandardResponse(record)
+    response = StandardResponse(schemas.Record.from_orm(record))
+    if idempotency is not None:
+        await idempotency.save(response)
+    return response
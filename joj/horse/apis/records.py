@@ -1,12 +1,34 @@
-from typing import Optional
+import asyncio
+from pathlib import PurePosixPath
+from typing import Any, AsyncGenerator, List, Literal, Optional
 from uuid import UUID
 
-from fastapi import Depends, Query
+import orjson
+from fastapi import Depends, Path, Query
+from fastapi.responses import Response, StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 from joj.horse import models, schemas
+from joj.horse.config import settings
 from joj.horse.models.permission import PermissionType, ScopeType
 from joj.horse.schemas.auth import DomainAuthentication
-from joj.horse.schemas.base import StandardListResponse, StandardResponse
+from joj.horse.schemas.base import (
+    StandardListResponse,
+    StandardResponse,
+    get_field_aliases,
+)
+from joj.horse.schemas.permission import Permission
+from joj.horse.services.db import db_session_dependency
+from joj.horse.services.lakefs import RECORD_BUNDLE_NAME, LakeFSRecord
+from joj.horse.services.pubsub import PubSubUnavailable, get_pubsub
+from joj.horse.utils.base import format_csv_rows, format_server_sent_event
+from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.fastapi.responses import (
+    get_content_disposition,
+    get_object_response,
+    get_presigned_url_response,
+)
 from joj.horse.utils.fastapi.router import APIRouter
 from joj.horse.utils.parser import (
     parse_domain_from_auth,
@@ -20,6 +42,10 @@ router = APIRouter()
 router_name = "domains/{domain}"
 router_tag = "record"
 
+RECORD_STREAM_KEEP_ALIVE_SECONDS = 15
+RECORD_BATCH_LIMIT = 100
+RECORD_EXPORT_PARTITION_SIZE = 1000
+
 
 @router.get("/records", permissions=[])
 async def list_records_in_domain(
@@ -32,7 +58,9 @@ async def list_records_in_domain(
     pagination: schemas.PaginationQuery = Depends(parse_pagination_query),
     user: schemas.User = Depends(parse_user_from_auth),
 ) -> StandardListResponse[schemas.RecordListDetail]:
-    statement = domain.find_records_statement(problem_set, problem, submitter_id)
+    statement = domain.find_records_statement(
+        problem_set, problem, submitter_id, schemas.RecordListDetail
+    )
 
     if not domain_auth.auth.check(ScopeType.DOMAIN_RECORD, PermissionType.view):
         statement = statement.where(models.Record.committer_id == user.id)
@@ -40,8 +68,88 @@ async def list_records_in_domain(
     rows, count = await models.Record.execute_list_statement(
         statement, ordering, pagination
     )
-    record_list_details = [schemas.RecordListDetail.from_row(*row) for row in rows]
-    return StandardListResponse(record_list_details, count)
+    record_list_details = [schemas.RecordListDetail.dump_row(row) for row in rows]
+    return StandardListResponse.from_trusted(record_list_details, count)
+
+
+@router.get("/records:batch", permissions=[])
+async def get_records_batch(
+    domain: models.Domain = Depends(parse_domain_from_auth),
+    domain_auth: DomainAuthentication = Depends(),
+    ids: List[UUID] = Query(
+        ..., description=f"ids of the records, at most {RECORD_BATCH_LIMIT}"
+    ),
+    include_cases: bool = Query(False, description="include cases of the records"),
+    user: schemas.User = Depends(parse_user_from_auth),
+) -> StandardListResponse[schemas.RecordDetail]:
+    record_ids = list(dict.fromkeys(ids))
+    if len(record_ids) > RECORD_BATCH_LIMIT:
+        raise BizError(
+            ErrorCode.IllegalFieldError,
+            f"at most {RECORD_BATCH_LIMIT} records can be requested at once",
+        )
+    statement = domain.find_records_by_ids_statement(
+        record_ids, schemas.RecordDetail, include_cases
+    )
+    # the same rule as parse_record, applied in sql
+    if not domain_auth.auth.check(ScopeType.DOMAIN_RECORD, PermissionType.view):
+        statement = statement.where(models.Record.committer_id == user.id)
+
+    rows = (await models.Record.session_exec(statement)).all()
+    # keep the order of the requested ids, records not found are omitted
+    positions = {record_id: i for i, record_id in enumerate(record_ids)}
+    rows = sorted(rows, key=lambda row: positions[row.id])
+    records = [schemas.RecordDetail.dump_row(row) for row in rows]
+    return StandardListResponse.from_trusted(records)
+
+
+@router.get(
+    "/records:export",
+    permissions=[Permission.DomainRecord.view],
+    description="Export all records matching the filters as csv or ndjson. "
+    "The rows are streamed from a server-side cursor without pagination.",
+)
+async def export_records_in_domain(
+    domain: models.Domain = Depends(parse_domain_from_auth),
+    problem_set: Optional[UUID] = Query(None, description="problem set id"),
+    problem: Optional[UUID] = Query(None, description="problem id"),
+    submitter_id: Optional[UUID] = Query(None, description="submitter uid"),
+    export_format: schemas.RecordExportFormat = Query(schemas.RecordExportFormat.csv),
+    ordering: schemas.OrderingQuery = Depends(parse_ordering_query()),
+) -> Any:
+    statement = domain.find_records_statement(
+        problem_set, problem, submitter_id, schemas.RecordListDetail
+    )
+    stream = models.Record.stream_list_statement(
+        statement, ordering, RECORD_EXPORT_PARTITION_SIZE
+    )
+
+    async def export_ndjson() -> AsyncGenerator[bytes, None]:
+        async for rows in stream:
+            yield b"".join(
+                orjson.dumps(schemas.RecordListDetail.dump_row(row)) + b"\n"
+                for row in rows
+            )
+
+    async def export_csv() -> AsyncGenerator[bytes, None]:
+        aliases = get_field_aliases(schemas.RecordListDetail)
+        columns = [aliases[column] for column in statement.selected_columns.keys()]
+        yield format_csv_rows([columns])
+        async for rows in stream:
+            # normalized by dump_row, the same values as ndjson
+            data = map(schemas.RecordListDetail.dump_row, rows)
+            yield format_csv_rows([x[column] for column in columns] for x in data)
+
+    if export_format == schemas.RecordExportFormat.ndjson:
+        content, media_type = export_ndjson(), "application/x-ndjson"
+    else:
+        content, media_type = export_csv(), "text/csv"
+    filename = f"records-{domain.url}.{export_format}"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @router.get("/records/{record}", permissions=[])
@@ -49,3 +157,87 @@ async def get_record(
     record: schemas.RecordDetail = Depends(parse_record),
 ) -> StandardResponse[schemas.RecordDetail]:
     return StandardResponse(schemas.RecordDetail.from_orm(record))
+
+
+@router.get("/records/{record}/code/{path:path}", permissions=[])
+async def download_record_code(
+    path: str = Path(..., description="Path of the submitted file"),
+    response_type: Literal["redirect", "json"] = Query(
+        "redirect", description="How a presigned url is returned if enabled"
+    ),
+    record: models.Record = Depends(parse_record),
+) -> Any:
+    if record.commit_id is None:
+        raise BizError(ErrorCode.FileDownloadError, "code not uploaded yet!")
+    await record.fetch_related("problem")
+    lakefs_record = LakeFSRecord(record.problem, record)
+    filename = PurePosixPath(path).name
+    if record.bundled:
+        # a file in the bundle can not be presigned, but it is small
+        data = await run_in_threadpool(
+            lakefs_record.read_bundle_file, RECORD_BUNDLE_NAME, path, record.commit_id
+        )
+        return Response(
+            data,
+            media_type="application/octet-stream",
+            headers={"content-disposition": get_content_disposition(filename)},
+        )
+    if settings.presigned_download:
+        url = await run_in_threadpool(
+            lakefs_record.get_presigned_url, path, record.commit_id
+        )
+        return get_presigned_url_response(url, response_type)
+    obj = await run_in_threadpool(lakefs_record.get_object, path, record.commit_id)
+    return get_object_response(obj, filename)
+
+
+@router.get(
+    "/records/{record}/stream",
+    permissions=[],
+    description="Server-sent events of the record. The current record is sent first "
+    "as a 'record' event, then 'case' and 'record' events are pushed when the judger "
+    "updates them. The stream ends when the record is finished.",
+)
+async def stream_record(
+    record: models.Record = Depends(parse_record),
+    session: AsyncSession = Depends(db_session_dependency),
+) -> Any:
+    async def current_record_event() -> bytes:
+        await record.refresh_model()
+        data = schemas.RecordDetail.from_orm(record).dict(by_alias=True)
+        # release the database connection for the rest of the stream
+        await session.close()
+        return format_server_sent_event("record", data)
+
+    async def event_stream() -> AsyncGenerator[bytes, None]:
+        channel = models.Record.get_channel(record.id)
+        try:
+            async with get_pubsub().subscribe(channel) as queue:
+                # read the record again after subscribing so no update is lost
+                yield await current_record_event()
+                finished = schemas.RecordState(record.state).is_finished()
+                while not finished:
+                    try:
+                        message = await asyncio.wait_for(
+                            queue.get(), RECORD_STREAM_KEEP_ALIVE_SECONDS
+                        )
+                    except asyncio.TimeoutError:
+                        yield b": keep-alive\n\n"
+                        continue
+                    if message is None:
+                        # dropped by the pubsub, the client reconnects to resync
+                        return
+                    event = orjson.loads(message)
+                    yield format_server_sent_event(event["event"], event["data"])
+                    if event["event"] == "record":
+                        state = schemas.RecordState(event["data"]["state"])
+                        finished = state.is_finished()
+        except PubSubUnavailable:
+            # no updates can be pushed, send the current record only
+            yield await current_record_event()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
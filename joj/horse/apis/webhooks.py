@@ -0,0 +1,88 @@
+import orjson
+from fastapi import BackgroundTasks, Header, Request
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+
+from joj.horse import models, schemas
+from joj.horse.schemas.base import StandardListResponse
+from joj.horse.schemas.gitea_webhook import EMPTY_COMMIT_ID, GiteaWebhook
+from joj.horse.services.gitea import (
+    sync_problem_config_from_gitea,
+    verify_gitea_signature,
+)
+from joj.horse.services.lakefs import LakeFSProblemConfig
+from joj.horse.utils.errors import ForbiddenError
+from joj.horse.utils.fastapi.router import APIRouter
+from joj.horse.utils.lock import problem_config_lock
+
+router = APIRouter()
+router_name = "webhooks"
+router_tag = "webhook"
+
+
+async def sync_problem_config(problem: models.Problem, webhook: GiteaWebhook) -> None:
+    try:
+        # the owner is the committer, a problem without an owner (the user is
+        # deleted) is still synced, committed by nobody like a deleted user
+        await problem.fetch_related("owner")
+        if problem.owner is None:
+            logger.warning("sync problem config without an owner: {}", problem.id)
+        async with problem_config_lock(problem.id):
+            # a missed push is never lost, the whole repo is synced instead
+            incremental = (
+                webhook.has_all_commits() and webhook.before == problem.gitea_commit_id
+            )
+            changes = await run_in_threadpool(
+                sync_problem_config_from_gitea,
+                LakeFSProblemConfig(problem),
+                webhook,
+                incremental,
+            )
+            if not changes.is_empty():
+                message = webhook.head_commit.message if webhook.head_commit else ""
+                result = await models.ProblemConfig.make_commit(
+                    problem=problem,
+                    committer=problem.owner,
+                    commit=schemas.ProblemConfigCommit(
+                        message=f"gitea {webhook.after[:10]}: {message}".strip(),
+                        data_version=2,
+                    ),
+                )
+                logger.info("problem config commit: {}", result)
+            problem.gitea_commit_id = webhook.after
+            await problem.save_model()
+    except Exception as e:
+        logger.error("sync problem config from gitea failed: {}", problem.id)
+        logger.exception(e)
+
+
+@router.post(
+    "/gitea",
+    description="Receive push events of Gitea, the configs of the problems bound "
+    "to the pushed repo and branch are synced in the background.",
+)
+async def receive_gitea_webhook(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_gitea_event: str = Header(""),
+    x_gitea_signature: str = Header(""),
+) -> StandardListResponse[schemas.ProblemPreview]:
+    body = await request.body()
+    if not verify_gitea_signature(body, x_gitea_signature):
+        raise ForbiddenError(message="invalid signature of the webhook.")
+    if x_gitea_event != "push":
+        return StandardListResponse()
+    webhook = GiteaWebhook(**orjson.loads(body))
+    if webhook.repository is None or webhook.branch is None:
+        return StandardListResponse()
+    if webhook.after == EMPTY_COMMIT_ID:
+        return StandardListResponse()  # the branch is deleted
+
+    problems = await models.Problem.all(
+        gitea_repo=webhook.repository.full_name, gitea_branch=webhook.branch
+    )
+    for problem in problems:
+        background_tasks.add_task(sync_problem_config, problem, webhook)
+    return StandardListResponse(
+        [schemas.ProblemPreview.from_orm(problem) for problem in problems]
+    )
@@ -1,4 +1,5 @@
 import asyncio
+from contextlib import suppress
 
 from fastapi import Depends, FastAPI, Request
 from fastapi.responses import ORJSONResponse
@@ -71,6 +72,9 @@ async def startup_event() -> None:  # pragma: no cover
         else:
             logger.warning("LakeFS not configured! All file features will be disabled.")
         await asyncio.gather(*initialize_tasks)
+        app.state.counter_flush_task = asyncio.create_task(
+            joj.horse.models.Problem.flush_counters_periodically()
+        )
 
     except (RetryError, LakeFSApiException) as e:
         logger.error("Initialization failed, exiting.")
@@ -78,6 +82,24 @@ async def startup_event() -> None:  # pragma: no cover
         exit(-1)
 
 
+@app.on_event("shutdown")
+async def shutdown_event() -> None:  # pragma: no cover
+    counter_flush_task = getattr(app.state, "counter_flush_task", None)
+    if counter_flush_task is not None:
+        counter_flush_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await counter_flush_task
+    # the counters buffered since the last flush, a batch taken by the
+    # cancelled flush is applied first (at most once), then the pending one
+    try:
+        for _ in range(2):
+            if not await joj.horse.models.Problem.flush_counters():
+                break
+    except Exception as e:
+        logger.error("problem counters: final flush failed.")
+        logger.exception(e)
+
+
 if settings.dsn:  # pragma: no cover
     import sentry_sdk
     from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
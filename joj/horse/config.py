@@ -70,6 +70,13 @@ class DatabaseSettings(BaseSettings):
     redis_port: int = 6379
     redis_password: str = ""
     redis_db_index: int = 0
+    counter_flush_interval: int = Field(
+        10, description="Seconds between flushes of buffered counters to PostgreSQL."
+    )
+    idempotency_key_ttl: int = Field(
+        24 * 60 * 60,
+        description="Seconds to replay the response of an idempotency key.",
+    )
 
     # rabbitmq config
     rabbitmq_host: str = "localhost"
@@ -101,11 +108,70 @@ class ObjectStorageSettings(BaseSettings):
     lakefs_port: int = 34766
     lakefs_username: str = "lakefs"
     lakefs_password: str = "lakefs"
+    lakefs_s3_public_url: str = Field(
+        "",
+        description="URL of the LakeFS S3 gateway in presigned urls, "
+        "the internal one is used if not set.",
+    )
+    s3_public_url: str = Field(
+        "",
+        description="URL of the S3 service in presigned urls, "
+        "the internal one is used if not set.",
+    )
+
+    lakefs_upload_concurrency: int = Field(
+        8, description="Parallel uploads of files of an archive to LakeFS."
+    )
+
+    # gitea, problem configs can be synced from pushes to its repos
+    gitea_url: str = Field(
+        "", description="URL of Gitea, e.g., https://git.example.com"
+    )
+    gitea_token: str = Field("", description="Access token to read the repos.")
+    gitea_webhook_secret: str = Field(
+        "", description="Secret of the webhooks, the webhook is disabled if not set."
+    )
 
     # buckets
     bucket_config: str = "s3://joj-config"
     bucket_submission: str = "s3://joj-submission"
 
+    # caches
+    problem_config_cache_size: int = Field(
+        1024, description="Number of parsed problem configs kept in each worker."
+    )
+    archive_cache_dir: str = Field(
+        "/tmp/horse/archives", description="Directory of cached archives of configs."
+    )
+    archive_cache_size_mb: int = Field(
+        10240, description="Total size of cached archives before eviction."
+    )
+    archive_streaming: bool = Field(
+        True,
+        description="Stream archives missing from the cache while they are generated.",
+    )
+
+    record_bundle: bool = Field(
+        False,
+        description="Pack the submitted files in a single object, "
+        "the judgers must support bundled records.",
+    )
+    judge_bundle: bool = Field(
+        True,
+        description="Bundle the files of each problem config commit for judgers, "
+        "the s3 settings are required.",
+    )
+
+    # downloads
+    presigned_download: bool = Field(
+        False,
+        description="Let clients download files from presigned urls of the object "
+        "store instead of through the server.",
+    )
+    presigned_url_expire_seconds: int = Field(
+        300, description="Seconds before a presigned url expires."
+    )
+
 
 add_settings(ObjectStorageSettings)
 
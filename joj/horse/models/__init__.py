@@ -1,4 +1,5 @@
 from joj.horse.models.base import BaseORMModel as BaseORMModel
+from joj.horse.models.counter_batch import CounterBatch as CounterBatch
 from joj.horse.models.domain import Domain as Domain
 from joj.horse.models.domain_invitation import DomainInvitation as DomainInvitation
 from joj.horse.models.domain_role import DomainRole as DomainRole
@@ -9,6 +10,10 @@ from joj.horse.models.problem_config import ProblemConfig as ProblemConfig
 from joj.horse.models.problem_group import ProblemGroup as ProblemGroup
 from joj.horse.models.problem_set import ProblemSet as ProblemSet
 from joj.horse.models.record import Record as Record
+from joj.horse.models.scoreboard import (
+    ScoreboardCell as ScoreboardCell,
+    ScoreboardEntry as ScoreboardEntry,
+)
 from joj.horse.models.user import User as User
 from joj.horse.models.user_latest_record import UserLatestRecord as UserLatestRecord
 from joj.horse.models.user_oauth_account import UserOAuthAccount as UserOAuthAccount
@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import (
     TYPE_CHECKING,
     Any,
+    AsyncGenerator,
     Dict,
     Iterator,
     List,
@@ -13,6 +14,7 @@ from typing import (
 )
 from uuid import UUID, uuid4
 
+from pydantic import BaseModel as PydanticBaseModel
 from pydantic.fields import Undefined
 from sqlalchemy.engine import Connection, Row
 from sqlalchemy.exc import StatementError
@@ -53,6 +55,21 @@ class ORMUtils(SQLModel, BaseModel):
     def sql_select(cls) -> Select:
         return select(cls)
 
+    @classmethod
+    def get_schema_columns(
+        cls, schema: Type[PydanticBaseModel]
+    ) -> List[InstrumentedAttribute]:
+        # only the columns declared in the schema are projected,
+        # so heavy columns (e.g., content, cases) are never loaded for lists
+        table_columns = cls.__table__.columns  # type: ignore[attr-defined]
+        return [
+            getattr(cls, name) for name in schema.__fields__ if name in table_columns
+        ]
+
+    @classmethod
+    def sql_select_schema(cls, schema: Type[PydanticBaseModel]) -> Select:
+        return select(*cls.get_schema_columns(schema))
+
     @classmethod
     def sql_update(cls) -> Update:
         return update(cls)
@@ -258,6 +275,21 @@ class ORMUtils(SQLModel, BaseModel):
                 row_count_value = row_count_value[0]
             return results.all(), row_count_value
 
+    @classmethod
+    async def stream_list_statement(
+        cls,
+        statement: Select,
+        ordering: Optional["OrderingQuery"] = None,
+        partition_size: int = 1000,
+    ) -> AsyncGenerator[List[Row], None]:
+        # rows are fetched from a server-side cursor partition by partition,
+        # so the memory usage does not grow with the number of rows
+        statement = cls.apply_ordering(statement, ordering)
+        async with db_session() as session:
+            result = await session.stream(statement)
+            async for rows in result.partitions(partition_size):
+                yield rows
+
     @staticmethod
     def parse_rows(
         rows: List[Row], *tables: Type["BaseORMModelType"]
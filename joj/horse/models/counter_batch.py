@@ -0,0 +1,15 @@
+from sqlmodel import Field
+
+from joj.horse.models.base import BaseORMModel
+
+
+class CounterBatch(BaseORMModel, table=True):  # type: ignore[call-arg]
+    """
+    A batch of buffered counters applied to the database, the id is the
+    batch id taken from redis. It is inserted in the same transaction as the
+    counters, so a batch retried after a crash before the ack is skipped.
+    """
+
+    __tablename__ = "counter_batches"
+
+    name: str = Field(nullable=False)
@@ -1,14 +1,14 @@
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, List, Optional, Type
 from uuid import UUID
 
 from sqlalchemy import event
-from sqlalchemy.orm import defer
 from sqlalchemy.schema import Column, ForeignKey
 from sqlalchemy.sql.expression import Select, or_, true
 from sqlmodel import Field, Relationship, select
 from sqlmodel.sql.sqltypes import GUID
 
 from joj.horse.models.base import URLORMModel, url_pre_save
+from joj.horse.schemas.base import BaseModel
 from joj.horse.schemas.domain import DomainDetail
 
 if TYPE_CHECKING:
@@ -54,20 +54,26 @@ class Domain(URLORMModel, DomainDetail, table=True):  # type: ignore[call-arg]
             statement = statement.where(models.Domain.group.in_(groups))  # type: ignore[attr-defined]
         return statement
 
-    def find_problem_sets_statement(self, include_hidden: bool) -> Select:
+    def find_problem_sets_statement(
+        self, include_hidden: bool, schema: Type[BaseModel]
+    ) -> Select:
         from joj.horse import models
 
-        statement = select(models.ProblemSet).where(
+        statement = models.ProblemSet.sql_select_schema(schema).where(
             models.ProblemSet.domain_id == self.id
         )
         if not include_hidden:
             statement = statement.where(models.ProblemSet.hidden != true())
         return statement
 
-    def find_problems_statement(self, include_hidden: bool) -> Select:
+    def find_problems_statement(
+        self, include_hidden: bool, schema: Type[BaseModel]
+    ) -> Select:
         from joj.horse import models
 
-        statement = select(models.Problem).where(models.Problem.domain_id == self.id)
+        statement = models.Problem.sql_select_schema(schema).where(
+            models.Problem.domain_id == self.id
+        )
         if not include_hidden:
             statement = statement.where(models.Problem.hidden != true())
         return statement
@@ -151,16 +157,17 @@ class Domain(URLORMModel, DomainDetail, table=True):  # type: ignore[call-arg]
         problem_set_id: Optional[UUID],
         problem_id: Optional[UUID],
         submitter_id: Optional[UUID],
+        schema: Type[BaseModel],
     ) -> Select:
         from joj.horse import models
 
+        # record.cases is excluded unless the schema declares it
         statement = select(
-            models.Record,
-            models.Problem.title,
-            models.ProblemSet.title,
-            models.User.username,
+            *models.Record.get_schema_columns(schema),
+            models.Problem.title.label("problem_title"),
+            models.ProblemSet.title.label("problem_set_title"),
+            models.User.username.label("committer_username"),
         ).where(models.Record.domain_id == self.id)
-        statement = statement.options(defer("cases"))  # exclude record.cases
         statement = statement.outerjoin_from(
             models.Record,
             models.ProblemSet,
@@ -185,6 +192,23 @@ class Domain(URLORMModel, DomainDetail, table=True):  # type: ignore[call-arg]
             statement = statement.where(models.Record.committer_id == submitter_id)
         return statement
 
+    def find_records_by_ids_statement(
+        self, record_ids: List[UUID], schema: Type[BaseModel], include_cases: bool
+    ) -> Select:
+        from joj.horse import models
+
+        columns = [
+            column
+            for column in models.Record.get_schema_columns(schema)
+            if include_cases or column.key != "cases"
+        ]
+        statement = (
+            select(*columns)
+            .where(models.Record.domain_id == self.id)
+            .where(models.Record.id.in_(record_ids))  # type: ignore[attr-defined]
+        )
+        return statement
+
 
 event.listen(Domain, "before_insert", url_pre_save)
 event.listen(Domain, "before_update", url_pre_save)
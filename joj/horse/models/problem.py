@@ -1,16 +1,30 @@
-from typing import TYPE_CHECKING, List, Optional, Type
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Type
 from uuid import UUID
 
-from sqlalchemy import event
+from aioredlock import LockError
+from loguru import logger
+from sqlalchemy import Integer, column, delete, event, values
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
 from sqlalchemy.sql.expression import Select
-from sqlmodel import Field, Relationship
+from sqlmodel import Field, Relationship, update
 from sqlmodel.sql.sqltypes import GUID
 
+from joj.horse.config import settings
 from joj.horse.models.base import DomainURLORMModel, url_pre_save
 from joj.horse.models.link_tables import ProblemProblemSetLink
-from joj.horse.schemas.problem import ProblemDetail, WithLatestRecordType
+from joj.horse.schemas.problem import (
+    ProblemCounters,
+    ProblemDetail,
+    WithLatestRecordType,
+)
+from joj.horse.schemas.statistics import JudgeStatistics
+from joj.horse.services.counter import get_buffered_counter
 from joj.horse.services.db import db_session
+from joj.horse.services.lock_manager import get_lock_manager
+from joj.horse.services.statistics import get_judge_statistics_store
 
 if TYPE_CHECKING:
     from joj.horse.models import (
@@ -22,6 +36,10 @@ if TYPE_CHECKING:
         User,
     )
 
+PROBLEM_COUNTER_FIELDS = ("num_submit", "num_accept")
+# applied batches are remembered long enough to outlive any retried flush
+COUNTER_BATCH_EXPIRE = timedelta(days=1)
+
 
 class Problem(DomainURLORMModel, ProblemDetail, table=True):  # type: ignore[call-arg]
     __tablename__ = "problems"
@@ -67,20 +85,120 @@ class Problem(DomainURLORMModel, ProblemDetail, table=True):  # type: ignore[cal
         cls,
         result_cls: Type[WithLatestRecordType],
         problem_set_id: Optional[UUID],
-        problems: List["Problem"],
+        problems: Sequence[Any],
         user_id: UUID,
     ) -> List[WithLatestRecordType]:
+        """
+        problems can be either projected rows or orm objects of problems.
+        """
         from joj.horse import models
 
         problem_ids = [problem.id for problem in problems]
         records = await models.Record.get_user_latest_records(
             problem_set_id=problem_set_id, problem_ids=problem_ids, user_id=user_id
         )
-        problems = [
-            result_cls(**problems[i].dict(), latest_record=records[i])
-            for i, record in enumerate(records)
+        return [
+            result_cls.from_row(problem, latest_record=record)
+            for problem, record in zip(problems, records)
         ]
-        return problems
+
+    @classmethod
+    async def increment_counter(cls, problem_id: UUID, field: str) -> None:
+        """
+        Counters are buffered in redis instead of updating the problem row,
+        so submitters to a popular problem never wait on its row lock.
+        """
+        await get_buffered_counter("problems").increment(problem_id, field)
+
+    async def get_counters(self) -> ProblemCounters:
+        pending = await get_buffered_counter("problems").get_pending(
+            [self.id], PROBLEM_COUNTER_FIELDS
+        )
+        deltas = pending[self.id]
+        return ProblemCounters(
+            num_submit=self.num_submit + deltas["num_submit"],
+            num_accept=self.num_accept + deltas["num_accept"],
+        )
+
+    @classmethod
+    async def flush_counters(cls) -> int:
+        """
+        Apply the buffered counters to the database in one statement.
+
+        The batch id is recorded in the same transaction, so the deltas of a
+        batch are never applied twice if the worker dies before the ack.
+        """
+        from joj.horse import models
+
+        counter = get_buffered_counter("problems")
+        lock_manager = get_lock_manager()
+        try:
+            lock = await lock_manager.lock("problems:counters:flush", lock_timeout=30)
+        except LockError:  # another worker is flushing
+            return 0
+        try:
+            batch_id, deltas = await counter.take()
+            if batch_id is not None and deltas:
+                rows = values(
+                    column("id", GUID),
+                    *(column(field, Integer) for field in PROBLEM_COUNTER_FIELDS),
+                    name="deltas",
+                ).data(
+                    [
+                        (
+                            problem_id,
+                            *(delta.get(x, 0) for x in PROBLEM_COUNTER_FIELDS),
+                        )
+                        for problem_id, delta in deltas.items()
+                    ]
+                )
+                statement = (
+                    update(cls)
+                    .where(cls.id == rows.c.id)
+                    .values(
+                        num_submit=cls.num_submit + rows.c.num_submit,
+                        num_accept=cls.num_accept + rows.c.num_accept,
+                        # counters are not an update of the problem
+                        updated_at=cls.updated_at,
+                    )
+                )
+                batch_table = models.CounterBatch.__table__  # type: ignore
+                batch_statement = (
+                    insert(batch_table)
+                    .values(id=batch_id, name="problems")
+                    .on_conflict_do_nothing()
+                    .returning(batch_table.c.id)
+                )
+                expired_statement = delete(batch_table).where(
+                    batch_table.c.created_at
+                    < datetime.now(timezone.utc) - COUNTER_BATCH_EXPIRE
+                )
+                async with db_session() as session:
+                    inserted = (await session.execute(batch_statement)).first()
+                    if inserted is not None:
+                        await session.exec(statement)
+                    await session.execute(expired_statement)
+                    await session.commit()
+            await counter.ack()
+        finally:
+            await lock_manager.unlock(lock)
+        return len(deltas)
+
+    @classmethod
+    async def flush_counters_periodically(cls) -> None:
+        while True:
+            await asyncio.sleep(settings.counter_flush_interval)
+            try:
+                count = await cls.flush_counters()
+                if count:
+                    logger.debug("flush counters of {} problems", count)
+            except Exception as e:
+                logger.error("problem counters: flush failed.")
+                logger.exception(e)
+
+    async def get_statistics(self) -> JudgeStatistics:
+        store = get_judge_statistics_store()
+        return await store.get(f"problems:{self.id}")
 
     async def get_latest_problem_config(self) -> Optional["ProblemConfig"]:
         from joj.horse import models
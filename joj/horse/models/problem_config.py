@@ -1,25 +1,39 @@
+import asyncio
+import time
 from pathlib import Path
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 from uuid import UUID
 
 import orjson
+from joj.elephant.errors import ElephantError
 
 # from joj.elephant.manager import Manager
 from lakefs_client.models import Commit
+from loguru import logger
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.schema import Column, ForeignKey
-from sqlmodel import Field, Relationship
+from sqlmodel import Field, Relationship, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.sql.sqltypes import GUID
 from starlette.concurrency import run_in_threadpool
 
-from joj.elephant.errors import ElephantError
+from joj.horse.config import settings
 from joj.horse.models.base import BaseORMModel
 from joj.horse.schemas.problem_config import ProblemConfigCommit, ProblemConfigDetail
+from joj.horse.services.db import get_db_engine
 from joj.horse.services.lakefs import LakeFSProblemConfig
 from joj.horse.utils.errors import BizError, ErrorCode
 
 if TYPE_CHECKING:
     from joj.horse.models import Problem, Record, User
 
+# a failed bundle is built again when the config is used after this interval
+BUNDLE_RETRY_INTERVAL = 60
+
+# bundles being built in this worker, and the last failures, keyed by config id
+pending_bundles: Dict[UUID, "asyncio.Task[None]"] = {}
+failed_bundles: Dict[UUID, float] = {}
+
 
 class ProblemConfig(BaseORMModel, ProblemConfigDetail, table=True):  # type: ignore[call-arg]
     __tablename__ = "problem_configs"
@@ -40,9 +54,67 @@ class ProblemConfig(BaseORMModel, ProblemConfigDetail, table=True):  # type: ign
 
     records: List["Record"] = Relationship(back_populates="problem_config")
 
+    @staticmethod
+    async def build_bundle(
+        lakefs_problem_config: LakeFSProblemConfig, commit_id: str
+    ) -> Optional[str]:
+        if not settings.judge_bundle or not settings.s3_host:
+            return None
+        try:
+            return await run_in_threadpool(
+                lakefs_problem_config.build_bundle, commit_id
+            )
+        except Exception as e:
+            # judgers can still fetch the files from lakefs
+            logger.error("build bundle failed: {}", commit_id)
+            logger.exception(e)
+            return None
+
+    async def update_bundle(self, lakefs_problem_config: LakeFSProblemConfig) -> None:
+        digest = await self.build_bundle(lakefs_problem_config, self.commit_id)
+        if digest is None:
+            failed_bundles[self.id] = time.monotonic()
+            return
+        failed_bundles.pop(self.id, None)
+        statement = (
+            update(ProblemConfig)
+            .where(ProblemConfig.id == self.id)
+            .values(bundle_digest=digest)
+        )
+        # not db_session(), the session of the request may be in use or closed
+        async with AsyncSession(get_db_engine()) as session:
+            await session.exec(statement)
+            await session.commit()
+        set_committed_value(self, "bundle_digest", digest)
+
+    def schedule_bundle(self, problem: "Problem") -> None:
+        """
+        Build the bundle in the background if it is missing, judgers fetch
+        the files from lakefs until it is built. A failed build is retried
+        when the config is used again, e.g., claimed by a judger.
+        """
+        if self.bundle_digest is not None or not settings.judge_bundle:
+            return
+        if self.id in pending_bundles:
+            return
+        failed_at = failed_bundles.get(self.id)
+        if (
+            failed_at is not None
+            and time.monotonic() - failed_at < BUNDLE_RETRY_INTERVAL
+        ):
+            return
+        config_id = self.id
+        # the problem is read now, it may be expired by the request later
+        task = asyncio.create_task(self.update_bundle(LakeFSProblemConfig(problem)))
+        pending_bundles[config_id] = task
+        task.add_done_callback(lambda _: pending_bundles.pop(config_id, None))
+
     @classmethod
     async def make_commit(
-        cls, problem: "Problem", committer: "User", commit: ProblemConfigCommit
+        cls,
+        problem: "Problem",
+        committer: Optional["User"],
+        commit: ProblemConfigCommit,
     ) -> "ProblemConfig":
         def sync_func() -> Commit:
             lakefs_problem_config = LakeFSProblemConfig(problem)
@@ -62,10 +134,12 @@ class ProblemConfig(BaseORMModel, ProblemConfigDetail, table=True):  # type: ign
             await problem.save_model()
             problem_config = cls(
                 problem_id=problem.id,
-                committer_id=committer.id,
+                committer_id=committer.id if committer else None,
                 commit_id=commit_result.id,
             )
             await problem_config.save_model()
+            # a large config is not bundled while the request is waiting
+            problem_config.schedule_bundle(problem)
         except ElephantError as e:
             raise BizError(ErrorCode.FileValidationError, e.message)
         return problem_config
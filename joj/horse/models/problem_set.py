@@ -1,20 +1,31 @@
-from typing import TYPE_CHECKING, List, Optional
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional
 from uuid import UUID
 
-from sqlalchemy import event
-from sqlalchemy.ext.orderinglist import ordering_list
+from sqlalchemy import Integer, column, event, func, update, values
 from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
-from sqlmodel import Field, Relationship
+from sqlalchemy.sql.expression import Select, Update
+from sqlmodel import Field, Relationship, select
 from sqlmodel.sql.sqltypes import GUID
 
 from joj.horse.models.base import DomainURLORMModel, url_pre_save
 from joj.horse.models.link_tables import ProblemProblemSetLink
-from joj.horse.schemas.base import Operation
+from joj.horse.schemas.base import Operation, utcnow
 from joj.horse.schemas.problem_set import ProblemSetDetail
+from joj.horse.schemas.score import ProblemSetProgress, ProgressCell, ProgressRow
+from joj.horse.schemas.statistics import JudgeStatistics
+from joj.horse.schemas.user import UserPreview
+from joj.horse.services.db import db_session
+from joj.horse.services.statistics import get_judge_statistics_store
 from joj.horse.utils.errors import BizError, ErrorCode
 
 if TYPE_CHECKING:
     from joj.horse.models import Domain, Problem, Record, User
+    from joj.horse.schemas.query import PaginationQuery
+
+# positions of problems are spread by this gap, so a problem is inserted or
+# moved between two others by updating its own link only
+PROBLEM_POSITION_GAP = 1024
 
 
 class ProblemSet(DomainURLORMModel, ProblemSetDetail, table=True):  # type: ignore[call-arg]
@@ -50,10 +61,7 @@ class ProblemSet(DomainURLORMModel, ProblemSetDetail, table=True):  # type: igno
     # maintain the order of many to many relationship
     problem_problem_set_links: List[ProblemProblemSetLink] = Relationship(
         back_populates="problem_set",
-        sa_relationship_kwargs={
-            "order_by": "ProblemProblemSetLink.position",
-            "collection_class": ordering_list("position"),
-        },
+        sa_relationship_kwargs={"order_by": "ProblemProblemSetLink.position"},
     )
 
     problems: List["Problem"] = Relationship(
@@ -66,6 +74,184 @@ class ProblemSet(DomainURLORMModel, ProblemSetDetail, table=True):  # type: igno
     )
     records: List["Record"] = Relationship(back_populates="problem_set")
 
+    def is_scoreboard_frozen(self) -> bool:
+        return self.lock_at is not None and datetime.now(timezone.utc) >= self.lock_at
+
+    async def get_statistics(self) -> JudgeStatistics:
+        store = get_judge_statistics_store()
+        return await store.get(f"problem_sets:{self.id}")
+
+    async def get_problem_ids(self) -> List[UUID]:
+        statement = (
+            select(ProblemProblemSetLink.problem_id)
+            .where(ProblemProblemSetLink.problem_set_id == self.id)
+            .order_by(ProblemProblemSetLink.position)
+        )
+        return (await self.session_exec(statement)).all()
+
+    def find_progress_statement(
+        self, pagination: Optional["PaginationQuery"]
+    ) -> Select:
+        """
+        The latest record of each user in a page of domain users on each
+        problem, in one statement. DISTINCT ON walks the records index of
+        (problem_set_id, committer_id, problem_id, created_at) once.
+        """
+        from joj.horse import models
+
+        users = (
+            select(models.User.id, models.User.username, models.User.gravatar)
+            .join(models.DomainUser, models.DomainUser.user_id == models.User.id)
+            .where(models.DomainUser.domain_id == self.domain_id)
+            .order_by(models.User.username, models.User.id)
+        )
+        users = models.User.apply_pagination(users, pagination).cte("page_users")
+        latest_records = (
+            select(
+                models.Record.committer_id,
+                models.Record.problem_id,
+                models.Record.id,
+                models.Record.state,
+                models.Record.score,
+                models.Record.created_at,
+            )
+            .where(models.Record.problem_set_id == self.id)
+            .where(models.Record.committer_id.in_(select(users.c.id)))  # type: ignore
+            .distinct(models.Record.committer_id, models.Record.problem_id)
+            .order_by(
+                models.Record.committer_id,
+                models.Record.problem_id,
+                models.Record.created_at.desc(),  # type: ignore
+            )
+            .subquery("latest_records")
+        )
+        return (
+            select(
+                users.c.id.label("user_id"),
+                users.c.username,
+                users.c.gravatar,
+                latest_records.c.problem_id,
+                latest_records.c.id.label("record_id"),
+                latest_records.c.state,
+                latest_records.c.score,
+                latest_records.c.created_at,
+            )
+            .select_from(users)
+            .outerjoin(latest_records, latest_records.c.committer_id == users.c.id)
+            .order_by(users.c.username, users.c.id)
+        )
+
+    async def get_progress(
+        self, pagination: Optional["PaginationQuery"]
+    ) -> ProblemSetProgress:
+        from joj.horse import models
+
+        problem_ids = await self.get_problem_ids()
+        columns = {problem_id: i for i, problem_id in enumerate(problem_ids)}
+        count = await models.DomainUser.count(
+            select(models.DomainUser).where(
+                models.DomainUser.domain_id == self.domain_id
+            )
+        )
+        rows = (await self.session_exec(self.find_progress_statement(pagination))).all()
+        results: Dict[UUID, ProgressRow] = {}
+        for row in rows:
+            result = results.get(row.user_id)
+            if result is None:
+                result = ProgressRow(
+                    user=UserPreview(
+                        id=row.user_id, username=row.username, gravatar=row.gravatar
+                    ),
+                    cells=[None] * len(problem_ids),
+                )
+                results[row.user_id] = result
+            # records of problems removed from the problem set are ignored
+            if row.problem_id in columns:
+                result.cells[columns[row.problem_id]] = ProgressCell(
+                    record_id=row.record_id,
+                    state=row.state,
+                    score=row.score,
+                    created_at=row.created_at,
+                )
+        return ProblemSetProgress(
+            problem_ids=problem_ids, count=count, results=list(results.values())
+        )
+
+    async def compact_problem_positions(self) -> None:
+        """Spread the positions of all problems by the gap again."""
+        ranks = (
+            select(
+                ProblemProblemSetLink.problem_id,
+                func.row_number()
+                .over(
+                    order_by=(
+                        ProblemProblemSetLink.position,
+                        ProblemProblemSetLink.problem_id,
+                    )
+                )
+                .label("rank"),
+            )
+            .where(ProblemProblemSetLink.problem_set_id == self.id)
+            .subquery("ranks")
+        )
+        statement = (
+            update(ProblemProblemSetLink)
+            .where(ProblemProblemSetLink.problem_set_id == self.id)
+            .where(ProblemProblemSetLink.problem_id == ranks.c.problem_id)
+            .values(position=ranks.c.rank * PROBLEM_POSITION_GAP)
+        )
+        async with db_session() as session:
+            await session.exec(statement)
+            await session.commit()
+
+    async def get_new_problem_position(
+        self, problem_id: UUID, index: Optional[int]
+    ) -> int:
+        """
+        The position placing the problem at the index of the other problems,
+        in the middle of its neighbours. Positions are compacted only when two
+        neighbours are adjacent, which takes about log2(gap) inserts at the
+        same place.
+        """
+        statement = (
+            select(ProblemProblemSetLink.position)
+            .where(ProblemProblemSetLink.problem_set_id == self.id)
+            .where(ProblemProblemSetLink.problem_id != problem_id)
+        )
+        if index is None:
+            # append to the end
+            statement = statement.order_by(
+                ProblemProblemSetLink.position.desc()  # type: ignore[attr-defined]
+            ).limit(1)
+            last = (await self.session_exec(statement)).first()
+            return PROBLEM_POSITION_GAP if last is None else last + PROBLEM_POSITION_GAP
+        statement = statement.order_by(ProblemProblemSetLink.position)
+        for _ in range(2):
+            if index <= 0:
+                neighbours = [None] + (
+                    await self.session_exec(statement.limit(1))
+                ).all()
+            else:
+                neighbours = (
+                    await self.session_exec(statement.offset(index - 1).limit(2))
+                ).all()
+            if not neighbours:  # out of range, append to the end
+                return await self.get_new_problem_position(problem_id, None)
+            if len(neighbours) == 1:
+                prev_position, next_position = neighbours[0], None
+            else:
+                prev_position, next_position = neighbours
+            if prev_position is None and next_position is None:
+                return PROBLEM_POSITION_GAP
+            if prev_position is None:
+                return next_position - PROBLEM_POSITION_GAP
+            if next_position is None:
+                return prev_position + PROBLEM_POSITION_GAP
+            if next_position - prev_position > 1:
+                return (prev_position + next_position) // 2
+            await self.compact_problem_positions()
+        raise BizError(ErrorCode.IntegrityError, "failed to find a position")
+
     async def operate_problem(
         self, problem: "Problem", operation: Operation, position: Optional[int] = None
     ) -> None:
@@ -83,16 +269,62 @@ class ProblemSet(DomainURLORMModel, ProblemSetDetail, table=True):  # type: igno
 
         if operation == Operation.Read:
             return
-        if operation in (Operation.Update, Operation.Delete):
-            self.problem_problem_set_links.remove(link)
-        if operation in (Operation.Create, Operation.Update):
-            if position is None:
-                self.problem_problem_set_links.append(link)
+        if operation != Operation.Delete:
+            link.position = await self.get_new_problem_position(problem.id, position)
+        # only the link of the problem is written, other links are untouched
+        async with db_session() as session:
+            if operation == Operation.Delete:
+                session.sync_session.delete(link)
             else:
-                self.problem_problem_set_links.insert(position, link)
-        if operation == Operation.Delete:
-            await link.delete_model(commit=False)
-        await self.save_model()
+                session.sync_session.add(link)
+            await session.exec(self.get_touch_statement())
+            await session.commit()
+        await self.refresh_model()
+
+    async def reorder_problems(self, problem_ids: List[UUID]) -> None:
+        """Apply a full ordering of the problems in one statement."""
+        if len(problem_ids) != len(set(problem_ids)) or set(problem_ids) != set(
+            await self.get_problem_ids()
+        ):
+            raise BizError(
+                ErrorCode.IntegrityError,
+                "the ordering should contain each problem of the problem set once",
+            )
+        if not problem_ids:
+            return
+        ordering = values(
+            column("problem_id", GUID),
+            column("position", Integer),
+            name="ordering",
+        ).data(
+            [
+                (problem_id, (i + 1) * PROBLEM_POSITION_GAP)
+                for i, problem_id in enumerate(problem_ids)
+            ]
+        )
+        statement = (
+            update(ProblemProblemSetLink)
+            .where(ProblemProblemSetLink.problem_set_id == self.id)
+            .where(ProblemProblemSetLink.problem_id == ordering.c.problem_id)
+            .values(position=ordering.c.position)
+        )
+        async with db_session() as session:
+            await session.exec(statement)
+            await session.exec(self.get_touch_statement())
+            await session.commit()
+        await self.refresh_model()
+
+    def get_touch_statement(self) -> Update:
+        """
+        The problems are a part of the problem set (e.g., in its etag),
+        changing them is an update of the problem set, committed in the same
+        transaction as the links.
+        """
+        return (
+            update(ProblemSet)
+            .where(ProblemSet.id == self.id)
+            .values(updated_at=utcnow())
+        )
 
 
 event.listen(ProblemSet, "before_insert", url_pre_save)
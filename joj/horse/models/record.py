@@ -1,12 +1,16 @@
-from typing import TYPE_CHECKING, List, Optional
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 from uuid import UUID, uuid4
 
+import orjson
 from celery import Celery
 from celery.result import AsyncResult
 from fastapi import BackgroundTasks
 from loguru import logger
-from sqlalchemy.schema import Column, ForeignKey
-from sqlmodel import Field, Relationship
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.schema import Column, ForeignKey, Index
+from sqlmodel import Field, Relationship, select, update
 from sqlmodel.sql.sqltypes import GUID
 from starlette.concurrency import run_in_threadpool
 
@@ -14,8 +18,16 @@ from joj.horse.config import settings
 from joj.horse.models.base import BaseORMModel
 from joj.horse.schemas.cache import get_redis_cache
 from joj.horse.schemas.problem import ProblemSolutionSubmit
-from joj.horse.schemas.record import RecordDetail, RecordPreview, RecordState
-from joj.horse.services.lakefs import LakeFSRecord
+from joj.horse.schemas.record import (
+    RecordCase,
+    RecordDetail,
+    RecordPreview,
+    RecordState,
+)
+from joj.horse.services.db import db_session
+from joj.horse.services.lakefs import RECORD_BUNDLE_NAME, LakeFSRecord
+from joj.horse.services.pubsub import get_pubsub
+from joj.horse.services.statistics import get_judge_statistics_store
 from joj.horse.utils.errors import BizError, ErrorCode
 
 if TYPE_CHECKING:
@@ -24,7 +36,18 @@ if TYPE_CHECKING:
 
 class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
     __tablename__ = "records"
-    # __table_args__ = (UniqueConstraint("domain_id", "url"),)
+    __table_args__ = (
+        # latest records of users in a problem set, see find_progress_statement
+        Index(
+            "ix_records_problem_set_latest",
+            "problem_set_id",
+            "committer_id",
+            "problem_id",
+            "created_at",
+        ),
+        # identical submissions of a user, see find_duplicate
+        Index("ix_records_committer_fingerprint", "committer_id", "fingerprint"),
+    )
 
     domain_id: UUID = Field(
         sa_column=Column(
@@ -74,6 +97,16 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
         sa_relationship_kwargs={"foreign_keys": "[Record.judger_id]"},
     )
 
+    # sha256 of the submitted files, language and problem config, never
+    # exposed in the schemas since it identifies the code
+    fingerprint: Optional[str] = Field(None, nullable=True)
+
+    # the first finished result is counted (the statistics and the
+    # scoreboard tries), a retried or rejudged result is never counted again
+    counted: bool = Field(
+        False, nullable=False, sa_column_kwargs={"server_default": "false"}
+    )
+
     @classmethod
     async def submit(
         cls,
@@ -91,6 +124,10 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
         if problem_submit.language not in problem.languages:
             raise BizError(ErrorCode.UnsupportedLanguageError)
         problem_set_id = problem_set.id if problem_set else None
+        fingerprint = await run_in_threadpool(
+            cls.get_fingerprint, problem_submit, problem_config.id
+        )
+        duplicate = await cls.find_duplicate(user.id, problem.id, fingerprint)
         record = cls(
             domain_id=problem.domain_id,
             problem_set_id=problem_set_id,
@@ -98,12 +135,15 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
             problem_config_id=problem_config.id,
             committer_id=user.id,
             language=problem_submit.language,
+            fingerprint=fingerprint,
         )
+        reuse_result = duplicate is not None and await duplicate.is_result_reusable()
+        if reuse_result:
+            assert duplicate is not None
+            record.copy_result(duplicate)
 
-        await record.save_model(commit=False, refresh=False)
-        problem.num_submit += 1
-        await problem.save_model(commit=True, refresh=True)
-        await record.refresh_model()
+        await record.save_model()
+        await problem.increment_counter(problem.id, "num_submit")
 
         key = cls.get_user_latest_record_key(problem_set_id, problem.id, user.id)
         value = RecordPreview(
@@ -111,30 +151,155 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
         )
 
         cache = get_redis_cache()
-        await cache.set(key, value, namespace="user_latest_records")
+        await cache.set(key, {"record": value.dict()}, namespace="user_latest_records")
+
+        if reuse_result:
+            logger.info("reuse the result of record {}: {}", duplicate, record)
+            await record.finish_judge(reused=True)
+            return record
 
         background_tasks.add_task(
             record.upload,
             celery_app=celery_app,
             problem_submit=problem_submit,
             problem=problem,
+            duplicate=duplicate,
         )
 
         return record
 
+    @staticmethod
+    def get_fingerprint(
+        problem_submit: ProblemSolutionSubmit, problem_config_id: UUID
+    ) -> str:
+        """
+        Hash of the submitted files, the language and the problem config, the
+        files are read in chunks and rewound. Blocking, call it in a thread.
+        """
+        digest = sha256(f"{problem_config_id}\0{problem_submit.language}".encode())
+        for file in sorted(problem_submit.files, key=lambda x: x.filename):
+            file_digest = sha256()
+            for chunk in iter(lambda: file.file.read(64 * 1024), b""):
+                file_digest.update(chunk)
+            file.file.seek(0)
+            digest.update(f"\0{file.filename}\0".encode())
+            digest.update(file_digest.digest())
+        return digest.hexdigest()
+
+    @classmethod
+    async def find_duplicate(
+        cls, committer_id: UUID, problem_id: UUID, fingerprint: str
+    ) -> Optional["Record"]:
+        """
+        The latest uploaded record of the committer with the same fingerprint.
+        Only records of the same committer are reused, so the history of a
+        user never depends on the submissions of others.
+        """
+        statement = (
+            cls.sql_select()
+            .where(cls.committer_id == committer_id)
+            .where(cls.fingerprint == fingerprint)
+            .where(cls.problem_id == problem_id)
+            .where(cls.commit_id.isnot(None))  # type: ignore[union-attr]
+            .order_by(cls.created_at.desc())  # type: ignore
+            .limit(1)
+        )
+        result = await cls.session_exec(statement)
+        return result.one_or_none()
+
+    async def is_result_reusable(self) -> bool:
+        from joj.horse import models
+
+        # a failed judge may be caused by the judger, it is never reused
+        if self.state not in (RecordState.accepted, RecordState.rejected):
+            return False
+        if self.created_at is None:
+            return False
+        domain = await models.Domain.one_or_none(id=self.domain_id)
+        if domain is None or domain.duplicate_result_seconds <= 0:
+            return False
+        window = timedelta(seconds=domain.duplicate_result_seconds)
+        return datetime.now(tz=timezone.utc) - self.created_at <= window
+
+    def copy_result(self, record: "Record") -> None:
+        self.commit_id = record.commit_id
+        self.bundled = record.bundled
+        self.state = record.state
+        self.score = record.score
+        self.time_ms = record.time_ms
+        self.memory_kb = record.memory_kb
+        self.cases = record.cases
+        # not judged by any judger, the result is copied now (judged_at is a
+        # naive column in utc)
+        self.judger_id = None
+        self.judged_at = datetime.utcnow()
+
+    async def mark_counted(self) -> bool:
+        """
+        Mark the record as counted, False if it has been counted. Atomic, only
+        one of concurrent results (e.g., retries of the judger) wins.
+        """
+        statement = (
+            update(Record)
+            .where(Record.id == self.id)
+            .where(Record.counted.is_(False))  # type: ignore[attr-defined]
+            .values(counted=True)
+            .returning(Record.id)
+        )
+        async with db_session() as session:
+            result = await session.execute(statement)
+            counted = result.first() is not None
+            await session.commit()
+        set_committed_value(self, "counted", True)
+        return counted
+
+    async def finish_judge(self, reused: bool = False) -> None:
+        """
+        Update the statistics and scoreboard after a result is saved. A reused
+        result (see copy_result) is not added to the judge statistics again.
+        """
+        from joj.horse import models
+
+        first = RecordState(self.state).is_finished() and await self.mark_counted()
+        if first and not reused:
+            await self.update_statistics()
+        if first and self.state == RecordState.accepted and self.problem_id is not None:
+            await models.Problem.increment_counter(self.problem_id, "num_accept")
+        if self.problem_set_id is not None:
+            await self.fetch_related("problem_set")
+            await models.ScoreboardEntry.update_by_record(
+                self, self.problem_set, count_try=first
+            )
+        await self.publish_state()
+
     async def upload(
         self,
         celery_app: Celery,
         problem_submit: ProblemSolutionSubmit,
         problem: "Problem",
+        duplicate: Optional["Record"] = None,
     ) -> None:
         def sync_func() -> None:
+            if duplicate is not None:
+                # an identical commit exists, nothing is uploaded again
+                self.state = RecordState.queueing
+                self.commit_id = duplicate.commit_id
+                self.bundled = duplicate.bundled
+                return
             lakefs_record = LakeFSRecord(problem, self)
-            lakefs_record.ensure_branch()
-            lakefs_record.upload_multiple_files(
-                [file.filename for file in problem_submit.files],
-                [file.file for file in problem_submit.files],
-            )
+            filenames = [file.filename for file in problem_submit.files]
+            files = [file.file for file in problem_submit.files]
+            if settings.record_bundle:
+                lakefs_record.upload_bundle(
+                    RECORD_BUNDLE_NAME,
+                    filenames,
+                    files,
+                    {"language": problem_submit.language},
+                )
+                self.bundled = True
+            else:
+                lakefs_record.ensure_branch()
+                lakefs_record.upload_multiple_files(filenames, files)
 
             commit = lakefs_record.commit(f"record: {self.id}")
             logger.info(commit)
@@ -152,6 +317,7 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
             logger.exception(e)
             self.state = RecordState.failed
             await self.save_model()
+        await self.publish_state()
 
     async def create_task(self, celery_app: Celery) -> AsyncResult:
         # create a task in celery with this record
@@ -163,6 +329,51 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
         )
         return result
 
+    @classmethod
+    def get_channel(cls, record_id: UUID) -> str:
+        return f"record:{record_id}"
+
+    async def publish_event(self, event: str, data: Dict[str, Any]) -> None:
+        # pushing to the subscribers is best effort, never fail the judger
+        message = orjson.dumps({"event": event, "data": data})
+        try:
+            await get_pubsub().publish(self.get_channel(self.id), message)
+        except Exception as e:
+            logger.error("publish record event failed: {}", self.id)
+            logger.exception(e)
+
+    async def publish_state(self) -> None:
+        await self.invalidate_user_latest_record()
+        data = RecordDetail.from_orm(self).dict(by_alias=True, exclude={"cases"})
+        await self.publish_event("record", data)
+
+    async def invalidate_user_latest_record(self) -> None:
+        # the cached latest record of the committer holds the state,
+        # it is reloaded on the next read after the state changes
+        if self.problem_id is None or self.committer_id is None:
+            return
+        key = self.get_user_latest_record_key(
+            self.problem_set_id, self.problem_id, self.committer_id
+        )
+        try:
+            await get_redis_cache().delete(key, namespace="user_latest_records")
+        except Exception as e:
+            logger.error("invalidate latest record cache failed: {}", self.id)
+            logger.exception(e)
+
+    async def publish_case(self, index: int) -> None:
+        case = RecordCase(**self.cases[index]).dict(by_alias=True)
+        await self.publish_event("case", {"index": index, **case})
+
+    async def update_statistics(self) -> None:
+        scopes = []
+        if self.problem_id is not None:
+            scopes.append(f"problems:{self.problem_id}")
+        if self.problem_set_id is not None:
+            scopes.append(f"problem_sets:{self.problem_set_id}")
+        store = get_judge_statistics_store()
+        await store.add_record(scopes, RecordDetail.from_orm(self))
+
     @classmethod
     def get_user_latest_record_key(
         cls, problem_set_id: Optional[UUID], problem_id: UUID, user_id: UUID
@@ -221,6 +432,34 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
             )
         return record
 
+    @classmethod
+    async def find_user_latest_records(
+        cls, problem_set_id: Optional[UUID], problem_ids: List[UUID], user_id: UUID
+    ) -> Dict[UUID, Optional[RecordPreview]]:
+        statement = (
+            select(
+                cls.problem_id,
+                *cls.get_schema_columns(RecordPreview),
+            )
+            .where(cls.problem_id.in_(problem_ids))  # type: ignore[union-attr]
+            .where(cls.committer_id == user_id)
+            .distinct(cls.problem_id)
+            .order_by(cls.problem_id, cls.created_at.desc())  # type: ignore
+        )
+        if problem_set_id is None:
+            statement = statement.where(cls.problem_set_id.is_(None))  # type: ignore
+        else:
+            statement = statement.where(cls.problem_set_id == problem_set_id)
+        result = await cls.session_exec(statement)
+        records: Dict[UUID, Optional[RecordPreview]] = {
+            problem_id: None for problem_id in problem_ids
+        }
+        for row in result.all():
+            records[row.problem_id] = RecordPreview(
+                **{name: row._mapping[name] for name in RecordPreview.__fields__}
+            )
+        return records
+
     @classmethod
     async def get_user_latest_records(
         cls, problem_set_id: Optional[UUID], problem_ids: List[UUID], user_id: UUID
@@ -233,30 +472,35 @@ class Record(BaseORMModel, RecordDetail, table=True):  # type: ignore[call-arg]
         values = []
         if keys:
             values = await cache.multi_get(keys, namespace="user_latest_records")
-        records = []
-        updated_cache_pairs = []
+        records: List[Optional[RecordPreview]] = []
+        missing_problem_ids = []
         for i, value in enumerate(values):
             record = None
             try:
                 data = value["record"]
                 if data is not None:
                     record = RecordPreview(**data)
-                use_cache = True
             except (TypeError, ValueError, KeyError):
-                use_cache = False
+                missing_problem_ids.append(problem_ids[i])
             except Exception as e:
-                use_cache = False
+                missing_problem_ids.append(problem_ids[i])
                 logger.error("error when loading records from cache:")
                 logger.exception(e)
-            if not use_cache:
-                record = await cls.get_user_latest_record(
-                    problem_set_id=problem_set_id,
-                    problem_id=problem_ids[i],
-                    user_id=user_id,
-                    use_cache=False,
-                )
-                updated_cache_pairs.append((keys[i], record.dict() if record else None))
             records.append(record)
+        updated_cache_pairs = []
+        if missing_problem_ids:
+            # all cache misses are loaded by one query instead of one per problem
+            latest_records = await cls.find_user_latest_records(
+                problem_set_id, missing_problem_ids, user_id
+            )
+            for i, problem_id in enumerate(problem_ids):
+                if problem_id not in latest_records:
+                    continue
+                record = latest_records[problem_id]
+                records[i] = record
+                updated_cache_pairs.append(
+                    (keys[i], {"record": record.dict() if record else None})
+                )
         if updated_cache_pairs:
             await cache.multi_set(updated_cache_pairs, namespace="user_latest_records")
         logger.info(
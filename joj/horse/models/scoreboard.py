@@ -0,0 +1,447 @@
+import asyncio
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from sqlalchemy import and_, case, func, literal, or_, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.schema import Column, ForeignKey, Index, UniqueConstraint
+from sqlmodel import Field, select
+from sqlmodel.sql.sqltypes import GUID
+
+from joj.horse.models.base import BaseORMModel
+from joj.horse.models.user import User
+from joj.horse.schemas.base import utcnow
+from joj.horse.schemas.cache import get_redis_cache
+from joj.horse.schemas.record import RecordState
+from joj.horse.schemas.score import (
+    Scoreboard,
+    ScoreboardCell as ScoreboardCellSchema,
+    ScoreboardCellBase,
+    ScoreboardEntry as ScoreboardEntrySchema,
+    ScoreboardEntryBase,
+    ScoreboardSnapshot,
+)
+from joj.horse.schemas.user import UserPreview
+from joj.horse.services.db import db_session
+
+if TYPE_CHECKING:
+    from joj.horse.models import ProblemSet, Record
+    from joj.horse.schemas.query import PaginationQuery
+
+# a live page is regenerated at most once in this number of seconds
+SCOREBOARD_SNAPSHOT_INTERVAL = 5
+SCOREBOARD_FROZEN_SNAPSHOT_TTL = 30 * 24 * 60 * 60
+
+# pages being generated in this worker, concurrent misses wait for the first one
+pending_snapshots: Dict[str, asyncio.Event] = {}
+
+
+class ScoreboardCell(BaseORMModel, ScoreboardCellBase, table=True):  # type: ignore[call-arg]
+    """The best result of a user on a problem in a problem set."""
+
+    __tablename__ = "scoreboard_cells"
+    __table_args__ = (UniqueConstraint("problem_set_id", "user_id", "problem_id"),)
+
+    problem_set_id: UUID = Field(
+        sa_column=Column(
+            GUID, ForeignKey("problem_sets.id", ondelete="CASCADE"), nullable=False
+        ),
+    )
+    user_id: UUID = Field(
+        sa_column=Column(
+            GUID, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        ),
+    )
+    problem_id: UUID = Field(
+        sa_column=Column(
+            GUID, ForeignKey("problems.id", ondelete="CASCADE"), nullable=False
+        ),
+    )
+    record_id: Optional[UUID] = Field(
+        sa_column=Column(
+            GUID, ForeignKey("records.id", ondelete="SET NULL"), nullable=True
+        ),
+    )
+
+
+class ScoreboardEntry(BaseORMModel, ScoreboardEntryBase, table=True):  # type: ignore[call-arg]
+    """The total result of a user in a problem set, one row per participant."""
+
+    __tablename__ = "scoreboard_entries"
+    __table_args__ = (
+        UniqueConstraint("problem_set_id", "user_id"),
+        # a page of the scoreboard is an index range scan
+        Index(
+            "ix_scoreboard_entries_ranking",
+            "problem_set_id",
+            text("score DESC"),
+            "penalty_seconds",
+        ),
+    )
+
+    problem_set_id: UUID = Field(
+        sa_column=Column(
+            GUID, ForeignKey("problem_sets.id", ondelete="CASCADE"), nullable=False
+        ),
+    )
+    user_id: UUID = Field(
+        sa_column=Column(
+            GUID, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        ),
+    )
+
+    @classmethod
+    async def update_by_record(
+        cls, record: "Record", problem_set: "ProblemSet", count_try: bool = True
+    ) -> None:
+        """
+        Fold a judged record into the scoreboard of its problem set.
+
+        The entry row is upserted first so that it is locked until commit,
+        concurrent results of the same user are applied one after another
+        and the totals never miss a cell. Results of other users are not
+        blocked, and the cost does not depend on the number of participants.
+        A record counts as a try only once (count_try), a rejudged result
+        can still improve the cell without another try.
+        """
+        if record.state not in (RecordState.accepted, RecordState.rejected):
+            return
+        if record.committer_id is None or record.problem_id is None:
+            return
+        start_at = problem_set.unlock_at or problem_set.created_at
+        penalty_seconds = 0
+        if start_at is not None and record.created_at is not None:
+            penalty_seconds = max(
+                0, int((record.created_at - start_at).total_seconds())
+            )
+
+        entry_table = cls.__table__  # type: ignore[attr-defined]
+        cell_table = ScoreboardCell.__table__  # type: ignore[attr-defined]
+        user_filter = and_(
+            cell_table.c.problem_set_id == problem_set.id,
+            cell_table.c.user_id == record.committer_id,
+        )
+
+        lock_statement = (
+            insert(entry_table)
+            .values(
+                id=uuid4(), problem_set_id=problem_set.id, user_id=record.committer_id
+            )
+            .on_conflict_do_update(
+                index_elements=["problem_set_id", "user_id"],
+                set_={"updated_at": utcnow()},
+            )
+        )
+
+        cell_statement = insert(cell_table).values(
+            id=uuid4(),
+            problem_set_id=problem_set.id,
+            user_id=record.committer_id,
+            problem_id=record.problem_id,
+            record_id=record.id,
+            score=record.score,
+            tries=1,
+            penalty_seconds=penalty_seconds,
+            accepted=record.state == RecordState.accepted,
+        )
+        excluded = cell_statement.excluded
+        # higher score wins, the earlier record wins a tie
+        better = or_(
+            excluded.score > cell_table.c.score,
+            and_(
+                excluded.score == cell_table.c.score,
+                excluded.penalty_seconds < cell_table.c.penalty_seconds,
+            ),
+        )
+        cell_statement = cell_statement.on_conflict_do_update(
+            index_elements=["problem_set_id", "user_id", "problem_id"],
+            set_={
+                "tries": cell_table.c.tries + int(count_try),
+                "score": case((better, excluded.score), else_=cell_table.c.score),
+                "penalty_seconds": case(
+                    (better, excluded.penalty_seconds),
+                    else_=cell_table.c.penalty_seconds,
+                ),
+                "record_id": case(
+                    (better, excluded.record_id), else_=cell_table.c.record_id
+                ),
+                "accepted": or_(cell_table.c.accepted, excluded.accepted),
+                "updated_at": utcnow(),
+            },
+        )
+
+        totals = select(
+            literal(uuid4(), GUID),
+            literal(problem_set.id, GUID),
+            literal(record.committer_id, GUID),
+            func.coalesce(func.sum(cell_table.c.score), 0),
+            func.coalesce(func.sum(cell_table.c.tries), 0),
+            func.coalesce(
+                func.sum(
+                    case(
+                        (cell_table.c.score > 0, cell_table.c.penalty_seconds),
+                        else_=0,
+                    )
+                ),
+                0,
+            ),
+            func.count().filter(cell_table.c.accepted),
+        ).where(user_filter)
+        total_columns = ["score", "tries", "penalty_seconds", "num_accept"]
+        entry_statement = insert(entry_table).from_select(
+            ["id", "problem_set_id", "user_id", *total_columns], totals
+        )
+        entry_statement = entry_statement.on_conflict_do_update(
+            index_elements=["problem_set_id", "user_id"],
+            set_={
+                **{k: entry_statement.excluded[k] for k in total_columns},
+                "updated_at": utcnow(),
+            },
+        )
+
+        async with db_session() as session:
+            await session.exec(lock_statement)
+            await session.exec(cell_statement)
+            await session.exec(entry_statement)
+            await session.commit()
+
+    @classmethod
+    async def get_page(
+        cls, problem_set_id: UUID, pagination: Optional["PaginationQuery"]
+    ) -> Tuple[
+        List[Tuple["ScoreboardEntry", User]], Dict[UUID, List[ScoreboardCell]], int
+    ]:
+        """
+        Fetch one page of the ranking together with the cells of the users in
+        that page only, so the cost is O(page) instead of O(participants).
+        """
+        statement = (
+            select(cls, User)
+            .join(User, User.id == cls.user_id)  # type: ignore[arg-type]
+            .where(cls.problem_set_id == problem_set_id)
+            .order_by(
+                cls.score.desc(),  # type: ignore[attr-defined]
+                cls.penalty_seconds.asc(),  # type: ignore[attr-defined]
+                cls.user_id,
+            )
+        )
+        count = await cls.count(statement)
+        statement = cls.apply_pagination(statement, pagination)
+        rows = (await cls.session_exec(statement)).all()
+        cells: Dict[UUID, List[ScoreboardCell]] = {
+            entry.user_id: [] for entry, _ in rows
+        }
+        if rows:
+            cell_statement = select(ScoreboardCell).where(
+                ScoreboardCell.problem_set_id == problem_set_id,
+                ScoreboardCell.user_id.in_(cells.keys()),  # type: ignore[attr-defined]
+            )
+            for cell in (await ScoreboardCell.session_exec(cell_statement)).all():
+                cells[cell.user_id].append(cell)
+        return rows, cells, count
+
+    @classmethod
+    async def get_scoreboard(
+        cls, problem_set: "ProblemSet", pagination: Optional["PaginationQuery"]
+    ) -> Scoreboard:
+        problem_ids = await problem_set.get_problem_ids()
+        rows, cells, count = await cls.get_page(problem_set.id, pagination)
+        offset = pagination.offset if pagination else 0
+        results = [
+            ScoreboardEntrySchema(
+                **entry.dict(),
+                rank=offset + i + 1,
+                user=UserPreview.from_orm(user),
+                cells=[ScoreboardCellSchema.from_orm(x) for x in cells[entry.user_id]],
+            )
+            for i, (entry, user) in enumerate(rows)
+        ]
+        return Scoreboard(problem_ids=problem_ids, count=count, results=results)
+
+    @classmethod
+    async def get_frozen_scoreboard(
+        cls, problem_set: "ProblemSet"
+    ) -> Tuple[Scoreboard, bool]:
+        """
+        Rebuild the whole scoreboard from the records created before the
+        freeze time (lock_at), folded by the same rules as update_by_record,
+        so a result submitted after the freeze never leaks into the frozen
+        scoreboard, even if a cached one is evicted.
+        Also return whether all these records are judged (settled),
+        otherwise it may still change.
+        """
+        from joj.horse.models import Record
+
+        assert problem_set.lock_at is not None
+        statement = (
+            select(
+                Record.committer_id,
+                Record.problem_id,
+                Record.score,
+                Record.state,
+                Record.created_at,
+            )
+            .where(Record.problem_set_id == problem_set.id)
+            .where(Record.created_at < problem_set.lock_at)
+            .where(Record.committer_id.isnot(None))  # type: ignore[union-attr]
+            .where(Record.problem_id.isnot(None))  # type: ignore[union-attr]
+            .order_by(Record.created_at)
+        )
+        rows = (await cls.session_exec(statement)).all()
+        start_at = problem_set.unlock_at or problem_set.created_at
+        cells: Dict[UUID, Dict[UUID, ScoreboardCellSchema]] = {}
+        settled = True
+        for user_id, problem_id, score, state, created_at in rows:
+            if not RecordState(state).is_finished():
+                settled = False
+            if state not in (RecordState.accepted, RecordState.rejected):
+                continue
+            penalty_seconds = 0
+            if start_at is not None:
+                penalty_seconds = max(0, int((created_at - start_at).total_seconds()))
+            accepted = state == RecordState.accepted
+            user_cells = cells.setdefault(user_id, {})
+            cell = user_cells.get(problem_id)
+            if cell is None:
+                user_cells[problem_id] = ScoreboardCellSchema(
+                    problem_id=problem_id,
+                    score=score,
+                    tries=1,
+                    penalty_seconds=penalty_seconds,
+                    accepted=accepted,
+                )
+                continue
+            cell.tries += 1
+            cell.accepted = cell.accepted or accepted
+            # higher score wins, the earlier record wins a tie
+            if score > cell.score or (
+                score == cell.score and penalty_seconds < cell.penalty_seconds
+            ):
+                cell.score = score
+                cell.penalty_seconds = penalty_seconds
+
+        users: Dict[UUID, User] = {}
+        if cells:
+            user_statement = select(User).where(
+                User.id.in_(cells.keys())  # type: ignore[attr-defined]
+            )
+            users = {x.id: x for x in (await User.session_exec(user_statement)).all()}
+        entries = []
+        for user_id, user_cells in cells.items():
+            if user_id not in users:
+                continue
+            values = list(user_cells.values())
+            entries.append(
+                ScoreboardEntrySchema(
+                    score=sum(x.score for x in values),
+                    tries=sum(x.tries for x in values),
+                    penalty_seconds=sum(
+                        x.penalty_seconds for x in values if x.score > 0
+                    ),
+                    num_accept=sum(1 for x in values if x.accepted),
+                    rank=0,
+                    user=UserPreview.from_orm(users[user_id]),
+                    cells=values,
+                )
+            )
+        entries.sort(key=lambda x: (-x.score, x.penalty_seconds, str(x.user.id)))
+        for i, entry in enumerate(entries):
+            entry.rank = i + 1
+        problem_ids = await problem_set.get_problem_ids()
+        scoreboard = Scoreboard(
+            problem_ids=problem_ids, count=len(entries), results=entries
+        )
+        return scoreboard, settled
+
+    @classmethod
+    async def get_frozen_page(
+        cls, problem_set: "ProblemSet", pagination: Optional["PaginationQuery"]
+    ) -> Tuple[Scoreboard, bool]:
+        """
+        Cut a page from the frozen scoreboard, which is cached as a whole so
+        that all page sizes agree with each other.
+        """
+        cache = get_redis_cache()
+        key = cls.get_snapshot_key(problem_set, None, True)
+        cached = await cache.get(key, namespace="scoreboards")
+        if cached is None:
+            cached = await cls.get_frozen_scoreboard(problem_set)
+            ttl = SCOREBOARD_FROZEN_SNAPSHOT_TTL
+            if not cached[1]:
+                ttl = SCOREBOARD_SNAPSHOT_INTERVAL
+            await cache.set(key, cached, ttl=ttl, namespace="scoreboards")
+        scoreboard, settled = cached
+        if pagination is not None:
+            start = pagination.offset
+            scoreboard = Scoreboard(
+                problem_ids=scoreboard.problem_ids,
+                count=scoreboard.count,
+                results=scoreboard.results[start : start + pagination.limit],
+            )
+        return scoreboard, settled
+
+    @staticmethod
+    def get_snapshot_key(
+        problem_set: "ProblemSet",
+        pagination: Optional["PaginationQuery"],
+        frozen: bool,
+    ) -> str:
+        if frozen and problem_set.lock_at is not None:
+            # a new freeze time never serves the snapshot of the old one
+            mode = f"frozen-{int(problem_set.lock_at.timestamp())}"
+        else:
+            mode = "live"
+        if pagination is None:
+            return f"{problem_set.id}:{mode}"
+        return f"{problem_set.id}:{mode}:{pagination.offset}:{pagination.limit}"
+
+    @classmethod
+    async def get_snapshot(
+        cls,
+        problem_set: "ProblemSet",
+        pagination: Optional["PaginationQuery"],
+        frozen: bool,
+    ) -> ScoreboardSnapshot:
+        """
+        Serve a materialized page of the scoreboard from redis.
+
+        A live page expires after SCOREBOARD_SNAPSHOT_INTERVAL seconds, so the
+        ranking is computed at most once per interval no matter how many
+        clients are polling. A frozen page is cut from the frozen scoreboard
+        (see get_frozen_scoreboard), so every page size is consistent and
+        nothing submitted after the freeze time is shown. It is kept until
+        the records before the freeze time are all judged.
+        """
+        cache = get_redis_cache()
+        key = cls.get_snapshot_key(problem_set, pagination, frozen)
+        if frozen:
+            # the key of the whole frozen scoreboard is not a page
+            key += ":page"
+        snapshot = await cache.get(key, namespace="scoreboards")
+        if snapshot is not None:
+            return snapshot
+        pending = pending_snapshots.get(key)
+        if pending is not None:
+            await pending.wait()
+            snapshot = await cache.get(key, namespace="scoreboards")
+            if snapshot is not None:
+                return snapshot
+
+        pending = asyncio.Event()
+        pending_snapshots[key] = pending
+        try:
+            if frozen:
+                scoreboard, settled = await cls.get_frozen_page(problem_set, pagination)
+                ttl = SCOREBOARD_FROZEN_SNAPSHOT_TTL
+                if not settled:
+                    ttl = SCOREBOARD_SNAPSHOT_INTERVAL
+            else:
+                scoreboard = await cls.get_scoreboard(problem_set, pagination)
+                ttl = SCOREBOARD_SNAPSHOT_INTERVAL
+            snapshot = ScoreboardSnapshot.from_scoreboard(scoreboard)
+            await cache.set(key, snapshot, ttl=ttl, namespace="scoreboards")
+        finally:
+            pending.set()
+            if pending_snapshots.get(key) is pending:
+                del pending_snapshots[key]
+        return snapshot
@@ -47,6 +47,7 @@ from joj.horse.schemas.permission import DomainPermission as DomainPermission
 from joj.horse.schemas.problem import (
     Problem as Problem,
     ProblemClone as ProblemClone,
+    ProblemCounters as ProblemCounters,
     ProblemCreate as ProblemCreate,
     ProblemDetail as ProblemDetail,
     ProblemDetailWithLatestRecord as ProblemDetailWithLatestRecord,
@@ -61,7 +62,9 @@ from joj.horse.schemas.problem_config import (
     ProblemConfigCommit as ProblemConfigCommit,
     ProblemConfigDataDetail as ProblemConfigDataDetail,
     ProblemConfigDetail as ProblemConfigDetail,
+    ProblemConfigFileChanges as ProblemConfigFileChanges,
     ProblemConfigJson as ProblemConfigJson,
+    ProblemConfigUploadDetail as ProblemConfigUploadDetail,
 )
 from joj.horse.schemas.problem_group import ProblemGroup as ProblemGroup
 from joj.horse.schemas.problem_set import (
@@ -70,6 +73,8 @@ from joj.horse.schemas.problem_set import (
     ProblemSetCreate as ProblemSetCreate,
     ProblemSetDetail as ProblemSetDetail,
     ProblemSetEdit as ProblemSetEdit,
+    ProblemSetPreview as ProblemSetPreview,
+    ProblemSetReorderProblems as ProblemSetReorderProblems,
     ProblemSetUpdateProblem as ProblemSetUpdateProblem,
 )
 from joj.horse.schemas.query import (
@@ -82,15 +87,25 @@ from joj.horse.schemas.record import (
     RecordCaseResult as RecordCaseResult,
     RecordCaseSubmit as RecordCaseSubmit,
     RecordDetail as RecordDetail,
+    RecordExportFormat as RecordExportFormat,
     RecordListDetail as RecordListDetail,
     RecordPreview as RecordPreview,
     RecordState as RecordState,
     RecordSubmit as RecordSubmit,
 )
 from joj.horse.schemas.score import (
-    Score as Score,
-    ScoreBoard as ScoreBoard,
-    UserScore as UserScore,
+    ProblemSetProgress as ProblemSetProgress,
+    ProgressCell as ProgressCell,
+    ProgressRow as ProgressRow,
+    Scoreboard as Scoreboard,
+    ScoreboardCell as ScoreboardCell,
+    ScoreboardEntry as ScoreboardEntry,
+    ScoreboardSnapshot as ScoreboardSnapshot,
+)
+from joj.horse.schemas.statistics import (
+    HistogramBucket as HistogramBucket,
+    JudgeStatistics as JudgeStatistics,
+    Quantiles as Quantiles,
 )
 from joj.horse.schemas.user import (
     JudgerCreate as JudgerCreate,
@@ -1,4 +1,5 @@
 import re
+import time
 from datetime import datetime
 from enum import Enum
 from functools import lru_cache
@@ -7,6 +8,7 @@ from typing import (
     TYPE_CHECKING,
     Any,
     Callable,
+    Dict,
     Generator,
     Generic,
     List,
@@ -18,9 +20,11 @@ from typing import (
 )
 from uuid import UUID
 
+import orjson
 from fastapi import Depends, File, Form, Request, UploadFile, params
 from fastapi_utils.api_model import APIModel
 from fastapi_utils.camelcase import snake2camel
+from loguru import logger
 from makefun import wraps
 from pydantic import (
     BaseModel as PydanticBaseModel,
@@ -29,14 +33,16 @@ from pydantic import (
     create_model,
 )
 from pydantic.datetime_parse import parse_datetime
-from pydantic.fields import Undefined
+from pydantic.fields import ModelField, Undefined
 from pydantic.main import ModelMetaclass
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.functions import FunctionElement
 from sqlalchemy.sql.schema import Column
 from sqlalchemy.types import DateTime
 from sqlmodel import Field, SQLModel
 from starlette.datastructures import QueryParams
+from starlette.responses import Response
 
 from joj.horse.utils.base import is_uuid
 from joj.horse.utils.errors import ErrorCode
@@ -45,12 +51,82 @@ if TYPE_CHECKING:
     Model = TypeVar("Model", bound="BaseModel")
 
 
+@lru_cache(maxsize=None)
+def get_field_aliases(cls: Type[PydanticBaseModel]) -> Dict[str, str]:
+    return {name: field.alias for name, field in cls.__fields__.items()}
+
+
+@lru_cache(maxsize=None)
+def get_datetime_fields(cls: Type[PydanticBaseModel]) -> List[ModelField]:
+    return [
+        field
+        for field in cls.__fields__.values()
+        if isinstance(field.type_, type) and issubclass(field.type_, datetime)
+    ]
+
+
+def normalize_datetime(field: ModelField, value: Any) -> Any:
+    """
+    Validate a datetime as the response model does (e.g., UTCDatetime
+    converts it), so a dumped row is serialized the same as a model.
+    """
+    if value is None:
+        return None
+    result, errors = field.validate(value, {}, loc=field.name)
+    if errors:
+        raise ValueError(f"invalid datetime of {field.name}: {value}")
+    return result
+
+
 class BaseModel(APIModel):
     """"""
 
     class Config:
         validate_all = True
 
+    @classmethod
+    def from_row(cls: Type["Model"], row: Any, **kwargs: Any) -> "Model":
+        """
+        Build the model from a database row (or an orm object) without validation.
+        The data is trusted, only the fields defined in the model are kept.
+        """
+        mapping = row._mapping if isinstance(row, Row) else row.dict()
+        values = {k: v for k, v in mapping.items() if k in cls.__fields__}
+        values.update(kwargs)
+        return cls.construct(**values)
+
+    @classmethod
+    def dump_row(cls, row: Any, **kwargs: Any) -> Dict[str, Any]:
+        """
+        Same as from_row, but dump the row into a dict keyed by the aliases,
+        which can be serialized by orjson without creating any model.
+        """
+        aliases = get_field_aliases(cls)
+        mapping = row._mapping if isinstance(row, Row) else row
+        data = {aliases[k]: v for k, v in mapping.items() if k in aliases}
+        data.update((aliases[k], v) for k, v in kwargs.items())
+        for field in get_datetime_fields(cls):
+            if field.alias in data:
+                data[field.alias] = normalize_datetime(field, data[field.alias])
+        for key, value in data.items():
+            if isinstance(value, (PydanticBaseModel, list)):
+                data[key] = dump_nested(value)
+        return data
+
+
+def dump_nested(value: Any) -> Any:
+    """
+    Dump the nested models of a row (e.g., latest_record) like dump_row, so
+    their datetime fields are normalized the same as the top level ones.
+    """
+    if isinstance(value, BaseModel):
+        return value.dump_row(dict(value))
+    if isinstance(value, PydanticBaseModel):
+        return value.dict(by_alias=True)
+    if isinstance(value, list):
+        return [dump_nested(x) for x in value]
+    return value
+
 
 class Operation(Enum):
     Create = "Create"
@@ -298,6 +374,8 @@ class StandardResponse(Generic[BT]):
 
 class StandardListResponse(Generic[BT]):
     def __class_getitem__(cls, item: Any) -> Type[Any]:
+        if isinstance(item, TypeVar):  # a generic subclass, TrustedListResponse
+            return super().__class_getitem__(item)  # type: ignore[misc]
         return get_standard_response_model(item, True)[0]
 
     def __new__(
@@ -321,6 +399,55 @@ class StandardListResponse(Generic[BT]):
             error_code=ErrorCode.Success, error_msg=None, data=response_data
         )
 
+    @classmethod
+    def from_trusted(
+        cls,
+        results: List[Dict[str, Any]],
+        count: Optional[int] = None,
+    ) -> "StandardListResponse[BT]":
+        """
+        Fast path for results already produced from database rows (by dump_row),
+        the envelope is serialized by orjson directly without any validation.
+        The endpoint should still be annotated with StandardListResponse[T],
+        so the response model in the openapi schema is unchanged.
+        """
+        return TrustedListResponse(results, count)
+
+
+def orjson_default(obj: Any) -> Any:
+    if isinstance(obj, PydanticBaseModel):
+        return obj.dict(by_alias=True)
+    raise TypeError
+
+
+class TrustedListResponse(Response, StandardListResponse[BT]):
+    """A serialized StandardListResponse, returned by the endpoint as is."""
+
+    media_type = "application/json"
+
+    def __new__(cls, *args: Any, **kwargs: Any) -> "TrustedListResponse[BT]":
+        # not the model built by StandardListResponse
+        return object.__new__(cls)
+
+    def __init__(
+        self, results: List[Dict[str, Any]], count: Optional[int] = None
+    ) -> None:
+        if count is None:
+            count = len(results)
+        content = {
+            "errorCode": ErrorCode.Success,
+            "errorMsg": None,
+            "data": {"count": count, "results": results},
+        }
+        start = time.perf_counter()
+        body = orjson.dumps(content, default=orjson_default)
+        duration = (time.perf_counter() - start) * 1000
+        logger.debug("serialize {} results in {:.3f}ms", len(results), duration)
+        # expose the serialization cost of each endpoint to the client
+        super().__init__(
+            body, headers={"server-timing": f"serialize;dur={duration:.3f}"}
+        )
+
 
 class LimitOffsetPagination(BaseModel):
     count: int
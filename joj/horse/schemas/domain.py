@@ -10,6 +10,7 @@ from joj.horse.schemas.base import (
     LongStr,
     LongText,
     NoneEmptyLongStr,
+    NoneNegativeInt,
     TimestampMixin,
     URLCreateMixin,
     URLORMSchema,
@@ -50,6 +51,13 @@ class DomainBase(URLORMSchema):
         sa_column_kwargs={"server_default": ""},
         description="group name of the domain",
     )
+    duplicate_result_seconds: int = Field(
+        0,
+        nullable=False,
+        sa_column_kwargs={"server_default": "0"},
+        description="seconds to reuse the judge result of an identical submission "
+        "of the same user, 0 means always judging",
+    )
 
 
 class DomainCreate(URLCreateMixin, DomainBase):
@@ -67,6 +75,7 @@ class DomainEdit(BaseModel, metaclass=EditMetaclass):
     bulletin: Optional[LongText]
     hidden: Optional[bool]
     group: Optional[LongStr]
+    duplicate_result_seconds: Optional[NoneNegativeInt]
 
 
 class DomainTransfer(BaseModel):
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from joj.horse.schemas import BaseModel
 
@@ -116,14 +116,48 @@ class Commit(BaseModel):
     modified: Optional[List[str]]
 
 
+EMPTY_COMMIT_ID = "0" * 40
+BRANCH_REF_PREFIX = "refs/heads/"
+
+
 class GiteaWebhook(BaseModel):
-    secret: str
+    # deprecated by gitea, the payload is signed with the secret instead
+    secret: str = ""
     ref: str
     before: str
     after: str
     compare_url: str
     commits: Optional[List[Commit]]
+    total_commits: Optional[int]
     head_commit: Optional[Commit]
     repository: Optional[Repository]
     pusher: Optional[User]
     sender: Optional[User]
+
+    @property
+    def branch(self) -> Optional[str]:
+        if not self.ref.startswith(BRANCH_REF_PREFIX):
+            return None  # a tag
+        return self.ref[len(BRANCH_REF_PREFIX) :]
+
+    def has_all_commits(self) -> bool:
+        """Whether the commits in the payload cover the whole push."""
+        if self.before == EMPTY_COMMIT_ID or not self.commits:
+            return False
+        return self.total_commits is None or self.total_commits <= len(self.commits)
+
+    def get_changed_paths(self) -> Dict[str, str]:
+        """Net change of each path in the push: added, modified or removed."""
+        changes: Dict[str, str] = {}
+        # gitea lists the newest commit first, the timestamps are in seconds
+        for commit in reversed(self.commits or []):
+            for path in commit.added or []:
+                changes[path] = "modified" if path in changes else "added"
+            for path in commit.modified or []:
+                changes.setdefault(path, "modified")
+            for path in commit.removed or []:
+                if changes.get(path) == "added":
+                    del changes[path]
+                else:
+                    changes[path] = "removed"
+        return changes
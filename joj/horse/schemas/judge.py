@@ -1,3 +1,5 @@
+from typing import Optional
+
 from joj.horse.schemas import BaseModel
 
 
@@ -10,3 +12,9 @@ class JudgerCredentials(BaseModel):
     problem_config_commit_id: str
     record_repo_name: str
     record_commit_id: str
+    # the submitted files packed in a single object, if bundled
+    record_bundle_path: Optional[str] = None
+    # the files of the problem config in a single archive, if bundled
+    problem_config_bundle_digest: Optional[str] = None
+    problem_config_manifest_url: Optional[str] = None
+    problem_config_bundle_url: Optional[str] = None
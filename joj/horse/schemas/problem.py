@@ -31,6 +31,8 @@ class ProblemEdit(BaseModel, metaclass=EditMetaclass):
     title: Optional[NoneEmptyStr]
     content: Optional[LongText]
     hidden: Optional[bool]
+    gitea_repo: Optional[str]
+    gitea_branch: Optional[str]
 
 
 class ProblemBase(URLORMSchema):
@@ -55,6 +57,21 @@ class ProblemContentMixin(BaseModel):
     )
 
 
+class ProblemGiteaMixin(BaseModel):
+    gitea_repo: Optional[str] = Field(
+        None,
+        nullable=True,
+        index=True,
+        description="full name of the gitea repo the config is synced from",
+    )
+    gitea_branch: Optional[str] = Field(
+        None, nullable=True, description="branch of the gitea repo"
+    )
+    gitea_commit_id: Optional[str] = Field(
+        None, nullable=True, description="the last gitea commit synced"
+    )
+
+
 class ProblemCreate(ProblemContentMixin, URLCreateMixin, ProblemBase):
     pass
 
@@ -69,6 +86,11 @@ class ProblemPreview(ProblemBase, IDMixin):
     owner_id: Optional[UUID] = None
 
 
+class ProblemCounters(BaseModel):
+    num_submit: int
+    num_accept: int
+
+
 class Problem(ProblemBase, DomainMixin, IDMixin):
     num_submit: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
     num_accept: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
@@ -77,7 +99,7 @@ class Problem(ProblemBase, DomainMixin, IDMixin):
     problem_group_id: Optional[UUID] = None
 
 
-class ProblemDetail(TimestampMixin, ProblemContentMixin, Problem):
+class ProblemDetail(TimestampMixin, ProblemContentMixin, ProblemGiteaMixin, Problem):
     languages: List[str] = Field(
         [],
         sa_column=Column(JSON, nullable=False, server_default="[]"),
@@ -1,10 +1,10 @@
 from enum import Enum
-from typing import Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
+from joj.elephant.schemas import Config, StrEnumMixin
 from sqlmodel import Field
 
-from joj.elephant.schemas import Config, StrEnumMixin
 from joj.horse.schemas.base import BaseModel, BaseORMSchema, IDMixin, TimestampMixin
 
 
@@ -30,6 +30,9 @@ class ProblemConfigCommit(BaseModel):
 
 class ProblemConfig(ProblemConfigBase, IDMixin):
     commit_id: str = Field("", nullable=False, sa_column_kwargs={"server_default": ""})
+    bundle_digest: Optional[str] = Field(
+        None, nullable=True, description="digest of the bundle for judgers"
+    )
     committer_id: Optional[UUID] = None
 
 
@@ -37,6 +40,38 @@ class ProblemConfigDetail(TimestampMixin, ProblemConfig):
     pass
 
 
+class ProblemConfigFileChanges(BaseModel):
+    added: List[str] = []
+    changed: List[str] = []
+    removed: List[str] = []
+    unchanged: int = 0
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    @classmethod
+    def from_checksums(
+        cls, old: Dict[str, str], new: Dict[str, str]
+    ) -> "ProblemConfigFileChanges":
+        """Compare the checksums of the files (path -> checksum)."""
+        changes = cls()
+        for path, checksum in new.items():
+            if path not in old:
+                changes.added.append(path)
+            elif old[path] != checksum:
+                changes.changed.append(path)
+            else:
+                changes.unchanged += 1
+        changes.removed = sorted(old.keys() - new.keys())
+        return changes
+
+
+class ProblemConfigUploadDetail(ProblemConfigDetail):
+    changes: Optional[ProblemConfigFileChanges] = Field(
+        None, description="Not reported if the archive is extracted by patool."
+    )
+
+
 class ProblemConfigJson(Config):
     pass
 
@@ -36,6 +36,12 @@ class ProblemSetAddProblem(ProblemSetUpdateProblem):
     problem: str = Field(..., description="url or id of the problem")
 
 
+class ProblemSetReorderProblems(BaseModel):
+    problem_ids: List[UUID] = Field(
+        ..., description="ids of all problems in the problem set in the new order"
+    )
+
+
 class ProblemSetEdit(BaseModel, metaclass=EditMetaclass):
     url: Optional[UserInputURL]
     title: Optional[NoneEmptyLongStr]
@@ -52,12 +58,6 @@ class ProblemSetBase(URLORMSchema):
         nullable=False,
         description="title of the problem set",
     )
-    content: LongText = Field(
-        "",
-        nullable=False,
-        sa_column_kwargs={"server_default": ""},
-        description="content of the problem set",
-    )
     hidden: bool = Field(
         False,
         nullable=False,
@@ -87,18 +87,31 @@ class ProblemSetBase(URLORMSchema):
     )
 
 
-class ProblemSetCreate(URLCreateMixin, ProblemSetBase):
+class ProblemSetContentMixin(BaseModel):
+    content: LongText = Field(
+        "",
+        nullable=False,
+        sa_column_kwargs={"server_default": ""},
+        description="content of the problem set",
+    )
+
+
+class ProblemSetCreate(ProblemSetContentMixin, URLCreateMixin, ProblemSetBase):
     due_at: Optional[UTCDatetime] = None
     lock_at: Optional[UTCDatetime] = None
     unlock_at: Optional[UTCDatetime] = None
 
 
-class ProblemSet(ProblemSetBase, DomainMixin, IDMixin):
+class ProblemSetPreview(ProblemSetBase, DomainMixin, IDMixin):
     num_submit: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
     num_accept: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
 
     owner_id: Optional[UUID] = None
 
 
+class ProblemSet(ProblemSetContentMixin, ProblemSetPreview):
+    pass
+
+
 class ProblemSetDetail(TimestampMixin, ProblemSet):
     problems: List[ProblemPreviewWithLatestRecord] = []
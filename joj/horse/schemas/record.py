@@ -35,6 +35,9 @@ class RecordState(StrEnumMixin, Enum):
     rejected = "rejected"
     failed = "failed"
 
+    def is_finished(self) -> bool:
+        return self in (RecordState.accepted, RecordState.rejected, RecordState.failed)
+
 
 class RecordCaseResult(StrEnumMixin, Enum):
     accepted = "accepted"
@@ -49,6 +52,11 @@ class RecordCaseResult(StrEnumMixin, Enum):
     etc = "etc"
 
 
+class RecordExportFormat(StrEnumMixin, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
 class RecordCase(BaseModel):
     state: RecordCaseResult = RecordCaseResult.etc
     score: int = 0
@@ -81,24 +89,15 @@ class RecordListDetail(Record):
     committer_id: Optional[UUID] = None
     committer_username: Optional[str] = None
 
-    @classmethod
-    def from_row(
-        cls,
-        record: "Record",
-        problem_title: Optional[str],
-        problem_set_title: Optional[str],
-        committer_username: Optional[str],
-    ) -> "RecordListDetail":
-        return cls(
-            **record.dict(),
-            problem_title=problem_title,
-            problem_set_title=problem_set_title,
-            committer_username=committer_username,
-        )
-
 
 class RecordDetail(Record):
     commit_id: Optional[str] = Field(None, nullable=True)
+    bundled: bool = Field(
+        False,
+        nullable=False,
+        sa_column_kwargs={"server_default": "false"},
+        description="whether the submitted files are packed in a single bundle",
+    )
     task_id: Optional[UUID] = Field(None, nullable=True)
 
     cases: List[RecordCase] = Field(
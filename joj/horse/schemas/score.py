@@ -1,25 +1,93 @@
-from datetime import datetime, timedelta
-from typing import List
+from datetime import datetime
+from hashlib import blake2b
+from typing import List, Optional
+from uuid import UUID
 
-from joj.horse.schemas import BaseModel
-from joj.horse.schemas.user import User
+import orjson
+from sqlmodel import Field
 
+from joj.horse.schemas.base import BaseModel, BaseORMSchema
+from joj.horse.schemas.record import RecordState
+from joj.horse.schemas.user import UserPreview
+from joj.horse.utils.errors import ErrorCode
 
-class Score(BaseModel):
+
+class ScoreboardCellBase(BaseORMSchema):
+    score: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    tries: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    penalty_seconds: int = Field(
+        0,
+        nullable=False,
+        sa_column_kwargs={"server_default": "0"},
+        description="seconds from the start of the problem set to the best record",
+    )
+    accepted: bool = Field(
+        False, nullable=False, sa_column_kwargs={"server_default": "false"}
+    )
+
+
+class ScoreboardCell(ScoreboardCellBase):
+    problem_id: UUID
+
+
+class ScoreboardEntryBase(BaseORMSchema):
+    score: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    tries: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    penalty_seconds: int = Field(
+        0,
+        nullable=False,
+        sa_column_kwargs={"server_default": "0"},
+        description="sum of the penalty of all problems with a positive score",
+    )
+    num_accept: int = Field(0, nullable=False, sa_column_kwargs={"server_default": "0"})
+
+
+class ScoreboardEntry(ScoreboardEntryBase):
+    rank: int
+    user: UserPreview
+    cells: List[ScoreboardCell]
+
+
+class Scoreboard(BaseModel):
+    problem_ids: List[UUID]
+    count: int
+    results: List[ScoreboardEntry]
+
+
+class ScoreboardSnapshot(BaseModel):
+    etag: str
+    generated_at: datetime
+    body: bytes
+
+    @classmethod
+    def from_scoreboard(cls, scoreboard: Scoreboard) -> "ScoreboardSnapshot":
+        # the whole response is serialized once and served as is until expired
+        body = orjson.dumps(
+            {
+                "errorCode": ErrorCode.Success,
+                "errorMsg": None,
+                "data": scoreboard.dict(by_alias=True),
+            }
+        )
+        etag = '"{}"'.format(blake2b(body, digest_size=16).hexdigest())
+        return cls(etag=etag, generated_at=datetime.utcnow(), body=body)
+
+
+class ProgressCell(BaseModel):
+    record_id: UUID
+    state: RecordState
     score: int
-    time: datetime
-    full_score: int
-    time_spent: timedelta
-    tried: bool
+    created_at: datetime
+
 
+class ProgressRow(BaseModel):
+    user: UserPreview
+    cells: List[Optional[ProgressCell]]
 
-class UserScore(BaseModel):
-    user: User
-    total_score: int
-    total_time_spent: timedelta
-    scores: List[Score]
 
+class ProblemSetProgress(BaseModel):
+    """The latest record of each user on each problem, cells follow problem_ids."""
 
-class ScoreBoard(BaseModel):
-    problem_ids: List[str]
-    results: List[UserScore]
+    problem_ids: List[UUID]
+    count: int
+    results: List[ProgressRow]
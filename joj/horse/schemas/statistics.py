@@ -0,0 +1,27 @@
+from typing import Dict, List
+
+from joj.horse.schemas.base import BaseModel
+
+
+class HistogramBucket(BaseModel):
+    lower: int
+    upper: int  # exclusive
+    count: int
+
+
+class Quantiles(BaseModel):
+    """Approximate quantiles, within 2% relative error."""
+
+    p50: int = 0
+    p90: int = 0
+    p99: int = 0
+    max: int = 0
+
+
+class JudgeStatistics(BaseModel):
+    count: int = 0
+    states: Dict[str, int] = {}
+    case_results: Dict[str, int] = {}
+    score_histogram: List[HistogramBucket] = []
+    time_ms: Quantiles = Quantiles()
+    memory_kb: Quantiles = Quantiles()
@@ -0,0 +1,163 @@
+import fcntl
+import os
+from functools import lru_cache
+from hashlib import blake2b
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp, mkstemp
+from typing import Callable, Generator, Iterable, Optional
+
+from joj.elephant.schemas import ArchiveType
+from loguru import logger
+
+from joj.horse.config import settings
+
+
+class ArchiveCache:
+    """
+    Generated archives of commits on the local disk, keyed by
+    (repo, commit_id, archive_format).
+
+    A commit never changes, so a cached archive is served until it is
+    evicted: the least recently used archives are removed when the total
+    size exceeds max_bytes. An archive streamed to a client is stored on
+    the way. Builds of the same archive are serialized by a
+    file lock, so concurrent requests (in any worker on this host) wait for
+    the first build instead of building it again.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get_path(
+        self, repo_name: str, commit_id: str, archive_type: ArchiveType
+    ) -> Path:
+        key = f"{repo_name}:{commit_id}:{archive_type.value}"
+        digest = blake2b(key.encode(), digest_size=16).hexdigest()
+        return self.directory / f"{digest}.{archive_type.value}"
+
+    def get_or_build(
+        self,
+        repo_name: str,
+        commit_id: str,
+        archive_type: ArchiveType,
+        build: Callable[[Path], Path],
+    ) -> Path:
+        """
+        build creates the archive in the given temporary directory on a miss
+        and returns its path. Blocking, call it in a thread.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.get_path(repo_name, commit_id, archive_type)
+        if self.touch(path):
+            return path
+        with path.with_suffix(".lock").open("wb") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.touch(path):  # built by another request
+                    return path
+                temp_dir = Path(mkdtemp(dir=self.directory, prefix="build-"))
+                try:
+                    # move the finished archive in place atomically,
+                    # a partial archive is never served
+                    os.replace(build(temp_dir), path)
+                finally:
+                    rmtree(temp_dir, ignore_errors=True)
+                self.touch(path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.evict()
+        return path
+
+    def get(
+        self, repo_name: str, commit_id: str, archive_type: ArchiveType
+    ) -> Optional[Path]:
+        path = self.get_path(repo_name, commit_id, archive_type)
+        return path if self.touch(path) else None
+
+    def iter_and_store(
+        self,
+        repo_name: str,
+        commit_id: str,
+        archive_type: ArchiveType,
+        chunks: Iterable[bytes],
+    ) -> Generator[bytes, None, None]:
+        """
+        Pass a streamed archive through, and keep a copy as the cached
+        archive once the whole stream is sent. Nothing is stored if another
+        request is building the same archive or the stream is interrupted.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.get_path(repo_name, commit_id, archive_type)
+        with path.with_suffix(".lock").open("wb") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield from chunks
+                return
+            try:
+                fd, temp_path = mkstemp(dir=self.directory, prefix="build-")
+                try:
+                    with os.fdopen(fd, "wb") as temp_file:
+                        for chunk in chunks:
+                            temp_file.write(chunk)
+                            yield chunk
+                    os.replace(temp_path, path)
+                    self.touch(path)
+                finally:
+                    Path(temp_path).unlink(missing_ok=True)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.evict()
+
+    @staticmethod
+    def touch(path: Path) -> bool:
+        """
+        The mtime of the lock file beside an archive is its last access time
+        for eviction, the archive itself is never modified once stored. The
+        lock file outlives an evicted archive, so a new build touches it too.
+        """
+        if not path.is_file():
+            return False
+        path.with_suffix(".lock").touch()
+        return True
+
+    @staticmethod
+    def get_accessed_at(path: Path, stat: os.stat_result) -> float:
+        try:
+            return path.with_suffix(".lock").stat().st_mtime
+        except FileNotFoundError:
+            return stat.st_mtime
+
+    def evict(self) -> None:
+        archives = []
+        for path in self.directory.iterdir():
+            if (
+                path.suffix == ".lock"
+                or path.name.startswith("build-")
+                or not path.is_file()
+            ):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            archives.append((self.get_accessed_at(path, stat), stat.st_size, path))
+        total = sum(size for _, size, _ in archives)
+        for _, size, path in sorted(archives):
+            if total <= self.max_bytes:
+                break
+            # an archive being sent is still readable after unlinked, the lock
+            # file is kept: a builder may hold it, and a new lock file would
+            # let another builder lock the same archive at the same time
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.info("archive cache: evict {}", path.name)
+
+
+@lru_cache()
+def get_archive_cache() -> ArchiveCache:
+    return ArchiveCache(
+        Path(settings.archive_cache_dir), settings.archive_cache_size_mb * 1024 * 1024
+    )
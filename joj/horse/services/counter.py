@@ -0,0 +1,83 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+from uuid import UUID, uuid4
+
+import aioredis
+
+from joj.horse.services.redis import create_redis_connection
+
+CounterDeltas = Dict[UUID, Dict[str, int]]
+
+
+class BufferedCounter:
+    """
+    Buffer the increments of database counters in a redis hash.
+
+    An increment is a single HINCRBY and never touches the database row,
+    the deltas are moved to the database in batches by the owner of the
+    counter: take the pending deltas, apply them, then ack. Deltas taken by
+    an interrupted flush are taken again by the next one with the same batch
+    id, so the owner can tell whether they have been applied.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.pending_key = f"counters:{name}:pending"
+        self.flushing_key = f"counters:{name}:flushing"
+        self.redis: Optional[aioredis.Redis] = None
+
+    async def get_redis(self) -> aioredis.Redis:
+        if self.redis is None or self.redis.closed:
+            self.redis = await create_redis_connection()
+        return self.redis
+
+    async def increment(self, object_id: UUID, field: str, delta: int = 1) -> None:
+        redis = await self.get_redis()
+        await redis.hincrby(self.pending_key, f"{object_id}:{field}", delta)
+
+    async def get_pending(
+        self, object_ids: Iterable[UUID], fields: Iterable[str]
+    ) -> CounterDeltas:
+        """Deltas not yet flushed to the database, including a flush in progress."""
+        object_ids = list(object_ids)
+        fields = list(fields)
+        keys = [f"{object_id}:{field}" for object_id in object_ids for field in fields]
+        if not keys:
+            return {}
+        redis = await self.get_redis()
+        pending = await redis.hmget(self.pending_key, *keys)
+        flushing = await redis.hmget(self.flushing_key, *keys)
+        values = iter(int(x or 0) + int(y or 0) for x, y in zip(pending, flushing))
+        return {
+            object_id: {field: next(values) for field in fields}
+            for object_id in object_ids
+        }
+
+    async def take(self) -> Tuple[Optional[UUID], CounterDeltas]:
+        """Return the batch id and the deltas, the batch id is None if empty."""
+        redis = await self.get_redis()
+        if not await redis.exists(self.flushing_key):
+            try:
+                # new increments go to a new pending hash from now on
+                await redis.rename(self.pending_key, self.flushing_key)
+            except aioredis.ReplyError:  # nothing pending
+                return None, {}
+        # set only once, a retried batch keeps its id
+        await redis.hsetnx(self.flushing_key, "batch", str(uuid4()))
+        batch_id: Optional[UUID] = None
+        deltas: CounterDeltas = {}
+        for key, value in (await redis.hgetall(self.flushing_key)).items():
+            if key == b"batch":
+                batch_id = UUID(value.decode())
+                continue
+            object_id, field = key.decode().split(":")
+            deltas.setdefault(UUID(object_id), {})[field] = int(value)
+        return batch_id, deltas
+
+    async def ack(self) -> None:
+        redis = await self.get_redis()
+        await redis.delete(self.flushing_key)
+
+
+@lru_cache()
+def get_buffered_counter(name: str) -> BufferedCounter:
+    return BufferedCounter(name)
@@ -0,0 +1,114 @@
+import hmac
+from functools import lru_cache
+from hashlib import sha256
+from tempfile import TemporaryFile
+from typing import IO
+from urllib.parse import quote
+
+import httpx
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from joj.horse import schemas
+from joj.horse.config import settings
+from joj.horse.schemas.gitea_webhook import GiteaWebhook
+from joj.horse.services.lakefs import LakeFSProblemConfig
+from joj.horse.utils.errors import BizError, ErrorCode
+
+GITEA_CHUNK_SIZE = 1024 * 1024
+
+
+def verify_gitea_signature(body: bytes, signature: str) -> bool:
+    if not settings.gitea_webhook_secret:
+        return False
+    expected = hmac.new(
+        settings.gitea_webhook_secret.encode(), body, sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+@lru_cache
+def get_gitea_client() -> httpx.Client:
+    headers = {}
+    if settings.gitea_token:
+        headers["Authorization"] = f"token {settings.gitea_token}"
+    return httpx.Client(
+        base_url=f"{settings.gitea_url.rstrip('/')}/api/v1",
+        headers=headers,
+        timeout=60,
+    )
+
+
+def download_gitea_file(repo: str, path: str, ref: str, dest: IO[bytes]) -> bool:
+    """False if the file is not found, e.g., the path is a submodule."""
+    url = f"/repos/{repo}/raw/{quote(path)}"
+    with get_gitea_client().stream("GET", url, params={"ref": ref}) as response:
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        for chunk in response.iter_bytes(GITEA_CHUNK_SIZE):
+            dest.write(chunk)
+    return True
+
+
+def download_gitea_archive(repo: str, ref: str, dest: IO[bytes]) -> None:
+    url = f"/repos/{repo}/archive/{ref}.zip"
+    with get_gitea_client().stream("GET", url) as response:
+        response.raise_for_status()
+        for chunk in response.iter_bytes(GITEA_CHUNK_SIZE):
+            dest.write(chunk)
+
+
+def sync_problem_config_from_gitea(
+    problem_config: LakeFSProblemConfig, webhook: GiteaWebhook, incremental: bool
+) -> schemas.ProblemConfigFileChanges:
+    """
+    Apply a push to the branch of the problem config. If incremental, only
+    the paths changed in the commits of the push are read from gitea,
+    otherwise the whole repo is synced from an archive of the pushed commit.
+    The branch is reset on errors.
+    """
+    assert webhook.repository is not None
+    repo = webhook.repository.full_name
+    problem_config.ensure_branch()
+    try:
+        if not incremental:
+            with TemporaryFile() as archive_file:
+                download_gitea_archive(repo, webhook.after, archive_file)
+                archive_file.seek(0)
+                # the files are in a directory named after the repo
+                changes = problem_config.upload_problem_config_archive(
+                    f"{webhook.after}.zip",
+                    archive_file,
+                    schemas.ConfigMissing.raise_error,
+                    strip_components=1,
+                )
+            assert changes is not None
+            return changes
+
+        changes = schemas.ProblemConfigFileChanges()
+        for path, change in sorted(webhook.get_changed_paths().items()):
+            if change != "removed":
+                with TemporaryFile() as file:
+                    if download_gitea_file(repo, path, webhook.after, file):
+                        file.seek(0)
+                        problem_config.put_object(path, file)
+                        if change == "added":
+                            changes.added.append(path)
+                        else:
+                            changes.changed.append(path)
+                        continue
+            changes.removed.append(path)
+        problem_config.delete_objects(changes.removed)
+        logger.info(
+            "sync from gitea: {} added, {} changed, {} removed",
+            len(changes.added),
+            len(changes.changed),
+            len(changes.removed),
+        )
+        return changes
+    except Exception as e:
+        problem_config.reset(schemas.LakeFSReset())
+        if isinstance(e, (httpx.HTTPError, ClientError)):
+            raise BizError(ErrorCode.FileUpdateError, str(e))
+        raise
@@ -1,19 +1,32 @@
-from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+from hashlib import md5, sha256
 from io import BytesIO
-from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import IO, TYPE_CHECKING, Any, BinaryIO, Dict, List, Literal, Optional, cast
+from pathlib import Path, PurePosixPath
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile, TemporaryFile
+from threading import BoundedSemaphore
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    cast,
+)
 
 import boto3
 import orjson
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 from fs.errors import ResourceNotFound
 from greenletio import async_
-from lakefs_client import Configuration, __version__ as lakefs_client_version, models
-from lakefs_client.client import LakeFSClient
-from lakefs_client.exceptions import ApiException as LakeFSApiException
-from loguru import logger
-from patoolib.util import PatoolError
-
 from joj.elephant.errors import ElephantError
 from joj.elephant.manager import Manager
 from joj.elephant.rclone import RClone
@@ -25,15 +38,35 @@ from joj.elephant.storage import (
     MultipleFilesStorage,
     Storage,
 )
+from lakefs_client import Configuration, __version__ as lakefs_client_version, models
+from lakefs_client.client import LakeFSClient
+from lakefs_client.exceptions import ApiException as LakeFSApiException
+from loguru import logger
+from patoolib.util import PatoolError
+
 from joj.horse import schemas
 from joj.horse.config import settings
+from joj.horse.utils.archive import (
+    ArchiveEntry,
+    is_archive_streamable,
+    iter_archive,
+    iter_archive_members,
+    read_bundle_file,
+    write_bundle,
+)
 from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.fastapi.responses import get_content_disposition
 from joj.horse.utils.retry import retry_init
 
 if TYPE_CHECKING:
     from joj.horse.models import Problem, Record, User
     from joj.horse.schemas.lakefs import LakeFSReset
 
+# members of uploaded archives larger than a part are sent in multipart uploads
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+# the limit of keys in a single request of delete_objects
+DELETE_OBJECTS_LIMIT = 1000
+
 
 @lru_cache
 def get_lakefs_client() -> LakeFSClient:
@@ -45,6 +78,82 @@ def get_lakefs_client() -> LakeFSClient:
     return LakeFSClient(configuration)
 
 
+@lru_cache
+def get_lakefs_s3_client(public: bool = False) -> Any:
+    # objects are read through the s3 gateway of lakefs as streams
+    endpoint_url = f"http://{settings.lakefs_s3_domain}:{settings.lakefs_port}"
+    if public and settings.lakefs_s3_public_url:
+        # the client only signs urls for the clients of the server
+        endpoint_url = settings.lakefs_s3_public_url
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=settings.lakefs_username,
+        aws_secret_access_key=settings.lakefs_password,
+    )
+
+
+@lru_cache
+def get_s3_client(public: bool = False) -> Any:
+    endpoint_url = f"http://{settings.s3_host}:{settings.s3_port}"
+    if public and settings.s3_public_url:
+        endpoint_url = settings.s3_public_url
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=settings.s3_username,
+        aws_secret_access_key=settings.s3_password,
+    )
+
+
+def copy_with_etag(src: IO[bytes], dest: Optional[IO[bytes]] = None) -> str:
+    """
+    Copy a file (or only read it if dest is None) and compute the etag of s3
+    for a multipart upload of it.
+    """
+    digests = []
+    while True:
+        part = src.read(UPLOAD_PART_SIZE)
+        if not part:
+            break
+        if dest is not None:
+            dest.write(part)
+        digests.append(md5(part).digest())
+    if len(digests) <= 1:  # sent in a single put
+        return digests[0].hex() if digests else md5().hexdigest()
+    return f"{md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def s3_object_exists(s3: Any, bucket: str, key: str) -> bool:
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+        raise
+
+
+def generate_presigned_url(
+    s3: Any, bucket: str, key: str, filename: Optional[str] = None
+) -> str:
+    params = {"Bucket": bucket, "Key": key}
+    if filename is not None:
+        params["ResponseContentDisposition"] = get_content_disposition(filename)
+    return s3.generate_presigned_url(
+        "get_object", Params=params, ExpiresIn=settings.presigned_url_expire_seconds
+    )
+
+
+@lru_cache
+def get_transfer_config() -> TransferConfig:
+    return TransferConfig(
+        multipart_threshold=UPLOAD_PART_SIZE,
+        multipart_chunksize=UPLOAD_PART_SIZE,
+        max_concurrency=settings.lakefs_upload_concurrency,
+    )
+
+
 @lru_cache
 def get_rclone() -> RClone:
     rclone_config = f"""
@@ -211,6 +320,10 @@ class LakeFSBase:
             self._storage = cast(LakeFSStorage, self._get_storage())
         return self._storage
 
+    @property
+    def bucket_name(self) -> str:
+        return self.bucket[len("s3://") :]
+
     @property
     def path(self) -> str:
         return f"lakefs:{self.repo_name}/{self.branch_name}/"
@@ -371,17 +484,65 @@ class LakeFSBase:
         except ElephantError as e:
             raise BizError(ErrorCode.FileUpdateError, str(e))
 
+    def upload_bundle(
+        self,
+        bundle_name: str,
+        filenames: List[str],
+        files: List[IO[bytes]],
+        manifest: Dict[str, Any],
+    ) -> None:
+        """
+        Pack the files in a single object written with one put. The branch
+        is only ensured if the put fails, e.g., at the first upload to it.
+        Like a sync of the files, other objects on the branch (e.g., the loose
+        files of a submission before bundles are enabled) are deleted.
+        """
+        bundle = BytesIO()
+        write_bundle(zip(filenames, files), manifest, bundle)
+        s3 = get_lakefs_s3_client()
+        key = self.get_object_key(bundle_name)
+        try:
+            try:
+                s3.put_object(Bucket=self.repo_name, Key=key, Body=bundle.getvalue())
+            except ClientError:
+                self.ensure_branch()
+                s3.put_object(Bucket=self.repo_name, Key=key, Body=bundle.getvalue())
+            stale = [
+                stats.path
+                for stats in self.iter_object_stats()
+                if stats.path_type == "object" and stats.path != bundle_name
+            ]
+            self.delete_objects(stale)
+        except ClientError as e:
+            raise BizError(ErrorCode.FileUpdateError, str(e))
+
+    def read_bundle_file(
+        self, bundle_name: str, file_path: str, ref: Optional[str] = None
+    ) -> bytes:
+        bundle = BytesIO(self.get_object(bundle_name, ref)["Body"].read())
+        return read_bundle_file(bundle, file_path)
+
     def upload_problem_config_archive(
         self,
         filename: str,
         file: IO[bytes],
         config_json_on_missing: schemas.ConfigMissing,
-    ) -> None:
+        strip_components: int = 0,
+    ) -> Optional[schemas.ProblemConfigFileChanges]:
+        """
+        Changes of files are returned unless the archive is extracted by
+        patool, which never strips components.
+        """
         self.ensure_branch()
+        if is_archive_streamable(file):
+            return self.upload_archive_members(
+                file, config_json_on_missing, strip_components
+            )
 
+        # other formats are extracted by patool
         try:
             temp_file = NamedTemporaryFile(mode="wb", delete=True, suffix=filename)
-            temp_file.write(file.read())
+            copyfileobj(file, temp_file, UPLOAD_PART_SIZE)
             temp_file.flush()
             logger.info("write archive into {}", temp_file.name)
             archive = ArchiveStorage(file_path=temp_file.name)
@@ -408,10 +569,167 @@ class LakeFSBase:
             logger.info(archive.path)
             manager.sync_with_validation()
             temp_file.close()
+            return None
 
         except ElephantError as e:
             raise BizError(ErrorCode.FileUpdateError, str(e))
 
+    def put_object(self, file_path: str, file: IO[bytes]) -> None:
+        """Upload a file through the s3 gateway, in parts if it is large."""
+        get_lakefs_s3_client().upload_fileobj(
+            file,
+            self.repo_name,
+            self.get_object_key(file_path),
+            Config=get_transfer_config(),
+        )
+
+    def delete_objects(self, file_paths: List[str]) -> None:
+        s3 = get_lakefs_s3_client()
+        for i in range(0, len(file_paths), DELETE_OBJECTS_LIMIT):
+            keys = file_paths[i : i + DELETE_OBJECTS_LIMIT]
+            s3.delete_objects(
+                Bucket=self.repo_name,
+                Delete={
+                    "Objects": [{"Key": self.get_object_key(path)} for path in keys],
+                    "Quiet": True,
+                },
+            )
+
+    def iter_object_stats(
+        self, ref: Optional[str] = None
+    ) -> Iterator[models.ObjectStats]:
+        after = ""
+        while True:
+            result = self.ls(ref=ref or self.branch_name, after=after, amount=1000)
+            yield from result.results
+            if not result.pagination.has_more:
+                return
+            after = result.pagination.next_offset
+
+    def upload_archive_members(
+        self,
+        file: IO[bytes],
+        config_json_on_missing: schemas.ConfigMissing,
+        strip_components: int = 0,
+    ) -> schemas.ProblemConfigFileChanges:
+        """
+        Replace the objects on the branch with the members of a zip or tar
+        archive, uploaded while the archive is read. Small members are put in
+        parallel and large ones are sent in multipart uploads, so the memory
+        is bounded by the concurrency instead of the size of the archive.
+
+        A member is skipped if its checksum (the etag of s3, computed with
+        the part size of the uploads) equals the checksum of the object on
+        the branch, objects missing in the archive are deleted. The branch
+        is reset on errors.
+        """
+        s3 = get_lakefs_s3_client()
+        prefix = f"{self.branch_name}/"
+        concurrency = settings.lakefs_upload_concurrency
+        # the members read in memory but not uploaded yet
+        semaphore = BoundedSemaphore(concurrency)
+
+        def put_object(key: str, body: bytes) -> None:
+            try:
+                s3.put_object(Bucket=self.repo_name, Key=key, Body=body)
+            finally:
+                semaphore.release()
+
+        checksums = {
+            stats.path: stats.checksum
+            for stats in self.iter_object_stats()
+            if stats.path_type == "object"
+        }
+        # the checksums of the members, a duplicated member replaces the
+        # earlier one as if the archive were extracted
+        uploaded: Dict[str, str] = {}
+        futures: Dict[str, "Future[None]"] = {}
+
+        def is_changed(path: str, checksum: str) -> bool:
+            current = uploaded.get(path, checksums.get(path))
+            uploaded[path] = checksum
+            previous = futures.pop(path, None)
+            if previous is not None:  # put the members of a path in order
+                previous.result()
+            return checksum != current
+
+        def upload_large(key: str, body: IO[bytes]) -> None:
+            s3.upload_fileobj(body, self.repo_name, key, Config=get_transfer_config())
+
+        try:
+            with ThreadPoolExecutor(concurrency) as executor:
+                for member in iter_archive_members(file, strip_components):
+                    key = prefix + member.path
+                    if member.size <= UPLOAD_PART_SIZE:
+                        semaphore.acquire()
+                        submitted = False
+                        try:
+                            body = member.file.read()
+                            if is_changed(member.path, md5(body).hexdigest()):
+                                future = executor.submit(put_object, key, body)
+                                submitted = True
+                                futures[member.path] = future
+                        finally:
+                            # put_object releases it once submitted
+                            if not submitted:
+                                semaphore.release()
+                    elif member.reopen is not None:
+                        # a zip member is read twice instead of spooled
+                        checksum = copy_with_etag(member.file)
+                        if is_changed(member.path, checksum):
+                            with member.reopen() as body:
+                                upload_large(key, body)
+                    else:
+                        # a tar is read as a stream, the checksum is known
+                        # only after the member is read, so it is spooled to
+                        # upload only a changed member
+                        with TemporaryFile() as temp_file:
+                            checksum = copy_with_etag(member.file, temp_file)
+                            if is_changed(member.path, checksum):
+                                temp_file.seek(0)
+                                upload_large(key, temp_file)
+                for future in futures.values():
+                    future.result()
+
+            config_json_path = "config.json"
+            if config_json_path not in uploaded:
+                if config_json_on_missing == schemas.ConfigMissing.raise_error:
+                    raise BizError(ErrorCode.ProblemConfigJsonNotFoundError)
+                if config_json_on_missing == schemas.ConfigMissing.use_old:
+                    if config_json_path not in checksums:
+                        raise BizError(ErrorCode.ProblemConfigJsonNotFoundError)
+                    uploaded[config_json_path] = checksums[config_json_path]
+                elif config_json_on_missing == schemas.ConfigMissing.use_default:
+                    body = orjson.dumps(
+                        schemas.ProblemConfigJson.generate_default_value().dict(),
+                        option=orjson.OPT_INDENT_2,
+                    )
+                    if is_changed(config_json_path, md5(body).hexdigest()):
+                        s3.put_object(
+                            Bucket=self.repo_name,
+                            Key=prefix + config_json_path,
+                            Body=body,
+                        )
+
+            changes = schemas.ProblemConfigFileChanges.from_checksums(
+                checksums, uploaded
+            )
+            self.delete_objects(changes.removed)
+            logger.info(
+                "upload archive: {} added, {} changed, {} removed, {} unchanged",
+                len(changes.added),
+                len(changes.changed),
+                len(changes.removed),
+                changes.unchanged,
+            )
+            return changes
+        except Exception as e:
+            # drop the partial changes, the branch is left as the last commit
+            self.reset(schemas.LakeFSReset())
+            if isinstance(e, ClientError):
+                raise BizError(ErrorCode.FileUpdateError, str(e))
+            raise
+
     def upload_text(self, filename: str, code_text: str) -> None:
         self.ensure_branch()
 
@@ -424,6 +742,13 @@ class LakeFSBase:
         except ElephantError as e:
             raise BizError(ErrorCode.FileUpdateError, str(e))
 
+    def get_archive_filename(self, archive_type: ArchiveType) -> str:
+        if archive_type == ArchiveType.zip:
+            return self.archive_name + ".zip"
+        if archive_type == ArchiveType.tar:
+            return self.archive_name + ".tar.gz"
+        raise BizError(ErrorCode.FileDownloadError, "archive type not supported!")
+
     def download_archive(
         self, temp_dir: Path, archive_type: ArchiveType, ref: Optional[str] = None
     ) -> Path:
@@ -434,18 +759,7 @@ class LakeFSBase:
             storage = self._get_storage(ref)
 
         try:
-            filename = self.archive_name
-            if archive_type == ArchiveType.zip:
-                filename += ".zip"
-            elif archive_type == ArchiveType.tar:
-                filename += ".tar.gz"
-            else:
-                raise BizError(
-                    ErrorCode.FileDownloadError,
-                    "archive type not supported!",
-                )
-
-            temp_file_path = temp_dir / filename
+            temp_file_path = temp_dir / self.get_archive_filename(archive_type)
 
             archive = ArchiveStorage(file_path=str(temp_file_path))
             manager = Manager(get_rclone(), storage, archive)
@@ -461,6 +775,133 @@ class LakeFSBase:
         except Exception as e:
             raise e
 
+    def get_object_key(self, file_path: str, ref: Optional[str] = None) -> str:
+        parts = PurePosixPath(file_path).parts
+        # a key never escapes from the ref, e.g., to the branch of another user
+        if not parts or parts[0] == "/" or ".." in parts:
+            raise BizError(ErrorCode.FileDownloadError, "invalid file path!")
+        return f"{ref or self.branch_name}/{file_path}"
+
+    def get_object(self, file_path: str, ref: Optional[str] = None) -> Dict[str, Any]:
+        """Get an object through the s3 gateway, the body is read as a stream."""
+        try:
+            return get_lakefs_s3_client().get_object(
+                Bucket=self.repo_name, Key=self.get_object_key(file_path, ref)
+            )
+        except ClientError as e:
+            raise BizError(ErrorCode.FileDownloadError, str(e))
+
+    def get_presigned_url(self, file_path: str, ref: Optional[str] = None) -> str:
+        key = self.get_object_key(file_path, ref)
+        try:
+            get_lakefs_s3_client().head_object(Bucket=self.repo_name, Key=key)
+        except ClientError as e:
+            raise BizError(ErrorCode.FileDownloadError, str(e))
+        return generate_presigned_url(
+            get_lakefs_s3_client(public=True),
+            self.repo_name,
+            key,
+            PurePosixPath(file_path).name,
+        )
+
+    def get_archive_presigned_url(
+        self, archive_type: ArchiveType, ref: str, build: Callable[[], Path]
+    ) -> str:
+        """
+        The archive of a commit is uploaded to the bucket of the repo (out of
+        the storage of lakefs) at the first request, build returns the local
+        archive to upload.
+        """
+        s3 = get_s3_client()
+        key = f"archives/{self.repo_name}/{ref}.{archive_type.value}"
+        try:
+            if not s3_object_exists(s3, self.bucket_name, key):
+                s3.upload_file(str(build()), self.bucket_name, key)
+        except ClientError as e:
+            raise BizError(ErrorCode.FileDownloadError, str(e))
+        return generate_presigned_url(
+            get_s3_client(public=True),
+            self.bucket_name,
+            key,
+            self.get_archive_filename(archive_type),
+        )
+
+    @staticmethod
+    def get_bundle_keys(digest: str) -> Tuple[str, str]:
+        return f"bundles/{digest}.json", f"bundles/{digest}.tar.gz"
+
+    def build_bundle(self, ref: str) -> str:
+        """
+        Bundle the files of a commit for judgers: a manifest of the files and
+        a tar.gz of them, stored in the bucket of the repo and keyed by the
+        digest of the manifest, so the same files are bundled only once.
+        The digest is returned.
+        """
+        files = [
+            {"path": stats.path, "size": stats.size_bytes, "checksum": stats.checksum}
+            for stats in self.iter_object_stats(ref)
+            if stats.path_type == "object"
+        ]
+        manifest = orjson.dumps(
+            {"format": "tar.gz", "files": files}, option=orjson.OPT_SORT_KEYS
+        )
+        digest = sha256(manifest).hexdigest()
+        manifest_key, archive_key = self.get_bundle_keys(digest)
+        s3 = get_s3_client()
+        if s3_object_exists(s3, self.bucket_name, manifest_key):
+            return digest
+        with TemporaryFile() as archive_file:
+            for chunk in iter_archive(self.iter_objects(ref), ArchiveType.tar):
+                archive_file.write(chunk)
+            archive_file.seek(0)
+            s3.upload_fileobj(
+                archive_file,
+                self.bucket_name,
+                archive_key,
+                Config=get_transfer_config(),
+            )
+        # the manifest is put at last, a bundle with a manifest is complete
+        s3.put_object(
+            Bucket=self.bucket_name,
+            Key=manifest_key,
+            Body=manifest,
+            ContentType="application/json",
+        )
+        logger.info("bundle {} built: {} files", digest, len(files))
+        return digest
+
+    def get_bundle_presigned_urls(self, digest: str) -> Tuple[str, str]:
+        manifest_key, archive_key = self.get_bundle_keys(digest)
+        s3 = get_s3_client(public=True)
+        return (
+            generate_presigned_url(s3, self.bucket_name, manifest_key),
+            generate_presigned_url(s3, self.bucket_name, archive_key),
+        )
+
+    def iter_objects(self, ref: Optional[str] = None) -> Iterator[ArchiveEntry]:
+        s3 = get_lakefs_s3_client()
+        prefix = f"{ref or self.branch_name}/"
+
+        def open_object(key: str) -> IO[bytes]:
+            return s3.get_object(Bucket=self.repo_name, Key=key)["Body"]
+
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.repo_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield ArchiveEntry(
+                    path=obj["Key"][len(prefix) :],
+                    size=obj["Size"],
+                    modified_at=obj["LastModified"],
+                    open=partial(open_object, obj["Key"]),
+                )
+
+    def iter_archive(
+        self, archive_type: ArchiveType, ref: Optional[str] = None
+    ) -> Iterator[bytes]:
+        """Stream the archive while the objects are read, nothing is staged."""
+        self.ensure_branch()
+        return iter_archive(self.iter_objects(ref), archive_type)
+
     def get_config(self, ref: str) -> Dict[str, Any]:
         try:
             result = self.download_file(Path("config.json"), ref)
@@ -574,6 +1015,9 @@ class LakeFSProblemConfig(LakeFSBase):
         self.problem = problem
 
 
+RECORD_BUNDLE_NAME = "code.tar.gz"
+
+
 class LakeFSRecord(LakeFSBase):
     def __init__(self, problem: "Problem", record: "Record"):
         super().__init__(
@@ -0,0 +1,90 @@
+import asyncio
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict
+
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+
+from joj.horse.config import settings
+from joj.horse.schemas.cache import get_redis_cache
+from joj.horse.schemas.problem_config import ProblemConfigJson
+from joj.horse.services.lakefs import LakeFSProblemConfig
+
+# entries never go stale, the ttl only bounds the memory of redis
+PROBLEM_CONFIG_JSON_TTL = 30 * 24 * 60 * 60
+
+
+class ProblemConfigJsonCache:
+    """
+    Parsed config.json of problem configs, keyed by (repo, commit_id).
+
+    A commit never changes, so an entry is valid forever: an in-process LRU
+    is looked up first, then redis shared by the workers. A miss downloads
+    and parses config.json in a thread, concurrent misses of the same commit
+    in this worker wait for the same download.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.local: "OrderedDict[str, ProblemConfigJson]" = OrderedDict()
+        self.pending: Dict[str, "asyncio.Task[ProblemConfigJson]"] = {}
+
+    @staticmethod
+    def get_key(problem_config: LakeFSProblemConfig, commit_id: str) -> str:
+        return f"{problem_config.repo_name}:{commit_id}"
+
+    def get_local(self, key: str) -> ProblemConfigJson:
+        config = self.local.pop(key)
+        self.local[key] = config
+        return config
+
+    def set_local(self, key: str, config: ProblemConfigJson) -> None:
+        self.local[key] = config
+        while len(self.local) > self.maxsize:
+            self.local.popitem(last=False)
+
+    async def load(
+        self, problem_config: LakeFSProblemConfig, commit_id: str, key: str
+    ) -> ProblemConfigJson:
+        cache = get_redis_cache()
+        try:
+            config = await cache.get(key, namespace="problem_config_json")
+        except Exception as e:
+            logger.error("error when loading problem config from cache:")
+            logger.exception(e)
+            config = None
+        if config is None:
+            data = await run_in_threadpool(problem_config.get_config, commit_id)
+            config = ProblemConfigJson(**data)
+            try:
+                await cache.set(
+                    key,
+                    config,
+                    ttl=PROBLEM_CONFIG_JSON_TTL,
+                    namespace="problem_config_json",
+                )
+            except Exception as e:
+                logger.error("error when saving problem config to cache:")
+                logger.exception(e)
+        self.set_local(key, config)
+        return config
+
+    async def get(
+        self, problem_config: LakeFSProblemConfig, commit_id: str
+    ) -> ProblemConfigJson:
+        key = self.get_key(problem_config, commit_id)
+        if key in self.local:
+            return self.get_local(key)
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self.load(problem_config, commit_id, key))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        # a cancelled request never cancels the download for the others
+        return await asyncio.shield(task)
+
+
+@lru_cache()
+def get_problem_config_cache() -> ProblemConfigJsonCache:
+    return ProblemConfigJsonCache(settings.problem_config_cache_size)
@@ -0,0 +1,127 @@
+import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncGenerator, Dict, Optional, Set
+
+import aioredis
+from loguru import logger
+
+from joj.horse.services.redis import create_redis_connection
+
+# messages buffered for a subscriber before it is dropped as too slow
+PUBSUB_QUEUE_SIZE = 64
+# seconds to wait for the subscription on redis before giving up
+PUBSUB_READY_TIMEOUT = 5
+PUBSUB_MIN_BACKOFF = 1
+PUBSUB_MAX_BACKOFF = 30
+
+
+class PubSubUnavailable(Exception):
+    pass
+
+
+class PubSub:
+    """
+    Fan out redis pub/sub messages to the subscribers in this process.
+
+    Each worker holds one pattern subscription on redis and dispatches messages
+    to in-process queues, so the number of redis connections does not grow
+    with the number of clients, and it works across workers and nodes.
+
+    A queue is bounded, a subscriber falling behind (or all subscribers when
+    the connection to redis is lost) gets None and is dropped, it should
+    resync and subscribe again.
+    """
+
+    def __init__(self, prefix: str = "pubsub:") -> None:
+        self.prefix = prefix
+        self.queues: Dict[str, Set["asyncio.Queue[Optional[bytes]]"]] = {}
+        self.publisher: Optional[aioredis.Redis] = None
+        self.listener: Optional["asyncio.Task[None]"] = None
+        self.ready = asyncio.Event()
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        if self.publisher is None or self.publisher.closed:
+            self.publisher = await create_redis_connection()
+        await self.publisher.publish(self.prefix + channel, message)
+
+    def dispatch(self, channel: str, message: bytes) -> None:
+        for queue in list(self.queues.get(channel, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning("pubsub: drop a slow subscriber of {}", channel)
+                self.drop(channel, queue)
+
+    def drop(self, channel: str, queue: "asyncio.Queue[Optional[bytes]]") -> None:
+        queues = self.queues.get(channel)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.queues[channel]
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def drop_all(self) -> None:
+        for channel, queues in list(self.queues.items()):
+            for queue in list(queues):
+                self.drop(channel, queue)
+
+    async def listen(self) -> None:
+        backoff = PUBSUB_MIN_BACKOFF
+        while True:
+            subscriber = None
+            try:
+                subscriber = await create_redis_connection()
+                (pattern,) = await subscriber.psubscribe(self.prefix + "*")
+                self.ready.set()
+                backoff = PUBSUB_MIN_BACKOFF
+                logger.info("pubsub: subscribed to {}*", self.prefix)
+                async for channel, message in pattern.iter():
+                    self.dispatch(channel.decode()[len(self.prefix) :], message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("pubsub: listener failed, reconnect in {}s.", backoff)
+                logger.exception(e)
+            finally:
+                self.ready.clear()
+                if subscriber is not None:
+                    subscriber.close()
+            # messages are lost until subscribed again
+            self.drop_all()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, PUBSUB_MAX_BACKOFF)
+
+    async def ensure_listener(self) -> None:
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self.listen())
+        try:
+            await asyncio.wait_for(self.ready.wait(), PUBSUB_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PubSubUnavailable()
+
+    @asynccontextmanager
+    async def subscribe(
+        self, channel: str
+    ) -> AsyncGenerator["asyncio.Queue[Optional[bytes]]", None]:
+        """Raise PubSubUnavailable if redis can not be subscribed in time."""
+        await self.ensure_listener()
+        queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(
+            maxsize=PUBSUB_QUEUE_SIZE
+        )
+        self.queues.setdefault(channel, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self.queues.get(channel)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.queues[channel]
+
+
+@lru_cache()
+def get_pubsub() -> PubSub:
+    return PubSub()
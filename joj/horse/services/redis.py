@@ -0,0 +1,11 @@
+import aioredis
+
+from joj.horse.config import settings
+
+
+async def create_redis_connection() -> aioredis.Redis:
+    return await aioredis.create_redis(
+        (settings.redis_host, settings.redis_port),
+        password=settings.redis_password or None,
+        db=settings.redis_db_index,
+    )
@@ -0,0 +1,126 @@
+import math
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+import aioredis
+
+from joj.horse.schemas.record import RecordDetail
+from joj.horse.schemas.statistics import HistogramBucket, JudgeStatistics, Quantiles
+from joj.horse.services.redis import create_redis_connection
+
+SCORE_HISTOGRAM_WIDTH = 10
+
+
+class QuantileSketch:
+    """
+    Bucket positive values logarithmically, so any quantile is answered with a
+    bounded relative error (the idea of DDSketch). The buckets are plain
+    counters, they can be incremented concurrently and merged by addition.
+    """
+
+    relative_accuracy = 0.02
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+
+    @classmethod
+    def get_bucket(cls, value: int) -> int:
+        if value <= 0:
+            return 0
+        return math.ceil(math.log(value, cls.gamma)) + 1
+
+    @classmethod
+    def get_value(cls, bucket: int) -> int:
+        if bucket <= 0:
+            return 0
+        return round(2 * cls.gamma ** (bucket - 1) / (cls.gamma + 1))
+
+    @classmethod
+    def get_quantiles(cls, buckets: Dict[int, int]) -> Quantiles:
+        count = sum(buckets.values())
+        if count == 0:
+            return Quantiles()
+        result = {}
+        targets = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+        cumulative = 0
+        for bucket in sorted(buckets):
+            cumulative += buckets[bucket]
+            for name, q in list(targets.items()):
+                if cumulative > q * (count - 1):
+                    result[name] = cls.get_value(bucket)
+                    del targets[name]
+        result["max"] = cls.get_value(max(buckets))
+        return Quantiles(**result)
+
+
+class JudgeStatisticsStore:
+    """
+    Rollups of judged records in redis hashes, one hash per scope (a problem
+    or a problem set). A record adds one to a few counters of each scope in a
+    single transaction, reading the statistics never scans records.
+    """
+
+    def __init__(self, prefix: str = "statistics:") -> None:
+        self.prefix = prefix
+        self.redis: Optional[aioredis.Redis] = None
+
+    async def get_redis(self) -> aioredis.Redis:
+        if self.redis is None or self.redis.closed:
+            self.redis = await create_redis_connection()
+        return self.redis
+
+    async def add_record(self, scopes: Iterable[str], record: RecordDetail) -> None:
+        fields: Counter[str] = Counter(
+            [
+                "count",
+                f"state:{record.state}",
+                f"score:{record.score // SCORE_HISTOGRAM_WIDTH}",
+                f"time:{QuantileSketch.get_bucket(record.time_ms)}",
+                f"memory:{QuantileSketch.get_bucket(record.memory_kb)}",
+            ]
+        )
+        fields.update(f"case:{case.state}" for case in record.cases)
+        redis = await self.get_redis()
+        transaction = redis.multi_exec()
+        for scope in scopes:
+            for field, increment in fields.items():
+                transaction.hincrby(self.prefix + scope, field, increment)
+        await transaction.execute()
+
+    async def get(self, scope: str) -> JudgeStatistics:
+        redis = await self.get_redis()
+        values = await redis.hgetall(self.prefix + scope)
+        statistics = JudgeStatistics()
+        scores: Dict[int, int] = {}
+        times: Dict[int, int] = {}
+        memories: Dict[int, int] = {}
+        for key, value in values.items():
+            kind, _, name = key.decode().partition(":")
+            count = int(value)
+            if kind == "count":
+                statistics.count = count
+            elif kind == "state":
+                statistics.states[name] = count
+            elif kind == "case":
+                statistics.case_results[name] = count
+            elif kind == "score":
+                scores[int(name)] = count
+            elif kind == "time":
+                times[int(name)] = count
+            elif kind == "memory":
+                memories[int(name)] = count
+        statistics.score_histogram = [
+            HistogramBucket(
+                lower=bucket * SCORE_HISTOGRAM_WIDTH,
+                upper=(bucket + 1) * SCORE_HISTOGRAM_WIDTH,
+                count=scores[bucket],
+            )
+            for bucket in sorted(scores)
+        ]
+        statistics.time_ms = QuantileSketch.get_quantiles(times)
+        statistics.memory_kb = QuantileSketch.get_quantiles(memories)
+        return statistics
+
+
+@lru_cache()
+def get_judge_statistics_store() -> JudgeStatisticsStore:
+    return JudgeStatisticsStore()
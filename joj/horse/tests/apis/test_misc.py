@@ -1,11 +1,17 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
 import jwt
+import orjson
 import pytest
+from fastapi.encoders import jsonable_encoder
 from httpx import AsyncClient
 from pytest_lazyfixture import lazy_fixture
 
 from joj.horse import models
 from joj.horse.app import app
 from joj.horse.config import settings
+from joj.horse.schemas.base import BaseModel, StandardListResponse, UTCDatetime
 from joj.horse.tests.utils.utils import do_api_request, user_access_tokens
 from joj.horse.utils.version import get_git_version, get_version
 
@@ -62,3 +68,34 @@ class TestMisc:
         assert response.status_code == 401
         res = response.json()
         assert res["detail"] == "Unauthorized"
+
+
+class DumpRowInner(BaseModel):
+    judged_at: UTCDatetime
+
+
+class DumpRowOuter(BaseModel):
+    created_at: UTCDatetime
+    latest_record: Optional[DumpRowInner]
+    records: List[DumpRowInner] = []
+
+
+def test_dump_row_nested_datetime() -> None:
+    at = datetime(2022, 5, 1, 12, 0, 0, 123456, tzinfo=timezone(timedelta(hours=8)))
+    data = {
+        "created_at": at,
+        "latest_record": {"judged_at": at},
+        "records": [{"judged_at": at}],
+    }
+    # nested models are built from trusted data too, never validated
+    row = {
+        "created_at": at,
+        "latest_record": DumpRowInner.construct(judged_at=at),
+        "records": [DumpRowInner.construct(judged_at=at)],
+    }
+    response = StandardListResponse.from_trusted([DumpRowOuter.dump_row(row)])
+    trusted = orjson.loads(response.body)["data"]["results"][0]  # type: ignore
+    validated = jsonable_encoder(DumpRowOuter(**data))
+    assert trusted == validated
+    assert trusted["latestRecord"]["judgedAt"] == trusted["createdAt"]
+    assert trusted["records"][0]["judgedAt"] == trusted["createdAt"]
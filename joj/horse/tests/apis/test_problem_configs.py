@@ -0,0 +1,548 @@
+import io
+import os
+import tarfile
+import warnings
+import zipfile
+from datetime import datetime, timezone
+from hashlib import md5
+from pathlib import Path
+from types import SimpleNamespace
+from typing import IO, Callable, Dict, Generator, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+import pytest
+from httpx import AsyncClient
+from joj.elephant.schemas import ArchiveType
+from pytest_lazyfixture import lazy_fixture
+
+from joj.horse import models, schemas
+from joj.horse.app import app
+from joj.horse.config import settings
+from joj.horse.models import problem_config as problem_config_model
+from joj.horse.services import lakefs
+from joj.horse.services.archive_cache import ArchiveCache, get_archive_cache
+from joj.horse.services.lakefs import LakeFSProblemConfig
+from joj.horse.services.problem_config_cache import get_problem_config_cache
+from joj.horse.tests.utils.utils import FakeS3, do_api_request, generate_auth_headers
+from joj.horse.utils.archive import (
+    ArchiveEntry,
+    iter_archive_members,
+    normalize_member_path,
+)
+from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.fastapi.responses import RangeNotSatisfiable, parse_range
+
+ARCHIVE_FILES = {
+    "config.json": b"{}",
+    "cases/0.in": b"1 2\n",
+    "cases/0.out": b"3\n",
+}
+
+
+async def create_problem_config(
+    problem: models.Problem, user: models.User, commit_id: str
+) -> models.ProblemConfig:
+    problem_config = models.ProblemConfig(
+        problem_id=problem.id, committer_id=user.id, commit_id=commit_id
+    )
+    await problem_config.save_model()
+    return problem_config
+
+
+@pytest.fixture
+def archive_cache_dir(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Generator[Path, None, None]:
+    monkeypatch.setattr(settings, "archive_cache_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "presigned_download", False)
+    get_archive_cache.cache_clear()
+    yield tmp_path
+    get_archive_cache.cache_clear()
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestProblemConfigJson:
+    url_base = "get_problem_config_json"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_problem_config_json(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        downloads: List[str] = []
+
+        def get_config(self: LakeFSProblemConfig, ref: str) -> dict:
+            downloads.append(ref)
+            return schemas.ProblemConfigJson.generate_default_value().dict()
+
+        monkeypatch.setattr(LakeFSProblemConfig, "get_config", get_config)
+        config = await create_problem_config(
+            global_problem, user, "problem_config_json_commit_0"
+        )
+        url = app.url_path_for(
+            self.url_base,
+            domain=global_domain.url,
+            problem=global_problem.url,
+            config=str(config.id),
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert data["commitId"] == config.commit_id
+        # served from the local cache, then from redis in a new worker
+        response = await do_api_request(client, "GET", url, user)
+        assert response.json()["data"] == data
+        get_problem_config_cache().local.clear()
+        response = await do_api_request(client, "GET", url, user)
+        assert response.json()["data"] == data
+        assert downloads == [config.commit_id]
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestProblemConfigArchive:
+    url_base = "download_problem_config_archive"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    @pytest.mark.parametrize("archive_format", [ArchiveType.zip, ArchiveType.tar])
+    async def test_download_streamed_archive(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+        archive_format: ArchiveType,
+        archive_cache_dir: Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        listed: List[Optional[str]] = []
+
+        def iter_objects(
+            self: LakeFSProblemConfig, ref: Optional[str] = None
+        ) -> Iterator[ArchiveEntry]:
+            listed.append(ref)
+            for path, content in ARCHIVE_FILES.items():
+
+                def open_object(content: bytes = content) -> IO[bytes]:
+                    return io.BytesIO(content)
+
+                yield ArchiveEntry(
+                    path=path,
+                    size=len(content),
+                    modified_at=datetime.now(timezone.utc),
+                    open=open_object,
+                )
+
+        monkeypatch.setattr(settings, "archive_streaming", True)
+        monkeypatch.setattr(LakeFSProblemConfig, "ensure_branch", lambda self: None)
+        monkeypatch.setattr(LakeFSProblemConfig, "iter_objects", iter_objects)
+        config = await create_problem_config(
+            global_problem, user, f"problem_config_archive_{archive_format.value}"
+        )
+        url = app.url_path_for(
+            self.url_base,
+            domain=global_domain.url,
+            problem=global_problem.url,
+            config=str(config.id),
+        )
+        query = {"archive_format": archive_format.value}
+        response = await do_api_request(client, "GET", url, user, query)
+        assert response.status_code == 200
+        assert "attachment" in response.headers["content-disposition"]
+        content = response.content
+        if archive_format == ArchiveType.zip:
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                files = {x: archive.read(x) for x in archive.namelist()}
+        else:
+            with tarfile.open(fileobj=io.BytesIO(content), mode="r:gz") as archive:
+                files = {
+                    x.name: archive.extractfile(x).read()  # type: ignore[union-attr]
+                    for x in archive.getmembers()
+                }
+        assert files == ARCHIVE_FILES
+        assert listed == [config.commit_id]
+        # the streamed archive is stored and served from the cache
+        response = await do_api_request(client, "GET", url, user, query)
+        assert response.status_code == 200
+        assert response.content == content
+        assert response.headers["accept-ranges"] == "bytes"
+        assert listed == [config.commit_id]
+
+
+def test_archive_cache_evict_least_recently_used(tmp_path: Path) -> None:
+    archive_cache = ArchiveCache(tmp_path, max_bytes=20)
+
+    def build(content: bytes) -> Callable[[Path], Path]:
+        def func(temp_dir: Path) -> Path:
+            path = temp_dir / "archive"
+            path.write_bytes(content)
+            return path
+
+        return func
+
+    old = archive_cache.get_or_build(
+        "repo", "commit_0", ArchiveType.zip, build(b"0" * 8)
+    )
+    new = archive_cache.get_or_build(
+        "repo", "commit_1", ArchiveType.zip, build(b"1" * 8)
+    )
+    for path in (old, new):
+        os.utime(path, (0, 0))
+        os.utime(path.with_suffix(".lock"), (0, 0))
+    # the old archive is used again, but the archive file is never modified
+    assert archive_cache.get("repo", "commit_0", ArchiveType.zip) == old
+    assert old.stat().st_mtime == 0
+    archive_cache.get_or_build("repo", "commit_2", ArchiveType.zip, build(b"2" * 8))
+    assert old.exists()
+    assert not new.exists()
+    # a builder may still hold the lock of an evicted archive
+    assert new.with_suffix(".lock").exists()
+    # the rebuilt archive is the most recently used again
+    for path in tmp_path.glob("*.lock"):
+        os.utime(path, (0, 0))
+    new = archive_cache.get_or_build(
+        "repo", "commit_1", ArchiveType.zip, build(b"1" * 8)
+    )
+    assert new.exists()
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        ("bytes=0-3", (0, 4)),
+        ("bytes=4-", (4, 10)),
+        ("bytes=-3", (7, 10)),
+        ("bytes=5-100", (5, 10)),
+        ("bytes=0-1,4-5", None),
+        ("items=0-3", None),
+        ("bytes=a-b", None),
+        ("bytes=3", None),
+    ],
+)
+def test_parse_range(header: str, expected: Optional[Tuple[int, int]]) -> None:
+    assert parse_range(header, 10) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10-", "bytes=5-4", "bytes=-0"])
+def test_parse_range_not_satisfiable(header: str) -> None:
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 10)
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestProblemConfigArchiveRange:
+    url_base = "download_problem_config_archive"
+    content = bytes(range(256)) * 4
+
+    async def get_url(
+        self, problem: models.Problem, user: models.User, domain: models.Domain
+    ) -> str:
+        """A config whose archive is already in the cache."""
+        config = await create_problem_config(problem, user, "problem_config_range")
+        repo_name = LakeFSProblemConfig(problem).repo_name
+        path = get_archive_cache().get_path(
+            repo_name, config.commit_id, ArchiveType.zip
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(self.content)
+        return app.url_path_for(
+            self.url_base, domain=domain.url, problem=problem.url, config=str(config.id)
+        )
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_download_range(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+        archive_cache_dir: Path,
+    ) -> None:
+        url = await self.get_url(global_problem, user, global_domain)
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        assert response.content == self.content
+        etag = response.headers["etag"]
+        last_modified = response.headers["last-modified"]
+
+        # the validators are the same on a hit, or after the archive is rebuilt
+        archive_path = next(archive_cache_dir.glob("*.zip"))
+        os.utime(archive_path, (0, 0))
+        headers = {**generate_auth_headers(user), "range": "bytes=100-199"}
+        response = await do_api_request(client, "GET", url, user, headers=headers)
+        assert response.status_code == 206
+        assert response.headers["etag"] == etag
+        assert response.headers["last-modified"] == last_modified
+        assert response.headers["content-range"] == f"bytes 100-199/{len(self.content)}"
+        assert response.content == self.content[100:200]
+
+        # resumed only if the archive has not changed
+        for if_range, status_code in ((etag, 206), (last_modified, 206), ('"x"', 200)):
+            headers = {
+                **generate_auth_headers(user),
+                "range": "bytes=-24",
+                "if-range": if_range,
+            }
+            response = await do_api_request(client, "GET", url, user, headers=headers)
+            assert response.status_code == status_code
+            if status_code == 206:
+                assert response.content == self.content[-24:]
+            else:
+                assert response.content == self.content
+
+        headers = {
+            **generate_auth_headers(user),
+            "range": f"bytes={len(self.content)}-",
+        }
+        response = await do_api_request(client, "GET", url, user, headers=headers)
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(self.content)}"
+
+
+@pytest.mark.parametrize(
+    "path,strip_components,expected",
+    [
+        ("a/b.in", 0, "a/b.in"),
+        ("./a/./b.in", 0, "a/b.in"),
+        ("/etc/passwd", 0, "etc/passwd"),
+        ("top/a/b.in", 1, "a/b.in"),
+        ("top/", 1, None),
+        ("top/a/b.in", 3, None),
+    ],
+)
+def test_normalize_member_path(
+    path: str, strip_components: int, expected: Optional[str]
+) -> None:
+    assert normalize_member_path(path, strip_components) == expected
+
+
+@pytest.mark.parametrize("path", ["../x", "a/../../x", "/a/../x"])
+def test_normalize_member_path_traversal(path: str) -> None:
+    with pytest.raises(BizError) as exc_info:
+        normalize_member_path(path)
+    assert exc_info.value.error_code == ErrorCode.FileValidationError
+
+
+def make_tar(members: List[tarfile.TarInfo], contents: Dict[str, bytes]) -> IO[bytes]:
+    file = io.BytesIO()
+    with tarfile.open(fileobj=file, mode="w:gz") as archive:
+        for info in members:
+            data = contents.get(info.name, b"")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    file.seek(0)
+    return file
+
+
+def make_zip(contents: Dict[str, bytes]) -> IO[bytes]:
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w") as archive:
+        for name, data in contents.items():
+            archive.writestr(name, data)
+    file.seek(0)
+    return file
+
+
+def read_members(file: IO[bytes], strip_components: int = 0) -> Dict[str, bytes]:
+    return {
+        member.path: member.file.read()
+        for member in iter_archive_members(file, strip_components)
+    }
+
+
+def test_iter_archive_members_tar() -> None:
+    def tar_info(name: str, type: bytes = tarfile.REGTYPE) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.type = type
+        if type == tarfile.SYMTYPE:
+            info.linkname = "/etc/passwd"
+        return info
+
+    contents = {"top/config.json": b"{}", "/top/cases/0.in": b"1 2\n"}
+    members = [
+        tar_info("top", tarfile.DIRTYPE),
+        tar_info("top/config.json"),
+        tar_info("/top/cases/0.in"),
+        # links and devices are never read
+        tar_info("top/link", tarfile.SYMTYPE),
+        tar_info("top/hard", tarfile.LNKTYPE),
+        tar_info("top/null", tarfile.CHRTYPE),
+        tar_info("top/fifo", tarfile.FIFOTYPE),
+    ]
+    assert read_members(make_tar(members, contents)) == {
+        "top/config.json": b"{}",
+        "top/cases/0.in": b"1 2\n",
+    }
+    assert read_members(make_tar(members, contents), strip_components=1) == {
+        "config.json": b"{}",
+        "cases/0.in": b"1 2\n",
+    }
+    members.append(tar_info("top/../../evil"))
+    with pytest.raises(BizError):
+        read_members(make_tar(members, contents))
+
+
+def test_iter_archive_members_zip() -> None:
+    contents = {"top/": b"", "top/config.json": b"{}", "/top/cases/0.in": b"1 2\n"}
+    assert read_members(make_zip(contents), strip_components=1) == {
+        "config.json": b"{}",
+        "cases/0.in": b"1 2\n",
+    }
+    with pytest.raises(BizError):
+        read_members(make_zip({**contents, "../evil": b""}))
+
+
+@pytest.mark.parametrize(
+    "size,etag_parts",
+    [(0, None), (1, None), (4, None), (5, 2), (8, 2), (9, 3)],
+)
+def test_copy_with_etag(
+    size: int, etag_parts: Optional[int], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(lakefs, "UPLOAD_PART_SIZE", 4)
+    data = bytes(range(size))
+    dest = io.BytesIO()
+    etag = lakefs.copy_with_etag(io.BytesIO(data), dest)
+    assert dest.getvalue() == data
+    # a single put up to the part size, a multipart upload beyond it
+    if etag_parts is None:
+        assert etag == md5(data).hexdigest()
+    else:
+        digests = b"".join(md5(data[i : i + 4]).digest() for i in range(0, size, 4))
+        assert etag == f"{md5(digests).hexdigest()}-{etag_parts}"
+    assert lakefs.copy_with_etag(io.BytesIO(data)) == etag
+
+
+def test_problem_config_file_changes() -> None:
+    old = {"config.json": "0", "a": "1", "b": "2"}
+    new = {"config.json": "0", "c": "3", "a": "4"}
+    changes = schemas.ProblemConfigFileChanges.from_checksums(old, new)
+    assert changes.added == ["c"]
+    assert changes.changed == ["a"]
+    assert changes.removed == ["b"]
+    assert changes.unchanged == 1
+    assert not changes.is_empty()
+    assert schemas.ProblemConfigFileChanges.from_checksums(old, old).is_empty()
+
+
+@pytest.mark.parametrize("archive_format", [ArchiveType.zip, ArchiveType.tar])
+def test_upload_archive_members(
+    archive_format: ArchiveType, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(lakefs, "UPLOAD_PART_SIZE", 4)
+    problem = SimpleNamespace(problem_group_id=uuid4(), id=uuid4(), title="upload")
+    problem_config = LakeFSProblemConfig(problem)  # type: ignore[arg-type]
+    prefix = f"{problem_config.branch_name}/"
+    s3 = FakeS3(
+        {
+            f"{prefix}config.json": b"{}",
+            f"{prefix}large.in": b"0123456789",
+            f"{prefix}small.in": b"old",
+            f"{prefix}removed.in": b"x",
+        }
+    )
+
+    monkeypatch.setattr(lakefs, "get_lakefs_s3_client", lambda: s3)
+    monkeypatch.setattr(
+        problem_config, "iter_object_stats", lambda: s3.iter_object_stats(prefix)
+    )
+    # a duplicated member replaces the earlier one, as if extracted
+    members = [
+        ("config.json", b"{}"),
+        ("small.in", b"first"),
+        ("large.in", b"0123456789"),
+        ("large.out", b"9876543210"),
+        ("small.in", b"new"),
+    ]
+    file = io.BytesIO()
+    if archive_format == ArchiveType.zip:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # duplicate name
+            with zipfile.ZipFile(file, "w") as archive:
+                for name, data in members:
+                    archive.writestr(name, data)
+    else:
+        with tarfile.open(fileobj=file, mode="w:gz") as archive:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    file.seek(0)
+
+    changes = problem_config.upload_archive_members(
+        file, schemas.ConfigMissing.raise_error
+    )
+    assert changes.added == ["large.out"]
+    assert changes.changed == ["small.in"]
+    assert changes.removed == ["removed.in"]
+    assert changes.unchanged == 2
+    assert s3.objects == {
+        f"{prefix}config.json": b"{}",
+        f"{prefix}large.in": b"0123456789",
+        f"{prefix}large.out": b"9876543210",
+        f"{prefix}small.in": b"new",
+    }
+    # unchanged members are never uploaded
+    assert [key for key, _ in s3.puts] == [
+        f"{prefix}small.in",
+        f"{prefix}large.out",
+        f"{prefix}small.in",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestProblemConfigBundle:
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_schedule_bundle(
+        self,
+        user: models.User,
+        global_problem: models.Problem,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        digests: List[Optional[str]] = [None, "digest_0"]
+        builds: List[str] = []
+
+        async def build_bundle(
+            lakefs_problem_config: LakeFSProblemConfig, commit_id: str
+        ) -> Optional[str]:
+            builds.append(commit_id)
+            return digests.pop(0)
+
+        monkeypatch.setattr(settings, "judge_bundle", True)
+        monkeypatch.setattr(
+            models.ProblemConfig, "build_bundle", staticmethod(build_bundle)
+        )
+        config = await create_problem_config(global_problem, user, "bundle_commit_0")
+
+        async def wait_bundle() -> None:
+            task = problem_config_model.pending_bundles.get(config.id)
+            if task is not None:
+                await task
+
+        # the first build fails, it is not retried at once
+        config.schedule_bundle(global_problem)
+        config.schedule_bundle(global_problem)
+        await wait_bundle()
+        config.schedule_bundle(global_problem)
+        await wait_bundle()
+        assert builds == [config.commit_id]
+        await config.refresh_model()
+        assert config.bundle_digest is None
+
+        # retried once the interval has passed
+        monkeypatch.setattr(problem_config_model, "BUNDLE_RETRY_INTERVAL", 0)
+        config.schedule_bundle(global_problem)
+        await wait_bundle()
+        assert builds == [config.commit_id] * 2
+        await config.refresh_model()
+        assert config.bundle_digest == "digest_0"
+        # never built again once built
+        config.schedule_bundle(global_problem)
+        assert config.id not in problem_config_model.pending_bundles
@@ -1,14 +1,438 @@
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
 import pytest
+from httpx import AsyncClient
+from pytest_lazyfixture import lazy_fixture
 
-from joj.horse import apis, models
-from joj.horse.tests.utils.utils import get_base_url, parametrize_global_problem_sets
+from joj.horse import apis, models, schemas
+from joj.horse.app import app
+from joj.horse.schemas.base import Operation
+from joj.horse.schemas.cache import get_redis_cache
+from joj.horse.tests.utils.utils import (
+    count_queries,
+    create_test_problem,
+    create_test_problem_set,
+    create_test_record,
+    do_api_request,
+    generate_auth_headers,
+    get_base_url,
+    parametrize_global_problem_sets,
+    validate_test_problem,
+    validate_test_problem_set,
+)
+from joj.horse.utils.errors import ErrorCode
 
 base_user_url = get_base_url(apis.users)
 
 
+@pytest.fixture(scope="module")
+async def problem_set_0(
+    client: AsyncClient,
+    global_domain_0: models.Domain,
+    global_root_user: models.User,
+) -> models.ProblemSet:
+    """
+    A new problem set for global_domain_0 with problem_0. Avoid earlier interference.
+    """
+    title = "problem_set_test_problem_set_0"
+    data = {"title": title, "url": title}
+    response = await create_test_problem_set(
+        client, global_domain_0, global_root_user, data
+    )
+    problem_set = await validate_test_problem_set(
+        response, global_domain_0, global_root_user, data
+    )
+    assert problem_set is not None
+    return problem_set
+
+
+@pytest.fixture(scope="module")
+async def problem_0(
+    client: AsyncClient,
+    global_domain_0: models.Domain,
+    global_root_user: models.User,
+    problem_set_0: models.ProblemSet,
+) -> models.Problem:
+    title = "problem_set_test_problem_0"
+    data = {"title": title, "url": title}
+    response = await create_test_problem(
+        client, global_domain_0, global_root_user, data
+    )
+    problem = await validate_test_problem(
+        response, global_domain_0, global_root_user, data
+    )
+    url = app.url_path_for(
+        "add_problem_in_problem_set",
+        domain=global_domain_0.url,
+        problemSet=problem_set_0.url,
+    )
+    data = {"problem": problem.url}
+    response = await do_api_request(client, "POST", url, global_root_user, data=data)
+    assert response.status_code == 200
+    return problem
+
+
 @pytest.mark.asyncio
 @pytest.mark.depends(name="TestProblemSetCreate", on=["TestDomainCreate"])
 class TestProblemSetCreate:
     @parametrize_global_problem_sets
     async def test_global_problem_sets(self, problem_set: models.ProblemSet) -> None:
         pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestProblemSetDetail:
+    url_base = "get_problem_set"
+
+    async def add_problems(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        domain: models.Domain,
+        problem_set: models.ProblemSet,
+        titles: List[str],
+    ) -> List[models.Problem]:
+        problems = []
+        for title in titles:
+            data = {"title": title, "url": title}
+            response = await create_test_problem(client, domain, user, data)
+            problem = await validate_test_problem(response, domain, user, data)
+            url = app.url_path_for(
+                "add_problem_in_problem_set",
+                domain=domain.url,
+                problemSet=problem_set.url,
+            )
+            data = {"problem": problem.url}
+            response = await do_api_request(client, "POST", url, user, data=data)
+            assert response.status_code == 200
+            problems.append(problem)
+        return problems
+
+    async def get_problem_set(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        domain: models.Domain,
+        problem_set: models.ProblemSet,
+    ) -> int:
+        url = app.url_path_for(
+            self.url_base, domain=domain.url, problemSet=problem_set.url
+        )
+        with count_queries() as statements:
+            response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        res = response.json()
+        assert res["errorCode"] == 0
+        self.problem_ids = [x["id"] for x in res["data"]["problems"]]
+        return len(statements)
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_query_count(
+        self, client: AsyncClient, user: models.User, global_domain_0: models.Domain
+    ) -> None:
+        title = "test_problem_set_detail"
+        data = {"title": title, "url": title}
+        response = await create_test_problem_set(client, global_domain_0, user, data)
+        problem_set = await validate_test_problem_set(
+            response, global_domain_0, user, data
+        )
+        assert problem_set is not None
+
+        problems = await self.add_problems(
+            client, user, global_domain_0, problem_set, [f"{title}_0"]
+        )
+        num_queries = await self.get_problem_set(
+            client, user, global_domain_0, problem_set
+        )
+        assert self.problem_ids == [str(x.id) for x in problems]
+
+        # the number of queries does not grow with the number of problems
+        problems += await self.add_problems(
+            client, user, global_domain_0, problem_set, [f"{title}_1", f"{title}_2"]
+        )
+        assert (
+            await self.get_problem_set(client, user, global_domain_0, problem_set)
+            == num_queries
+        )
+        assert self.problem_ids == [str(x.id) for x in problems]
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_reorder_problems(
+        self, client: AsyncClient, user: models.User, global_domain_0: models.Domain
+    ) -> None:
+        title = "test_problem_set_reorder"
+        data = {"title": title, "url": title}
+        response = await create_test_problem_set(client, global_domain_0, user, data)
+        problem_set = await validate_test_problem_set(
+            response, global_domain_0, user, data
+        )
+        assert problem_set is not None
+        problems = await self.add_problems(
+            client,
+            user,
+            global_domain_0,
+            problem_set,
+            [f"{title}_{i}" for i in range(3)],
+        )
+
+        # move the last problem to the middle
+        url = app.url_path_for(
+            "update_problem_in_problem_set",
+            domain=global_domain_0.url,
+            problemSet=problem_set.url,
+            problem=problems[2].url,
+        )
+        data = {"position": 1}
+        response = await do_api_request(client, "PATCH", url, user, data=data)
+        assert response.status_code == 200
+        await self.get_problem_set(client, user, global_domain_0, problem_set)
+        expected = [problems[0], problems[2], problems[1]]
+        assert self.problem_ids == [str(x.id) for x in expected]
+
+        url = app.url_path_for(
+            "reorder_problems_in_problem_set",
+            domain=global_domain_0.url,
+            problemSet=problem_set.url,
+        )
+        expected = [problems[1], problems[0], problems[2]]
+        data = {"problemIds": [x.id for x in expected]}
+        response = await do_api_request(client, "PUT", url, user, data=data)
+        assert response.status_code == 200
+        assert response.json()["errorCode"] == 0
+        await self.get_problem_set(client, user, global_domain_0, problem_set)
+        assert self.problem_ids == [str(x.id) for x in expected]
+
+        # an ordering missing a problem is rejected
+        data = {"problemIds": [x.id for x in expected[:2]]}
+        response = await do_api_request(client, "PUT", url, user, data=data)
+        assert response.json()["errorCode"] == ErrorCode.IntegrityError
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_operate_problems_without_request(
+        self, client: AsyncClient, user: models.User, global_domain_0: models.Domain
+    ) -> None:
+        title = "test_problem_set_operate"
+        data = {"title": title, "url": title}
+        response = await create_test_problem_set(client, global_domain_0, user, data)
+        problem_set = await validate_test_problem_set(
+            response, global_domain_0, user, data
+        )
+        assert problem_set is not None
+        problems = []
+        for i in range(3):
+            data = {"title": f"{title}_{i}", "url": f"{title}_{i}"}
+            response = await create_test_problem(client, global_domain_0, user, data)
+            problems.append(
+                await validate_test_problem(response, global_domain_0, user, data)
+            )
+
+        # outside a request, every call opens its own sessions
+        updated_at = problem_set.updated_at
+        for problem in problems:
+            await problem_set.operate_problem(problem, Operation.Create)
+        await problem_set.operate_problem(problems[2], Operation.Update, 0)
+        await problem_set.operate_problem(problems[1], Operation.Delete)
+        fetched = await models.ProblemSet.one_or_none(id=problem_set.id)
+        assert fetched is not None
+        assert await fetched.get_problem_ids() == [problems[2].id, problems[0].id]
+        assert fetched.updated_at is not None and updated_at is not None
+        assert fetched.updated_at > updated_at
+
+        await problem_set.reorder_problems([problems[0].id, problems[2].id])
+        fetched = await models.ProblemSet.one_or_none(id=problem_set.id)
+        assert fetched is not None
+        assert await fetched.get_problem_ids() == [problems[0].id, problems[2].id]
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestProblemSetList:
+    url_base = "list_problem_sets"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_trusted_response_same_as_detail(
+        self, client: AsyncClient, user: models.User, global_domain_0: models.Domain
+    ) -> None:
+        title = "test_problem_set_list_datetime"
+        data = {
+            "title": title,
+            "url": title,
+            "dueAt": "2030-01-02T03:04:05.678+08:00",
+            "lockAt": "2030-01-01T00:00:00Z",
+        }
+        response = await create_test_problem_set(client, global_domain_0, user, data)
+        problem_set = await validate_test_problem_set(
+            response, global_domain_0, user, data
+        )
+        assert problem_set is not None
+
+        url = app.url_path_for(self.url_base, domain=global_domain_0.url)
+        query = {"ordering": "-created_at", "limit": "1"}
+        response = await do_api_request(client, "GET", url, user, query)
+        assert response.status_code == 200
+        results = response.json()["data"]["results"]
+        assert len(results) == 1
+        result = results[0]
+        assert result["id"] == str(problem_set.id)
+
+        url = app.url_path_for(
+            "get_problem_set", domain=global_domain_0.url, problemSet=problem_set.url
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        detail = response.json()["data"]
+        # the datetimes of the orjson fast path are formatted as the models
+        assert result["dueAt"] is not None
+        for key, value in result.items():
+            assert detail[key] == value, key
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestScoreboard:
+    url_base = "get_scoreboard"
+
+    async def get_scoreboard(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        domain: models.Domain,
+        problem_set: models.ProblemSet,
+    ) -> Dict[str, Any]:
+        url = app.url_path_for(
+            self.url_base, domain=domain.url, problemSet=problem_set.url
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        return response.json()["data"]
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_scoreboard(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        problem_set_0: models.ProblemSet,
+        problem_0: models.Problem,
+    ) -> None:
+        record = await create_test_record(problem_0, user, problem_set_0)
+        record.state = schemas.RecordState.accepted
+        record.score = 100
+        await record.save_model()
+        await record.finish_judge()
+        # a retried result of the judger is not another try
+        await record.finish_judge()
+        res = await self.get_scoreboard(client, user, global_domain_0, problem_set_0)
+        assert res["count"] == 1
+        entry = res["results"][0]
+        assert entry["rank"] == 1
+        assert entry["user"]["id"] == str(user.id)
+        assert entry["score"] == 100
+        assert entry["tries"] == 1
+        assert entry["numAccept"] == 1
+        assert len(entry["cells"]) == 1
+        assert entry["cells"][0]["problemId"] == str(problem_0.id)
+        assert entry["cells"][0]["accepted"]
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_scoreboard_not_modified(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        problem_set_0: models.ProblemSet,
+    ) -> None:
+        url = app.url_path_for(
+            self.url_base, domain=global_domain_0.url, problemSet=problem_set_0.url
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        headers = {"If-None-Match": etag, **generate_auth_headers(user)}
+        response = await do_api_request(client, "GET", url, user, headers=headers)
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_frozen_scoreboard(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        problem_0: models.Problem,
+    ) -> None:
+        title = "problem_set_test_frozen_problem_set"
+        data = {"title": title, "url": title}
+        response = await create_test_problem_set(client, global_domain_0, user, data)
+        problem_set = await validate_test_problem_set(
+            response, global_domain_0, user, data
+        )
+        assert problem_set is not None
+        problem_set.lock_at = datetime.now(timezone.utc) - timedelta(hours=1)
+        await problem_set.save_model()
+        # rejected before the freeze time, accepted after it
+        for created_at, state in (
+            (problem_set.lock_at - timedelta(minutes=10), schemas.RecordState.rejected),
+            (None, schemas.RecordState.accepted),
+        ):
+            record = await create_test_record(problem_0, user, problem_set)
+            if created_at is not None:
+                record.created_at = created_at
+            record.state = state
+            record.score = 100 if state == schemas.RecordState.accepted else 0
+            await record.save_model()
+            await record.finish_judge()
+
+        def parse(snapshot: schemas.ScoreboardSnapshot) -> Dict[str, Any]:
+            return json.loads(snapshot.body)["data"]
+
+        live = await models.ScoreboardEntry.get_snapshot(problem_set, None, False)
+        assert parse(live)["results"][0]["tries"] == 2
+        assert parse(live)["results"][0]["numAccept"] == 1
+        # a page size never requested before the freeze, and after the cache
+        # of the frozen scoreboard is gone
+        for _ in range(2):
+            pagination = schemas.PaginationQuery(offset=0, limit=7)
+            frozen = await models.ScoreboardEntry.get_snapshot(
+                problem_set, pagination, True
+            )
+            res = parse(frozen)
+            assert res["count"] == 1
+            entry = res["results"][0]
+            assert entry["rank"] == 1
+            assert entry["tries"] == 1
+            assert entry["score"] == 0
+            assert entry["numAccept"] == 0
+            await get_redis_cache().clear(namespace="scoreboards")
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestProblemSetProgress:
+    url_base = "get_problem_set_progress"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_problem_set_progress(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        problem_set_0: models.ProblemSet,
+        problem_0: models.Problem,
+    ) -> None:
+        record = await create_test_record(problem_0, user, problem_set_0)
+        url = app.url_path_for(
+            self.url_base, domain=global_domain_0.url, problemSet=problem_set_0.url
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        res = response.json()
+        res = res["data"]
+        assert res["problemIds"] == [str(problem_0.id)]
+        rows = [x for x in res["results"] if x["user"]["id"] == str(user.id)]
+        assert len(rows) == 1
+        assert rows[0]["cells"][0]["recordId"] == str(record.id)
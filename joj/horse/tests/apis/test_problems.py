@@ -1,7 +1,17 @@
 import pytest
+from httpx import AsyncClient
+from pytest_lazyfixture import lazy_fixture
 
-from joj.horse import apis, models
-from joj.horse.tests.utils.utils import get_base_url, parametrize_global_problems
+from joj.horse import apis, models, schemas
+from joj.horse.app import app
+from joj.horse.services.counter import get_buffered_counter
+from joj.horse.tests.utils.utils import (
+    create_test_record,
+    do_api_request,
+    generate_auth_headers,
+    get_base_url,
+    parametrize_global_problems,
+)
 
 base_user_url = get_base_url(apis.users)
 
@@ -12,3 +22,145 @@ class TestProblemCreate:
     @parametrize_global_problems
     async def test_global_problems(self, problem: models.Problem) -> None:
         pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestProblemCounters:
+    url_base = "get_problem_counters"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_problem_counters(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+    ) -> None:
+        url = app.url_path_for(
+            self.url_base, domain=global_domain.url, problem=global_problem.url
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        before = response.json()["data"]
+        await models.Problem.increment_counter(global_problem.id, "num_submit")
+        response = await do_api_request(client, "GET", url, user)
+        after = response.json()["data"]
+        assert after["numSubmit"] == before["numSubmit"] + 1
+        assert after["numAccept"] == before["numAccept"]
+        # the counters are moved to the database, but the value is unchanged
+        await models.Problem.flush_counters()
+        response = await do_api_request(client, "GET", url, user)
+        assert response.json()["data"] == after
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_flush_counters_retried(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        url = app.url_path_for(
+            self.url_base, domain=global_domain.url, problem=global_problem.url
+        )
+        await models.Problem.increment_counter(global_problem.id, "num_submit")
+        response = await do_api_request(client, "GET", url, user)
+        expected = response.json()["data"]
+        counter = get_buffered_counter("problems")
+
+        async def ack() -> None:
+            raise RuntimeError("the worker dies before the ack")
+
+        # the deltas are committed to the database but still in redis
+        with monkeypatch.context() as m:
+            m.setattr(counter, "ack", ack)
+            with pytest.raises(RuntimeError):
+                await models.Problem.flush_counters()
+        # the retried batch is not applied again
+        await models.Problem.flush_counters()
+        response = await do_api_request(client, "GET", url, user)
+        assert response.json()["data"] == expected
+        await global_problem.refresh_model()
+        assert global_problem.num_submit == expected["numSubmit"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestProblemNotModified:
+    url_base = "get_problem"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_problem_not_modified(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+    ) -> None:
+        url = app.url_path_for(
+            self.url_base, domain=global_domain.url, problem=global_problem.url
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        headers = {"If-None-Match": etag, **generate_auth_headers(user)}
+        response = await do_api_request(client, "GET", url, user, headers=headers)
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+        # an update of the problem changes the etag
+        url_update = app.url_path_for(
+            "update_problem", domain=global_domain.url, problem=global_problem.url
+        )
+        data = {"content": "updated content"}
+        response = await do_api_request(client, "PATCH", url_update, user, data=data)
+        assert response.status_code == 200
+        response = await do_api_request(client, "GET", url, user, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        data = {"content": global_problem.content}
+        response = await do_api_request(client, "PATCH", url_update, user, data=data)
+        assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestJudgeStatistics:
+    url_base = "get_problem_statistics"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_problem_statistics(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+    ) -> None:
+        url = app.url_path_for(
+            self.url_base, domain=global_domain.url, problem=global_problem.url
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        before = response.json()["data"]
+        record = await create_test_record(global_problem, user)
+        record.state = schemas.RecordState.rejected
+        record.time_ms = 1000
+        record.cases = [
+            schemas.RecordCase(state=schemas.RecordCaseResult.accepted).dict(),
+            schemas.RecordCase(state=schemas.RecordCaseResult.wrong_answer).dict(),
+        ]
+        await record.save_model()
+        await record.finish_judge()
+        # a retried result of the judger is not counted again
+        await record.finish_judge()
+        response = await do_api_request(client, "GET", url, user)
+        after = response.json()["data"]
+        assert after["count"] == before["count"] + 1
+        assert after["states"]["rejected"] == before["states"].get("rejected", 0) + 1
+        assert after["caseResults"]["wrong_answer"] == (
+            before["caseResults"].get("wrong_answer", 0) + 1
+        )
+        assert 980 <= after["timeMs"]["max"] <= 1020
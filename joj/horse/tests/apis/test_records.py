@@ -1,16 +1,40 @@
+import asyncio
+import csv
+import io
+import tarfile
+from datetime import datetime, timedelta
+from hashlib import sha256
+from types import SimpleNamespace
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import orjson
 import pytest
 from httpx import AsyncClient
 from pytest_lazyfixture import lazy_fixture
 
-from joj.horse import models
+from joj.horse import models, schemas
 from joj.horse.app import app
+from joj.horse.services import lakefs
+from joj.horse.services.lakefs import RECORD_BUNDLE_NAME, LakeFSRecord
+from joj.horse.services.pubsub import PubSub, get_pubsub
 from joj.horse.tests.utils.utils import (
+    FakeS3,
     create_test_problem,
     create_test_problem_set,
+    create_test_record,
     do_api_request,
     validate_test_problem,
     validate_test_problem_set,
 )
+from joj.horse.utils.archive import read_bundle_file, write_bundle
+from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.exception_handlers import idempotent_replay_handler
+from joj.horse.utils.idempotency import (
+    Idempotency,
+    IdempotentReplay,
+    parse_idempotency_key,
+)
 
 
 @pytest.fixture(scope="module")
@@ -275,6 +299,508 @@ class TestRecordList:
             == 1
         )
 
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_list_records_trusted_response(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+    ) -> None:
+        url = app.url_path_for(self.url_base, domain=global_domain_0.url)
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        assert response.headers["server-timing"].startswith("serialize;dur=")
+        res = response.json()
+        assert res["errorCode"] == ErrorCode.Success
+        fields = {field.alias for field in schemas.RecordListDetail.__fields__.values()}
+        for result in res["data"]["results"]:
+            assert set(result.keys()) == fields
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestRecordBatch:
+    url_base = "get_records_batch"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_records_batch(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        record_0: models.Record,
+        record_2: models.Record,
+        record_3: models.Record,
+    ) -> None:
+        url = app.url_path_for(self.url_base, domain=global_domain_0.url)
+        ids = [str(record_2.id), str(record_0.id), str(record_3.id)]
+        response = await do_api_request(client, "GET", url, user, {"ids": ids})
+        assert response.status_code == 200
+        res = response.json()
+        res = res["data"]
+        # record_3 is in another domain
+        assert res["count"] == 2
+        assert [x["id"] for x in res["results"]] == ids[:2]
+        for result in res["results"]:
+            assert "cases" not in result
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_get_records_batch_include_cases(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        record_0: models.Record,
+    ) -> None:
+        url = app.url_path_for(self.url_base, domain=global_domain_0.url)
+        query = {"ids": [str(record_0.id)], "includeCases": True}
+        response = await do_api_request(client, "GET", url, user, query)
+        assert response.status_code == 200
+        res = response.json()
+        res = res["data"]
+        assert res["count"] == 1
+        assert res["results"][0]["cases"] == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestRecordExport:
+    url_base = "export_records_in_domain"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_export_records_ndjson(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        problem_0: models.Problem,
+        record_0: models.Record,
+        record_1: models.Record,
+    ) -> None:
+        url = app.url_path_for(self.url_base, domain=global_domain_0.url)
+        query = {"problem": str(problem_0.id), "exportFormat": "ndjson"}
+        response = await do_api_request(client, "GET", url, user, query)
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert len(lines) == 2
+        ids = {orjson.loads(line)["id"] for line in lines}
+        assert ids == {str(record_0.id), str(record_1.id)}
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_export_records_csv(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        problem_1: models.Problem,
+        record_2: models.Record,
+    ) -> None:
+        url = app.url_path_for(self.url_base, domain=global_domain_0.url)
+        query = {"problem": str(problem_1.id), "exportFormat": "csv"}
+        response = await do_api_request(client, "GET", url, user, query)
+        assert response.status_code == 200
+        rows = list(csv.DictReader(response.text.splitlines()))
+        assert len(rows) == 1
+        assert rows[0]["id"] == str(record_2.id)
+        assert rows[0]["problemTitle"] == problem_1.title
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_export_records_same_timestamps(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        problem_1: models.Problem,
+        record_2: models.Record,
+    ) -> None:
+        url = app.url_path_for(self.url_base, domain=global_domain_0.url)
+        query = {"problem": str(problem_1.id), "exportFormat": "ndjson"}
+        response = await do_api_request(client, "GET", url, user, query)
+        (ndjson_row,) = [orjson.loads(line) for line in response.text.splitlines()]
+        query["exportFormat"] = "csv"
+        response = await do_api_request(client, "GET", url, user, query)
+        (csv_row,) = csv.DictReader(response.text.splitlines())
+        assert ndjson_row["createdAt"]
+        for key in ["createdAt", "updatedAt"]:
+            assert csv_row[key] == ndjson_row[key]
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestRecordCode:
+    url_base = "download_record_code"
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_download_code_not_uploaded(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        record_0: models.Record,
+    ) -> None:
+        url = app.url_path_for(
+            self.url_base,
+            domain=global_domain_0.url,
+            record=str(record_0.id),
+            path="main.c",
+        )
+        response = await do_api_request(client, "GET", url, user)
+        assert response.status_code == 200
+        res = response.json()
+        assert res["errorCode"] == ErrorCode.FileDownloadError
+
+
+def test_bundle_round_trip() -> None:
+    files = [("./src/main.c", io.BytesIO(b"int main() {}")), ("a.txt", io.BytesIO())]
+    bundle = io.BytesIO()
+    write_bundle(files, {"language": "c"}, bundle)
+
+    bundle.seek(0)
+    with tarfile.open(fileobj=bundle, mode="r:gz") as archive:
+        assert archive.getnames() == [
+            "manifest.json",
+            "files/src/main.c",
+            "files/a.txt",
+        ]
+        manifest_file = archive.extractfile("manifest.json")
+        assert manifest_file is not None
+        manifest = orjson.loads(manifest_file.read())
+    assert manifest["language"] == "c"
+    assert manifest["files"][0] == {
+        "path": "src/main.c",
+        "size": 13,
+        "sha256": sha256(b"int main() {}").hexdigest(),
+    }
+
+    for path in ["src/main.c", "./src/main.c", "src//main.c"]:
+        bundle.seek(0)
+        assert read_bundle_file(bundle, path) == b"int main() {}"
+    bundle.seek(0)
+    assert read_bundle_file(bundle, "a.txt") == b""
+    for path in ["main.c", "manifest.json"]:
+        bundle.seek(0)
+        with pytest.raises(BizError) as e:
+            read_bundle_file(bundle, path)
+        assert e.value.error_code == ErrorCode.FileDownloadError
+    with pytest.raises(BizError) as e:
+        read_bundle_file(bundle, "../files/a.txt")
+    assert e.value.error_code == ErrorCode.FileValidationError
+
+
+def test_upload_bundle_deletes_loose_files(monkeypatch: pytest.MonkeyPatch) -> None:
+    problem = SimpleNamespace(id=uuid4())
+    record = SimpleNamespace(problem_id=problem.id, committer_id=uuid4(), id=uuid4())
+    lakefs_record = LakeFSRecord(problem, record)  # type: ignore[arg-type]
+    prefix = f"{lakefs_record.branch_name}/"
+    # files of an earlier submission uploaded before bundles are enabled
+    s3 = FakeS3({f"{prefix}main.c": b"old", f"{prefix}src/util.h": b"old"})
+    monkeypatch.setattr(lakefs, "get_lakefs_s3_client", lambda: s3)
+    monkeypatch.setattr(
+        lakefs_record, "iter_object_stats", lambda: s3.iter_object_stats(prefix)
+    )
+
+    lakefs_record.upload_bundle(
+        RECORD_BUNDLE_NAME, ["main.c"], [io.BytesIO(b"new")], {}
+    )
+    assert list(s3.objects) == [f"{prefix}{RECORD_BUNDLE_NAME}"]
+    bundle = io.BytesIO(s3.objects[f"{prefix}{RECORD_BUNDLE_NAME}"])
+    assert read_bundle_file(bundle, "main.c") == b"new"
+
+
+def test_get_fingerprint() -> None:
+    problem_config_id = uuid4()
+
+    def get_fingerprint(language: str = "c", **files: bytes) -> str:
+        problem_submit = SimpleNamespace(
+            language=language,
+            files=[
+                SimpleNamespace(filename=filename, file=io.BytesIO(data))
+                for filename, data in files.items()
+            ],
+        )
+        fingerprint = models.Record.get_fingerprint(
+            problem_submit, problem_config_id  # type: ignore[arg-type]
+        )
+        for file in problem_submit.files:
+            assert file.file.tell() == 0
+        return fingerprint
+
+    fingerprint = get_fingerprint(**{"a.c": b"int a;", "b.c": b"int b;"})
+    # the order of the files does not matter
+    assert get_fingerprint(**{"b.c": b"int b;", "a.c": b"int a;"}) == fingerprint
+    assert get_fingerprint("cc", **{"a.c": b"int a;", "b.c": b"int b;"}) != fingerprint
+    assert get_fingerprint(**{"a.c": b"int a;", "b.c": b"int c;"}) != fingerprint
+    assert get_fingerprint(**{"a.c": b"int a;", "c.c": b"int b;"}) != fingerprint
+    # a file name is never mixed up with the contents
+    assert get_fingerprint(**{"a.c": b"int a;b.c"}) != get_fingerprint(
+        **{"a.c": b"int a;", "b.c": b""}
+    )
+    problem_config_id = uuid4()
+    assert get_fingerprint(**{"a.c": b"int a;", "b.c": b"int b;"}) != fingerprint
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestRecordDuplicate:
+    @staticmethod
+    async def create_record(
+        problem: models.Problem,
+        user: models.User,
+        fingerprint: str,
+        commit_id: Optional[str] = "commit_0",
+        state: schemas.RecordState = schemas.RecordState.accepted,
+    ) -> models.Record:
+        record = await create_test_record(problem, user)
+        record.fingerprint = fingerprint
+        record.commit_id = commit_id
+        record.state = state
+        await record.save_model()
+        return record
+
+    async def test_find_duplicate(
+        self,
+        problem_1: models.Problem,
+        global_root_user: models.User,
+        global_domain_user: models.User,
+    ) -> None:
+        fingerprint = uuid4().hex
+        assert (
+            await models.Record.find_duplicate(
+                global_root_user.id, problem_1.id, fingerprint
+            )
+            is None
+        )
+        await self.create_record(problem_1, global_root_user, fingerprint)
+        latest = await self.create_record(problem_1, global_root_user, fingerprint)
+        # not uploaded yet, or submitted by another user
+        await self.create_record(problem_1, global_root_user, fingerprint, None)
+        await self.create_record(problem_1, global_domain_user, fingerprint)
+        await self.create_record(problem_1, global_root_user, uuid4().hex)
+
+        duplicate = await models.Record.find_duplicate(
+            global_root_user.id, problem_1.id, fingerprint
+        )
+        assert duplicate is not None
+        assert duplicate.id == latest.id
+        assert (
+            await models.Record.find_duplicate(
+                global_domain_user.id, problem_1.id, uuid4().hex
+            )
+            is None
+        )
+
+    async def test_is_result_reusable(
+        self,
+        problem_1: models.Problem,
+        global_root_user: models.User,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        domain = SimpleNamespace(duplicate_result_seconds=0)
+
+        async def get_domain(**_: Any) -> SimpleNamespace:
+            return domain
+
+        monkeypatch.setattr(models.Domain, "one_or_none", get_domain)
+        record = await self.create_record(problem_1, global_root_user, uuid4().hex)
+        assert not await record.is_result_reusable()
+
+        domain.duplicate_result_seconds = 60
+        assert await record.is_result_reusable()
+        record.state = schemas.RecordState.failed
+        assert not await record.is_result_reusable()
+        record.state = schemas.RecordState.rejected
+        assert await record.is_result_reusable()
+        assert record.created_at is not None
+        record.created_at -= timedelta(seconds=61)
+        assert not await record.is_result_reusable()
+
+    async def test_reuse_result(
+        self,
+        problem_1: models.Problem,
+        global_root_user: models.User,
+        global_domain_user: models.User,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        duplicate = await self.create_record(problem_1, global_root_user, uuid4().hex)
+        duplicate.judger_id = global_domain_user.id
+        duplicate.judged_at = datetime.utcnow() - timedelta(hours=1)
+        duplicate.score = 100
+        duplicate.cases = [{"state": "accepted", "score": 100}]
+        await duplicate.save_model()
+
+        record = await create_test_record(problem_1, global_root_user)
+        record.copy_result(duplicate)
+        assert record.commit_id == duplicate.commit_id
+        assert record.state == schemas.RecordState.accepted
+        assert record.score == 100
+        assert record.cases == duplicate.cases
+        assert record.judger_id is None
+        assert record.judged_at is not None
+        assert record.judged_at > duplicate.judged_at
+        await record.save_model()
+
+        statistics_updates = []
+
+        async def update_statistics(self: models.Record) -> None:
+            statistics_updates.append(self.id)
+
+        monkeypatch.setattr(models.Record, "update_statistics", update_statistics)
+        await record.finish_judge(reused=True)
+        assert record.counted
+        assert statistics_updates == []
+        await duplicate.finish_judge()
+        assert statistics_updates == [duplicate.id]
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestRecordIdempotency:
+    @staticmethod
+    def parse(
+        path: str, idempotency_key: str, user: models.User
+    ) -> AsyncGenerator[Optional[Idempotency], None]:
+        request = SimpleNamespace(method="POST", url=SimpleNamespace(path=path))
+        return parse_idempotency_key(
+            request, idempotency_key, user  # type: ignore[arg-type]
+        )
+
+    async def test_replay(
+        self,
+        client: AsyncClient,
+        global_root_user: models.User,
+        record_0: models.Record,
+    ) -> None:
+        path, key = f"/records/{uuid4()}", uuid4().hex
+        dependency = self.parse(path, key, global_root_user)
+        idempotency = await dependency.__anext__()
+        assert idempotency is not None
+        await idempotency.save(
+            schemas.StandardResponse(schemas.Record.from_orm(record_0))
+        )
+        with pytest.raises(StopAsyncIteration):
+            await dependency.__anext__()
+
+        with pytest.raises(IdempotentReplay) as e:
+            await self.parse(path, key, global_root_user).__anext__()
+        data = e.value.content["data"]
+        assert data["id"] == str(record_0.id)
+        assert data["timeMs"] == record_0.time_ms
+        # only the fields of the response schema are saved
+        assert "commitId" not in data and "fingerprint" not in data
+        response = await idempotent_replay_handler(None, e.value)  # type: ignore
+        assert response.headers["idempotent-replayed"] == "true"
+        assert orjson.loads(response.body) == e.value.content
+
+        # scoped to the path and the user
+        dependency = self.parse(f"/records/{uuid4()}", key, global_root_user)
+        assert await dependency.__anext__() is not None
+        await dependency.aclose()
+
+    async def test_key_in_use(
+        self, client: AsyncClient, global_root_user: models.User
+    ) -> None:
+        path, key = f"/records/{uuid4()}", uuid4().hex
+        dependency = self.parse(path, key, global_root_user)
+        assert await dependency.__anext__() is not None
+        with pytest.raises(BizError) as e:
+            await self.parse(path, key, global_root_user).__anext__()
+        assert e.value.error_code == ErrorCode.IdempotencyKeyInUseError
+
+        # released if no response is saved
+        await dependency.aclose()
+        dependency = self.parse(path, key, global_root_user)
+        assert await dependency.__anext__() is not None
+        await dependency.aclose()
+
+    async def test_key_released_on_error(
+        self, client: AsyncClient, global_root_user: models.User
+    ) -> None:
+        path, key = f"/records/{uuid4()}", uuid4().hex
+        dependency = self.parse(path, key, global_root_user)
+        assert await dependency.__anext__() is not None
+        with pytest.raises(BizError):
+            await dependency.athrow(BizError(ErrorCode.ProblemConfigNotFoundError))
+
+        dependency = self.parse(path, key, global_root_user)
+        idempotency = await dependency.__anext__()
+        assert idempotency is not None
+        await idempotency.save(schemas.StandardResponse())
+        await dependency.aclose()
+        with pytest.raises(IdempotentReplay):
+            await self.parse(path, key, global_root_user).__anext__()
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestDomainCreate"])
+class TestRecordStream:
+    url_base = "stream_record"
+
+    @staticmethod
+    def parse_events(content: bytes) -> List[Tuple[str, Dict[str, Any]]]:
+        events = []
+        for block in content.decode().split("\n\n"):
+            lines = dict(
+                line.split(": ", 1) for line in block.splitlines() if ": " in line
+            )
+            if "event" in lines:
+                events.append((lines["event"], orjson.loads(lines["data"])))
+        return events
+
+    @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
+    async def test_stream_record(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        global_domain_0: models.Domain,
+        record_0: models.Record,
+    ) -> None:
+        record = models.Record(
+            domain_id=record_0.domain_id,
+            problem_id=record_0.problem_id,
+            problem_config_id=record_0.problem_config_id,
+            committer_id=user.id,
+        )
+        await record.save_model()
+        url = app.url_path_for(
+            self.url_base, domain=global_domain_0.url, record=str(record.id)
+        )
+        task = asyncio.create_task(do_api_request(client, "GET", url, user))
+        # wait until the stream is subscribed, otherwise the state is missed
+        channel = models.Record.get_channel(record.id)
+        pubsub = get_pubsub()
+        for _ in range(100):
+            if channel in pubsub.queues or task.done():
+                break
+            await asyncio.sleep(0.05)
+        assert channel in pubsub.queues
+        record.state = schemas.RecordState.accepted
+        await record.save_model()
+        await record.publish_state()
+        response = await asyncio.wait_for(task, 10)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = self.parse_events(response.content)
+        assert events[0][0] == "record"
+        assert events[0][1]["id"] == str(record.id)
+        # the stream ends with the finished record
+        assert events[-1][0] == "record"
+        assert events[-1][1]["state"] == schemas.RecordState.accepted
+
+    async def test_drop_slow_subscriber(self) -> None:
+        pubsub = PubSub()
+        fast: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=1)
+        slow: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=1)
+        pubsub.queues["channel"] = {fast, slow}
+        pubsub.dispatch("channel", b"0")
+        assert fast.get_nowait() == b"0"
+        pubsub.dispatch("channel", b"1")
+        assert pubsub.queues["channel"] == {fast}
+        assert slow.get_nowait() is None
+        assert fast.get_nowait() == b"1"
+        pubsub.drop_all()
+        assert pubsub.queues == {}
+        assert fast.get_nowait() is None
+
 
 #     @pytest.mark.parametrize("user", [lazy_fixture("global_root_user")])
 #     async def test_list_domain_desc(
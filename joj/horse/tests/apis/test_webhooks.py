@@ -0,0 +1,290 @@
+import hmac
+from hashlib import sha256
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import orjson
+import pytest
+from httpx import AsyncClient
+from pytest_lazyfixture import lazy_fixture
+
+from joj.horse import models
+from joj.horse.apis import webhooks
+from joj.horse.app import app
+from joj.horse.config import settings
+from joj.horse.models.permission import DefaultRole
+from joj.horse.schemas.gitea_webhook import EMPTY_COMMIT_ID, GiteaWebhook
+from joj.horse.tests.utils.utils import do_api_request
+from joj.horse.utils import lock
+
+GITEA_REPO = "joj/webhook_test_repo"
+GITEA_TIME = "2022-05-01T12:00:00+08:00"
+
+
+def gitea_user() -> Dict[str, Any]:
+    return {
+        "id": 1,
+        "login": "joj",
+        "full_name": "",
+        "email": "joj@sjtu.edu.cn",
+        "avatar_url": "",
+        "language": "",
+        "is_admin": False,
+        "last_login": GITEA_TIME,
+        "created": GITEA_TIME,
+        "restricted": False,
+        "username": "joj",
+    }
+
+
+def gitea_commit(
+    commit_id: str,
+    added: Optional[List[str]] = None,
+    removed: Optional[List[str]] = None,
+    modified: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    return {
+        "id": commit_id,
+        "message": f"commit {commit_id}",
+        "url": "",
+        "author": None,
+        "committer": None,
+        "verification": None,
+        # the timestamps of a push are often in the same second
+        "timestamp": GITEA_TIME,
+        "added": added or [],
+        "removed": removed or [],
+        "modified": modified or [],
+    }
+
+
+def gitea_push(
+    commits: List[Dict[str, Any]],
+    before: str = "b" * 40,
+    total_commits: Optional[int] = None,
+    branch: str = "master",
+) -> Dict[str, Any]:
+    """A push event of gitea, the newest commit is listed first."""
+    owner = gitea_user()
+    repository = {
+        "id": 1,
+        "owner": owner,
+        "name": GITEA_REPO.split("/")[1],
+        "full_name": GITEA_REPO,
+        "description": "",
+        "empty": False,
+        "private": True,
+        "fork": False,
+        "template": False,
+        "parent": None,
+        "mirror": False,
+        "size": 0,
+        "html_url": "",
+        "ssh_url": "",
+        "clone_url": "",
+        "original_url": "",
+        "website": "",
+        "stars_count": 0,
+        "forks_count": 0,
+        "watchers_count": 0,
+        "open_issues_count": 0,
+        "open_pr_counter": 0,
+        "release_counter": 0,
+        "default_branch": "master",
+        "archived": False,
+        "created_at": GITEA_TIME,
+        "updated_at": GITEA_TIME,
+        "permissions": None,
+        "has_issues": False,
+        "internal_tracker": None,
+        "external_tracker": None,
+        "has_wiki": False,
+        "external_wiki": None,
+        "has_pull_requests": False,
+        "has_projects": False,
+        "ignore_whitespace_conflicts": False,
+        "allow_merge_commits": True,
+        "allow_rebase": True,
+        "allow_rebase_explicit": True,
+        "allow_squash_merge": True,
+        "avatar_url": "",
+        "internal": False,
+        "mirror_interval": "",
+    }
+    return {
+        "ref": f"refs/heads/{branch}",
+        "before": before,
+        "after": commits[0]["id"] if commits else "a" * 40,
+        "compare_url": "",
+        "commits": commits,
+        "total_commits": len(commits) if total_commits is None else total_commits,
+        "head_commit": commits[0] if commits else None,
+        "repository": repository,
+        "pusher": owner,
+        "sender": owner,
+    }
+
+
+@pytest.fixture(scope="module")
+async def problem_editor(
+    global_domain: models.Domain, global_domain_root_user: models.User
+) -> models.User:
+    """A domain root, who can edit the problems but is not a site root."""
+    domain_user = await models.DomainUser.one_or_none(
+        domain_id=global_domain.id, user_id=global_domain_root_user.id
+    )
+    if domain_user is None:
+        domain_user = await models.DomainUser.add_domain_user(
+            global_domain.id, global_domain_root_user.id, DefaultRole.ROOT
+        )
+    domain_user.role = DefaultRole.ROOT
+    await domain_user.save_model()
+    return global_domain_root_user
+
+
+def sign(body: bytes) -> str:
+    return hmac.new(settings.gitea_webhook_secret.encode(), body, sha256).hexdigest()
+
+
+def test_has_all_commits() -> None:
+    commits = [gitea_commit("2" * 40), gitea_commit("1" * 40)]
+    assert GiteaWebhook(**gitea_push(commits)).has_all_commits()
+    # gitea sends at most a limited number of commits in a payload
+    assert not GiteaWebhook(**gitea_push(commits, total_commits=3)).has_all_commits()
+    # a new branch, the commits before the push are unknown
+    webhook = GiteaWebhook(**gitea_push(commits, before=EMPTY_COMMIT_ID))
+    assert not webhook.has_all_commits()
+    assert not GiteaWebhook(**gitea_push([])).has_all_commits()
+
+
+def test_get_changed_paths() -> None:
+    # newest first, all in the same second
+    commits = [
+        gitea_commit("4" * 40, removed=["new.in"], modified=["config.json"]),
+        gitea_commit("3" * 40, added=["new.in", "readded.in"]),
+        gitea_commit("2" * 40, removed=["readded.in", "removed.in"]),
+        gitea_commit("1" * 40, modified=["modified.in"]),
+    ]
+    webhook = GiteaWebhook(**gitea_push(commits))
+    assert webhook.get_changed_paths() == {
+        "modified.in": "modified",
+        "readded.in": "modified",
+        "removed.in": "removed",
+        "config.json": "modified",
+    }
+
+
+@pytest.mark.asyncio
+class TestGiteaWebhook:
+    url_base = "receive_gitea_webhook"
+
+    async def test_invalid_signature(self, client: AsyncClient) -> None:
+        url = app.url_path_for(self.url_base)
+        response = await client.post(
+            url,
+            content=b'{"ref": "refs/heads/master"}',
+            headers={"X-Gitea-Event": "push", "X-Gitea-Signature": "invalid"},
+        )
+        assert response.status_code == 403
+
+    @pytest.mark.depends(on=["TestProblemCreate"])
+    async def test_push(
+        self,
+        client: AsyncClient,
+        global_problem: models.Problem,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        synced: List[str] = []
+
+        async def sync_problem_config(
+            problem: models.Problem, webhook: GiteaWebhook
+        ) -> None:
+            synced.append(f"{problem.id}:{webhook.after}")
+
+        monkeypatch.setattr(settings, "gitea_webhook_secret", "webhook_secret")
+        monkeypatch.setattr(webhooks, "sync_problem_config", sync_problem_config)
+        global_problem.gitea_repo = GITEA_REPO
+        global_problem.gitea_branch = "master"
+        await global_problem.save_model()
+        try:
+            url = app.url_path_for(self.url_base)
+            for branch, expected in (("master", [global_problem]), ("dev", [])):
+                payload = gitea_push([gitea_commit("1" * 40)], branch=branch)
+                body = orjson.dumps(payload)
+                response = await client.post(
+                    url,
+                    content=body,
+                    headers={"X-Gitea-Event": "push", "X-Gitea-Signature": sign(body)},
+                )
+                assert response.status_code == 200
+                res = response.json()["data"]
+                assert [x["id"] for x in res["results"]] == [
+                    str(x.id) for x in expected
+                ]
+            assert synced == [f"{global_problem.id}:{'1' * 40}"]
+        finally:
+            global_problem.gitea_repo = None
+            global_problem.gitea_branch = None
+            await global_problem.save_model()
+
+
+@pytest.mark.asyncio
+async def test_problem_config_lock(monkeypatch: pytest.MonkeyPatch) -> None:
+    resources: List[str] = []
+
+    class LockManager:
+        async def lock(self, resource: str, lock_timeout: int) -> str:
+            resources.append(resource)
+            return resource
+
+        async def unlock(self, lock: str) -> None:
+            resources.append(f"unlock {lock}")
+
+    monkeypatch.setattr(lock, "get_lock_manager", LockManager)
+    # the problem of a request addressed by its url, and of a webhook
+    problem = SimpleNamespace(id=uuid4(), url="webhook_lock")
+    dependency = lock.lock_problem_config(problem)  # type: ignore[arg-type]
+    await dependency.__anext__()
+    await dependency.aclose()
+    async with lock.problem_config_lock(problem.id):
+        pass
+    resource = f"problem:{problem.id}:config"
+    assert resources == [resource, f"unlock {resource}"] * 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.depends(on=["TestProblemCreate"])
+class TestGiteaBinding:
+    url_base = "update_problem"
+
+    @pytest.mark.parametrize(
+        "user,status_code",
+        [
+            (lazy_fixture("problem_editor"), 403),
+            (lazy_fixture("global_root_user"), 200),
+        ],
+    )
+    async def test_bind_gitea_repo(
+        self,
+        client: AsyncClient,
+        user: models.User,
+        status_code: int,
+        global_domain: models.Domain,
+        global_problem: models.Problem,
+    ) -> None:
+        url = app.url_path_for(
+            self.url_base, domain=global_domain.url, problem=global_problem.url
+        )
+        data = {"giteaRepo": GITEA_REPO, "giteaBranch": "master"}
+        response = await do_api_request(client, "PATCH", url, user, data=data)
+        assert response.status_code == status_code
+        await global_problem.refresh_model()
+        assert global_problem.gitea_repo == (GITEA_REPO if status_code == 200 else None)
+        # other fields can still be edited by a problem editor
+        data = {"giteaRepo": None, "giteaBranch": None}
+        response = await do_api_request(client, "PATCH", url, user, data=data)
+        assert response.status_code == status_code
+        data = {"content": global_problem.content}
+        response = await do_api_request(client, "PATCH", url, user, data=data)
+        assert response.status_code == 200
@@ -1,4 +1,7 @@
-from typing import Any, Dict, Optional, Tuple, Union
+import io
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple, Union
 from uuid import UUID
 
 import jwt
@@ -8,9 +11,12 @@ from httpx import AsyncClient, Response
 from loguru import logger
 from pydantic import BaseModel
 from pytest_lazyfixture import lazy_fixture
+from sqlalchemy import event
 
 from joj.horse import apis, models, schemas
 from joj.horse.config import settings
+from joj.horse.services.db import get_db_engine
+from joj.horse.services.lakefs import copy_with_etag
 from joj.horse.utils.errors import ErrorCode
 
 GLOBAL_DOMAIN_COUNT = 3
@@ -34,6 +40,22 @@ def validate_response(
     return res["data"]
 
 
+@contextmanager
+def count_queries() -> Iterator[List[str]]:
+    """Collect the sql statements sent to the database in the block."""
+    statements: List[str] = []
+
+    def before_cursor_execute(*args: Any) -> None:
+        statements.append(args[2])
+
+    engine = get_db_engine().sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 def to_dict(data: Union[Dict[Any, Any], BaseModel]) -> Dict[Any, Any]:
     if isinstance(data, dict):
         return data
@@ -254,6 +276,29 @@ async def validate_test_problem(
     return problem
 
 
+async def create_test_record(
+    problem: models.Problem,
+    committer: models.User,
+    problem_set: Optional[models.ProblemSet] = None,
+    commit_id: str = "commit_0",
+) -> models.Record:
+    problem_config = models.ProblemConfig(
+        problem_id=problem.id,
+        committer_id=committer.id,
+        commit_id=commit_id,
+    )
+    await problem_config.save_model()
+    record = models.Record(
+        domain_id=problem.domain_id,
+        problem_set_id=problem_set.id if problem_set else None,
+        problem_id=problem.id,
+        problem_config_id=problem_config.id,
+        committer_id=committer.id,
+    )
+    await record.save_model()
+    return record
+
+
 def get_base_url(module: Any, **kwargs: Any) -> str:
     s = "/api/v1" + ("/" + module.router_name if module.router_name else "")
     return s.format(**kwargs)
@@ -284,3 +329,34 @@ def validate_user_profile(response: Response, user: models.User) -> None:
     assert res["studentId"] == user.student_id
     assert res["realName"] == user.real_name
     assert res["gravatar"] == user.gravatar
+
+
+class FakeS3:
+    """The objects on a branch, put with the api used by the archive upload."""
+
+    def __init__(self, objects: Dict[str, bytes]) -> None:
+        self.objects = objects
+        self.puts: List[Tuple[str, bytes]] = []
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> None:
+        self.objects[Key] = Body
+        self.puts.append((Key, Body))
+
+    def upload_fileobj(
+        self, Fileobj: IO[bytes], Bucket: str, Key: str, **_: Any
+    ) -> None:
+        self.put_object(Bucket, Key, Fileobj.read())
+
+    def delete_objects(self, Bucket: str, Delete: Dict[str, Any]) -> None:
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"])
+
+    def iter_object_stats(self, prefix: str) -> Iterator[SimpleNamespace]:
+        """The stats of the objects on a branch, like the ls of lakefs."""
+        for key, data in list(self.objects.items()):
+            if key.startswith(prefix):
+                yield SimpleNamespace(
+                    path=key[len(prefix) :],
+                    path_type="object",
+                    checksum=copy_with_etag(io.BytesIO(data)),
+                )
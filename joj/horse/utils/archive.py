@@ -0,0 +1,278 @@
+import io
+import tarfile
+import time
+import zipfile
+from datetime import datetime
+from functools import partial
+from hashlib import sha256
+from pathlib import PurePosixPath
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import orjson
+from joj.elephant.schemas import ArchiveType
+from loguru import logger
+
+from joj.horse.utils.errors import BizError, ErrorCode
+
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+# chunks buffered between the archive writer and the response
+ARCHIVE_QUEUE_SIZE = 16
+
+
+class ArchiveEntry(NamedTuple):
+    path: str
+    size: int
+    modified_at: datetime
+    open: Callable[[], IO[bytes]]
+
+
+class ArchiveStreamClosed(Exception):
+    pass
+
+
+class ArchiveStreamWriter(io.RawIOBase):
+    """
+    An unseekable file passing the written bytes to a queue in large chunks,
+    the writer blocks while the reader is behind.
+    """
+
+    def __init__(self, queue: "Queue[Optional[bytes]]", closed: Event) -> None:
+        super().__init__()
+        self.queue = queue
+        self.reader_closed = closed
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.offset
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        self.buffer += data
+        self.offset += len(data)
+        if len(self.buffer) >= ARCHIVE_CHUNK_SIZE:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def put(self, item: Optional[bytes]) -> None:
+        while True:
+            if self.reader_closed.is_set():
+                raise ArchiveStreamClosed()
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except Full:
+                pass
+
+    def finish(self) -> None:
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+        self.put(None)
+
+
+def write_zip(entries: Iterable[ArchiveEntry], output: IO[bytes]) -> None:
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.path, entry.modified_at.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # a known size decides whether zip64 is used before writing
+            info.file_size = entry.size
+            with entry.open() as src, archive.open(info, "w") as dest:
+                while True:
+                    data = src.read(ARCHIVE_CHUNK_SIZE)
+                    if not data:
+                        break
+                    dest.write(data)
+
+
+def write_tar(entries: Iterable[ArchiveEntry], output: IO[bytes]) -> None:
+    # the stream mode never seeks the output
+    with tarfile.open(fileobj=output, mode="w|gz") as archive:
+        for entry in entries:
+            info = tarfile.TarInfo(entry.path)
+            info.size = entry.size
+            info.mtime = int(entry.modified_at.timestamp())
+            with entry.open() as src:
+                archive.addfile(info, src)
+
+
+def iter_archive(
+    entries: Iterable[ArchiveEntry], archive_type: ArchiveType
+) -> Generator[bytes, None, None]:
+    """
+    Generate an archive of the entries as a stream of chunks. The objects
+    are read and compressed in a thread while the chunks are consumed, so
+    the first bytes are sent at once and nothing is staged on the disk.
+    """
+    if archive_type == ArchiveType.zip:
+        write = write_zip
+    elif archive_type == ArchiveType.tar:
+        write = write_tar
+    else:
+        raise BizError(ErrorCode.FileDownloadError, "archive type not supported!")
+
+    queue: "Queue[Optional[bytes]]" = Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+    closed = Event()
+    errors = []
+
+    def sync_func() -> None:
+        writer = ArchiveStreamWriter(queue, closed)
+        try:
+            write(entries, writer)
+            writer.finish()
+        except ArchiveStreamClosed:
+            pass
+        except Exception as e:
+            logger.exception(e)
+            errors.append(e)
+            try:
+                writer.put(None)
+            except ArchiveStreamClosed:
+                pass
+
+    thread = Thread(target=sync_func, daemon=True)
+    thread.start()
+    start = time.monotonic()
+    try:
+        while True:
+            try:
+                chunk = queue.get(timeout=1)
+            except Empty:
+                if not thread.is_alive():
+                    break
+                continue
+            if chunk is None:
+                break
+            yield chunk
+        if errors:
+            # the response has started, abort the connection instead
+            raise errors[0]
+        logger.info("archive streamed in {:.2f}s", time.monotonic() - start)
+    finally:
+        closed.set()
+
+
+class ArchiveMember(NamedTuple):
+    path: str
+    size: int
+    file: IO[bytes]
+    # open the member again, None if the archive is read as a stream
+    reopen: Optional[Callable[[], IO[bytes]]] = None
+
+
+def normalize_member_path(path: str, strip_components: int = 0) -> Optional[str]:
+    """None if nothing is left after the leading components are stripped."""
+    parts = [part for part in PurePosixPath(path).parts if part not in ("/", ".")]
+    if ".." in parts:
+        raise BizError(ErrorCode.FileValidationError, f"invalid path: {path}")
+    parts = parts[strip_components:]
+    return "/".join(parts) if parts else None
+
+
+def is_archive_streamable(file: IO[bytes]) -> bool:
+    """Whether the archive is a zip or a (compressed) tar read in process."""
+    try:
+        if zipfile.is_zipfile(file):
+            return True
+        file.seek(0)
+        with tarfile.open(fileobj=file, mode="r:*"):
+            return True
+    except tarfile.TarError:
+        return False
+    finally:
+        file.seek(0)
+
+
+def iter_archive_members(
+    file: IO[bytes], strip_components: int = 0
+) -> Iterator[ArchiveMember]:
+    """
+    Read the regular files of a zip or tar archive one by one, a member
+    must be read before the next one is generated. Nothing is extracted to
+    the disk and a tar is read as a stream. Like tar --strip-components,
+    the leading directories of the paths can be stripped.
+    """
+    file.seek(0)
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                path = normalize_member_path(info.filename, strip_components)
+                if path is None:
+                    continue
+                reopen = partial(archive.open, info)
+                with reopen() as member:
+                    yield ArchiveMember(path, info.file_size, member, reopen)
+        return
+    file.seek(0)
+    with tarfile.open(fileobj=file, mode="r|*") as archive:
+        for info in archive:
+            # directories, links and devices are skipped
+            if not info.isfile():
+                continue
+            path = normalize_member_path(info.name, strip_components)
+            if path is None:
+                continue
+            member = archive.extractfile(info)
+            assert member is not None
+            yield ArchiveMember(path, info.size, member)
+
+
+def write_bundle(
+    files: Iterable[Tuple[str, IO[bytes]]], manifest: Dict[str, Any], output: IO[bytes]
+) -> None:
+    """
+    Pack small files (e.g., submitted code) in a tar.gz. manifest.json comes
+    first and lists the path, size and sha256 of the files under files/.
+    """
+    contents = []
+    for filename, file in files:
+        path = normalize_member_path(filename)
+        if path is None:
+            raise BizError(ErrorCode.FileValidationError, "empty file name")
+        contents.append((path, file.read()))
+    manifest = {
+        **manifest,
+        "files": [
+            {"path": path, "size": len(data), "sha256": sha256(data).hexdigest()}
+            for path, data in contents
+        ],
+    }
+    members = [("manifest.json", orjson.dumps(manifest))]
+    members += [(f"files/{path}", data) for path, data in contents]
+    with tarfile.open(fileobj=output, mode="w:gz") as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            archive.addfile(info, io.BytesIO(data))
+
+
+def read_bundle_file(bundle: IO[bytes], filename: str) -> bytes:
+    path = normalize_member_path(filename)
+    with tarfile.open(fileobj=bundle, mode="r|gz") as archive:
+        for info in archive:
+            if info.isfile() and info.name == f"files/{path}":
+                member = archive.extractfile(info)
+                assert member is not None
+                return member.read()
+    raise BizError(ErrorCode.FileDownloadError, f"file not found: {filename}")
@@ -1,10 +1,15 @@
+import csv
+import io
+from datetime import datetime
 from enum import Enum
 from pathlib import Path
 from shutil import rmtree
 from tempfile import mkdtemp
-from typing import Any, Generator, Optional
+from typing import Any, Generator, Iterable, Optional, Sequence
 from uuid import UUID
 
+import orjson
+
 
 class StrEnumMixin(str, Enum):
     def __str__(self) -> str:
@@ -19,6 +24,20 @@ def is_uuid(s: Any) -> bool:
     return True
 
 
+def is_etag_matched(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of the If-None-Match header, as required for GET."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def opaque_tag(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return opaque_tag(etag) in {opaque_tag(x) for x in if_none_match.split(",")}
+
+
 class TemporaryDirectory:
     def __init__(
         self,
@@ -38,6 +57,16 @@ class TemporaryDirectory:
             rmtree(path, ignore_errors=True)
 
 
-def iter_file(file_path: Path) -> Generator[bytes, None, None]:
-    with file_path.open(mode="rb") as fp:
-        yield from fp
+def format_server_sent_event(event: str, data: Any) -> bytes:
+    return b"event: %s\ndata: %s\n\n" % (event.encode(), orjson.dumps(data))
+
+
+def format_csv_rows(rows: Iterable[Sequence[Any]]) -> bytes:
+    """A datetime is formatted by orjson, the same as in a json response."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        [orjson.dumps(x)[1:-1].decode() if isinstance(x, datetime) else x for x in row]
+        for row in rows
+    )
+    return buffer.getvalue().encode()
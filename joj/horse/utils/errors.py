@@ -12,6 +12,7 @@ class ErrorCode(str, Enum):
     IllegalFieldError = "IllegalFieldError"
     IntegrityError = "IntegrityError"
     LockError = "LockError"
+    IdempotencyKeyInUseError = "IdempotencyKeyInUseError"
     # NotFoundError = "NotFoundError"
 
     APINotImplementedError = "APINotImplementedError"
@@ -4,10 +4,12 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi_jwt_auth.exceptions import AuthJWTException
 from loguru import logger
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 
 from joj.horse.schemas.base import StandardErrorResponse
 from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.fastapi.router import NotModified
+from joj.horse.utils.idempotency import IdempotentReplay
 from joj.horse.utils.logger import init_logging  # noqa: F401 lgtm [py/unused-import]
 
 
@@ -37,6 +39,16 @@ async def business_exception_handler(request: Request, exc: BizError) -> JSONRes
     return business_exception_response(exc)
 
 
+async def not_modified_handler(request: Request, exc: NotModified) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=exc.headers)
+
+
+async def idempotent_replay_handler(
+    request: Request, exc: IdempotentReplay
+) -> JSONResponse:
+    return JSONResponse(exc.content, headers={"idempotent-replayed": "true"})
+
+
 async def general_exception_handler(
     request: Request, exc: Exception
 ) -> JSONResponse:  # pragma: no cover
@@ -65,4 +77,6 @@ def register_exception_handlers(app: FastAPI) -> None:
     )
     app.add_exception_handler(RequestValidationError, validation_exception_handler)
     app.add_exception_handler(BizError, business_exception_handler)
+    app.add_exception_handler(NotModified, not_modified_handler)
+    app.add_exception_handler(IdempotentReplay, idempotent_replay_handler)
     app.add_exception_handler(Exception, general_exception_handler)
@@ -0,0 +1,193 @@
+import os
+import stat
+from datetime import datetime
+from email.utils import formatdate
+from hashlib import md5
+from pathlib import Path
+from typing import Any, Dict, Literal, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from starlette.responses import RedirectResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from joj.horse.schemas.base import StandardResponse
+from joj.horse.schemas.misc import Redirect
+
+ZERO_COPY_SEND = "http.response.zerocopysend"
+OBJECT_CHUNK_SIZE = 256 * 1024
+
+
+def get_content_disposition(filename: str) -> str:
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+def get_object_response(obj: Dict[str, Any], filename: str) -> StreamingResponse:
+    """Pass an object got from s3 through, the body is never read as a whole."""
+    return StreamingResponse(
+        obj["Body"].iter_chunks(OBJECT_CHUNK_SIZE),
+        media_type=obj.get("ContentType") or "application/octet-stream",
+        headers={
+            "content-length": str(obj["ContentLength"]),
+            "content-disposition": get_content_disposition(filename),
+        },
+    )
+
+
+def get_presigned_url_response(
+    url: str, response_type: Literal["redirect", "json"]
+) -> Any:
+    if response_type == "json":
+        return StandardResponse(Redirect(redirect_url=url))
+    # 307 keeps the method, so a HEAD request is still a HEAD request
+    return RedirectResponse(url, status_code=307)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header into [start, end) of the file. Only a single byte
+    range is served, None means the whole file should be sent instead.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, sep, last = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:  # suffix range: the last bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size)
+
+
+class RangeFileResponse(Response):
+    """
+    Send a file with the support of a byte range, so an interrupted
+    download is resumed instead of restarted.
+
+    The validators are derived from version (e.g., the commit of a
+    generated archive) and modified_at if given, so they stay the same for
+    the same content even if the file is generated again, otherwise from
+    the stat of the file.
+
+    The file is opened on creation, it can be removed (e.g., evicted from a
+    cache) while being sent. The body is sent with zero copy by the
+    sendfile extension of the ASGI server if supported, otherwise in large
+    chunks read in a thread.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        request: Request,
+        filename: Optional[str] = None,
+        media_type: str = "application/octet-stream",
+        headers: Optional[Dict[str, str]] = None,
+        version: Optional[str] = None,
+        modified_at: Optional[datetime] = None,
+    ) -> None:
+        self.file = open(path, "rb")
+        stat_result = os.fstat(self.file.fileno())
+        assert stat.S_ISREG(stat_result.st_mode)
+        size = stat_result.st_size
+        if version is None:
+            version = str(stat_result.st_mtime)
+        etag = '"{}"'.format(md5(f"{version}-{size}".encode()).hexdigest())
+        if modified_at is not None:
+            mtime = modified_at.timestamp()
+        else:
+            mtime = stat_result.st_mtime
+        last_modified = formatdate(mtime, usegmt=True)
+
+        self.start, self.end = 0, size
+        status_code = 200
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        # a resumed download never mixes the bytes of two versions
+        if range_header and if_range in (None, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                self.file.close()
+                self.start = self.end = 0
+                byte_range = None
+                status_code = 416
+            if byte_range is not None:
+                self.start, self.end = byte_range
+                status_code = 206
+
+        super().__init__(
+            status_code=status_code, headers=headers, media_type=media_type
+        )
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = last_modified
+        self.headers["content-length"] = str(self.end - self.start)
+        if status_code == 206:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end - 1}/{size}"
+        elif status_code == 416:
+            self.headers["content-range"] = f"bytes */{size}"
+        if filename is not None:
+            self.headers["content-disposition"] = get_content_disposition(filename)
+        self.send_body = request.method != "HEAD" and status_code != 416
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        try:
+            if not self.send_body or self.start == self.end:
+                await send({"type": "http.response.body", "body": b""})
+            elif ZERO_COPY_SEND in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": ZERO_COPY_SEND,
+                        "file": self.file.fileno(),
+                        "offset": self.start,
+                        "count": self.end - self.start,
+                        "more_body": False,
+                    }
+                )
+            else:
+                offset = self.start
+                while offset < self.end:
+                    size = min(self.chunk_size, self.end - offset)
+                    chunk = await anyio.to_thread.run_sync(
+                        os.pread, self.file.fileno(), size, offset
+                    )
+                    if not chunk:  # truncated
+                        break
+                    offset += len(chunk)
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": offset < self.end,
+                        }
+                    )
+                if offset < self.end:
+                    await send({"type": "http.response.body", "body": b""})
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
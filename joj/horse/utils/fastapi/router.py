@@ -1,24 +1,95 @@
 import functools
+from hashlib import blake2b
 from inspect import Parameter, signature
-from typing import TYPE_CHECKING, Any, Callable, List, get_type_hints
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Dict, List, get_type_hints
 
-from fastapi import APIRouter as OriginalAPIRouter, Depends, FastAPI
+import orjson
+from fastapi import APIRouter as OriginalAPIRouter, Depends, FastAPI, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.routing import APIRoute
 from loguru import logger
 from pydantic.fields import ModelField
 
 from joj.horse.schemas import BaseModel
 from joj.horse.schemas.permission import PermissionBase
+from joj.horse.utils.base import is_etag_matched
+
+# clients keep an immutable response for a year without revalidation
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
 
 class Detail(BaseModel):
     detail: str
 
 
+class Version:
+    """
+    The version of the resource in a response, e.g., the updated_at of a
+    problem or the commit_id of a problem config. The etag of the response
+    is derived from it, so all parts of the response should be covered.
+    An immutable version never changes for the same url.
+    """
+
+    def __init__(self, *parts: Any, immutable: bool = False) -> None:
+        self.parts = parts
+        self.immutable = immutable
+
+    def get_etag(self, *salt: Any) -> str:
+        data = orjson.dumps(jsonable_encoder([*salt, *self.parts]))
+        return '"{}"'.format(blake2b(data, digest_size=16).hexdigest())
+
+    def get_cache_control(self) -> str:
+        if self.immutable:
+            return f"private, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        return "private, no-cache"
+
+
+class NotModified(Exception):
+    def __init__(self, headers: Dict[str, str]) -> None:
+        self.headers = headers
+
+
+def version_from(
+    dependency: Callable[..., Any], *attributes: str, immutable: bool = False
+) -> Callable[..., Version]:
+    """A version source reading the attributes of a parsed model."""
+
+    def get_version(model: Any = Depends(dependency)) -> Version:
+        return Version(*(getattr(model, x) for x in attributes), immutable=immutable)
+
+    return get_version
+
+
+def conditional_get(
+    version_source: Callable[..., Any]
+) -> Callable[..., Coroutine[Any, Any, None]]:
+    """
+    Set the etag of the response from its version, and answer a matched
+    If-None-Match with 304. It runs as a dependency of the endpoint, and the
+    version source only uses the dependencies (cached by FastAPI in a
+    request) resolved before the handler, so the handler is never run for
+    an unchanged resource.
+    """
+
+    async def check_version(
+        request: Request,
+        response: Response,
+        version: Version = Depends(version_source),
+    ) -> None:
+        etag = version.get_etag(request.app.version)
+        headers = {"etag": etag, "cache-control": version.get_cache_control()}
+        if is_etag_matched(request.headers.get("if-none-match"), etag):
+            raise NotModified(headers)
+        response.headers.update(headers)
+
+    return check_version
+
+
 class APIRouter(OriginalAPIRouter):
     """
     Overrides the route decorator logic to use the annotated return type as the `response_model` if unspecified.
     Parse the permissions in endpoints args and add them to the dependencies.
+    Parse the version source (etag) in endpoints args and add a conditional get dependency.
     """
 
     def _parse_permissions(func: Callable[..., Any]) -> Callable[..., Any]:
@@ -29,11 +100,18 @@ class APIRouter(OriginalAPIRouter):
                 kind=Parameter.POSITIONAL_ONLY,
                 default=None,
                 annotation=List[PermissionBase],
-            )
+            ),
+            Parameter(
+                name="etag",
+                kind=Parameter.POSITIONAL_ONLY,
+                default=None,
+                annotation=Callable[..., Version],
+            ),
         ]
         sig = sig.replace(parameters=parameters)
         func.__signature__ = sig
         func.__annotations__["permissions"] = List[PermissionBase]
+        func.__annotations__["etag"] = Callable[..., Version]
 
         @functools.wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
@@ -44,6 +122,10 @@ class APIRouter(OriginalAPIRouter):
                 new_dependencies = Depends(ensure_permission(permissions))
                 kwargs["dependencies"] = list(kwargs.get("dependencies", []))
                 kwargs["dependencies"].append(new_dependencies)
+            etag = kwargs.pop("etag", None)
+            if etag:
+                kwargs["dependencies"] = list(kwargs.get("dependencies", []))
+                kwargs["dependencies"].append(Depends(conditional_get(etag)))
             return func(*args, **kwargs)
 
         return wrapper
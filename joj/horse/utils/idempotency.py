@@ -0,0 +1,76 @@
+from typing import Any, AsyncGenerator, Optional
+
+from fastapi import Depends, Header, Request
+from fastapi.encoders import jsonable_encoder
+from loguru import logger
+
+from joj.horse.config import settings
+from joj.horse.schemas.cache import get_redis_cache
+from joj.horse.schemas.user import User
+from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.parser import parse_user_from_auth
+
+IDEMPOTENCY_NAMESPACE = "idempotency"
+# the key is released if the worker dies before the response is saved
+IDEMPOTENCY_PROCESSING_TTL = 60
+
+
+class IdempotentReplay(Exception):
+    def __init__(self, content: Any) -> None:
+        self.content = content
+
+
+class Idempotency:
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.saved = False
+
+    async def save(self, response: Any) -> None:
+        await get_redis_cache().set(
+            self.key,
+            {"response": jsonable_encoder(response)},
+            ttl=settings.idempotency_key_ttl,
+            namespace=IDEMPOTENCY_NAMESPACE,
+        )
+        self.saved = True
+
+
+async def parse_idempotency_key(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    user: User = Depends(parse_user_from_auth),
+) -> AsyncGenerator[Optional[Idempotency], None]:
+    """
+    Replay the saved response of a retried request with the same
+    Idempotency-Key header, so it is never applied twice. The key is scoped
+    to the user and the url, the body of the retry is not compared.
+
+    A request in progress holds the key and a concurrent retry gets an
+    error. The key is released unless a response is saved by the endpoint,
+    so a failed request can be retried with the same key.
+    """
+    if idempotency_key is None:
+        yield None
+        return
+    cache = get_redis_cache()
+    key = f"{user.id}:{request.method}:{request.url.path}:{idempotency_key}"
+    try:
+        await cache.add(
+            key,
+            {"response": None},
+            ttl=IDEMPOTENCY_PROCESSING_TTL,
+            namespace=IDEMPOTENCY_NAMESPACE,
+        )
+    except ValueError:  # the key exists
+        value = await cache.get(key, namespace=IDEMPOTENCY_NAMESPACE)
+        if value is not None and value.get("response") is not None:
+            logger.info("idempotency: replay {}", key)
+            raise IdempotentReplay(value["response"])
+        raise BizError(ErrorCode.IdempotencyKeyInUseError, idempotency_key)
+
+    idempotency = Idempotency(key)
+    try:
+        yield idempotency
+    finally:
+        if not idempotency.saved:
+            await cache.delete(key, namespace=IDEMPOTENCY_NAMESPACE)
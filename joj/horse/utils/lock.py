@@ -1,17 +1,21 @@
-from typing import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, AsyncGenerator
+from uuid import UUID
 
 from aioredlock import Lock, LockError
-from fastapi import Path
+from fastapi import Depends, Path
 from loguru import logger
 
+from joj.horse import models
 from joj.horse.services.lock_manager import get_lock_manager
 from joj.horse.utils.errors import BizError, ErrorCode
+from joj.horse.utils.parser import parse_problem
 
 
-async def lock_problem_config(problem: str = Path(...)) -> AsyncGenerator[Lock, None]:
+@asynccontextmanager
+async def redis_lock(resource: str) -> AsyncGenerator[Lock, None]:
     lock_manager = get_lock_manager()
     lock = None
-    resource = f"problem:{problem}:config"
     try:
         logger.debug("redis lock {}", resource)
         lock = await lock_manager.lock(resource, lock_timeout=10)
@@ -25,18 +29,21 @@ async def lock_problem_config(problem: str = Path(...)) -> AsyncGenerator[Lock,
             await lock_manager.unlock(lock)
 
 
+def problem_config_lock(problem_id: UUID) -> AsyncContextManager[Lock]:
+    """
+    Keyed on the id of the problem, never on the url, so every writer of the
+    config (e.g., uploads and webhooks) takes the same lock.
+    """
+    return redis_lock(f"problem:{problem_id}:config")
+
+
+async def lock_problem_config(
+    problem: models.Problem = Depends(parse_problem),
+) -> AsyncGenerator[Lock, None]:
+    async with problem_config_lock(problem.id) as lock:
+        yield lock
+
+
 async def lock_record_judger(record: str = Path(...)) -> AsyncGenerator[Lock, None]:
-    lock_manager = get_lock_manager()
-    lock = None
-    resource = f"record:{record}:judger"
-    try:
-        logger.debug("redis lock {}", resource)
-        lock = await lock_manager.lock(resource, lock_timeout=10)
-        logger.debug("redis locked {}", resource)
+    async with redis_lock(f"record:{record}:judger") as lock:
         yield lock
-    except LockError:
-        raise BizError(ErrorCode.LockError, resource)
-    finally:
-        if lock is not None:
-            logger.debug("redis unlock {}", resource)
-            await lock_manager.unlock(lock)
@@ -4,13 +4,15 @@ from typing import Any, Callable, Coroutine, List, Optional, cast
 from uuid import UUID
 
 from fastapi import Depends, File, Path, Query, UploadFile
-from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.orm import joinedload, selectinload, subqueryload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from joj.horse import models
 from joj.horse.models.permission import PermissionType, ScopeType
 from joj.horse.schemas.auth import Authentication, DomainAuthentication, get_domain
 from joj.horse.schemas.base import NoneEmptyLongStr, NoneNegativeInt, PaginationLimit
 from joj.horse.schemas.query import OrderingQuery, PaginationQuery
+from joj.horse.schemas.record import RecordPreview
 from joj.horse.schemas.user import User, UserID
 from joj.horse.utils.errors import BizError, ErrorCode
 
@@ -154,7 +156,11 @@ def parse_problem_set_factory(
     load_problems: bool = False,
     load_links: bool = False,
 ) -> Callable[..., Coroutine[Any, Any, models.ProblemSet]]:
+    # relationships are loaded with the problem set by selectin loading,
+    # so the number of queries does not depend on the number of problems
     options = []
+    if load_problems:
+        options.append(selectinload(models.ProblemSet.problems))
     if load_links:
         options.append(
             subqueryload(models.ProblemSet.problem_problem_set_links).joinedload(
@@ -167,13 +173,12 @@ def parse_problem_set_factory(
         domain: models.Domain = Depends(parse_domain_from_auth),
         include_hidden: bool = Depends(parse_view_hidden_problem_set),
     ) -> models.ProblemSet:
-        nonlocal load_problems
         problem_set_model = await models.ProblemSet.find_by_domain_url_or_id(
             domain, problem_set, options
         )
         if problem_set_model is None:
             raise BizError(ErrorCode.ProblemSetNotFoundError)
-        if not include_hidden:
+        if load_problems and not include_hidden:
             if (
                 problem_set_model.unlock_at
                 and datetime.utcnow() < problem_set_model.unlock_at
@@ -181,12 +186,9 @@ def parse_problem_set_factory(
                 problem_set_model.lock_at
                 and datetime.utcnow() > problem_set_model.lock_at
             ):
-                load_problems = False
-        if load_problems:
-            await problem_set_model.fetch_related("problems")
-        if problem_set_model:
-            return problem_set_model
-        raise BizError(ErrorCode.ProblemSetNotFoundError)
+                # hide the problems before unlocked or after locked
+                set_committed_value(problem_set_model, "problems", [])
+        return problem_set_model
 
     return wrapped
 
@@ -194,6 +196,29 @@ def parse_problem_set_factory(
 parse_problem_set = parse_problem_set_factory()
 
 
+async def parse_problem_latest_record(
+    problem: models.Problem = Depends(parse_problem),
+    user: User = Depends(parse_user_from_auth),
+) -> Optional[RecordPreview]:
+    return await models.Record.get_user_latest_record(
+        problem_set_id=None, problem_id=problem.id, user_id=user.id
+    )
+
+
+async def parse_problem_set_latest_records(
+    problem_set: models.ProblemSet = Depends(
+        parse_problem_set_factory(load_problems=True)
+    ),
+    user: User = Depends(parse_user_from_auth),
+) -> List[Optional[RecordPreview]]:
+    """The latest records of the user, following problem_set.problems."""
+    return await models.Record.get_user_latest_records(
+        problem_set_id=problem_set.id,
+        problem_ids=[problem.id for problem in problem_set.problems],
+        user_id=user.id,
+    )
+
+
 async def parse_problem_problem_set_link(
     problem_set: models.ProblemSet = Depends(parse_problem_set),
     problem: models.Problem = Depends(parse_problem_without_validation),
@@ -0,0 +1,44 @@
+"""sparse problem positions
+
+Revision ID: 3a7c51f0d2e4
+Revises: bc2df455dd08
+Create Date: 2026-10-19 11:40:27.105338
+
+"""
+import sqlalchemy as sa
+import sqlmodel
+import sqlmodel.sql.sqltypes
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3a7c51f0d2e4"
+down_revision = "bc2df455dd08"
+branch_labels = None
+depends_on = None
+
+PROBLEM_POSITION_GAP = 1024
+
+
+def renumber_positions(start: int, gap: int) -> None:
+    op.execute(
+        f"""
+        UPDATE problem_problem_set_links AS links
+        SET position = {start} + (ranks.rank - 1) * {gap}
+        FROM (
+            SELECT problem_id, problem_set_id, row_number() OVER (
+                PARTITION BY problem_set_id ORDER BY position, problem_id
+            ) AS rank
+            FROM problem_problem_set_links
+        ) AS ranks
+        WHERE links.problem_id = ranks.problem_id
+        AND links.problem_set_id = ranks.problem_set_id
+        """
+    )
+
+
+def upgrade() -> None:
+    renumber_positions(PROBLEM_POSITION_GAP, PROBLEM_POSITION_GAP)
+
+
+def downgrade() -> None:
+    renumber_positions(0, 1)